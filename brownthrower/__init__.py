@@ -5,9 +5,9 @@ import logging
 
 from . import release
 from .engine import Notifications
-from .io import clone_stdout_stderr
+from .io import clone_stdout_stderr, context_stdout_stderr, ring_buffers
 from .model import (InvalidStatusException, TaskNotAvailableException, TokenMismatchException,
-                    tasks, Dependency, Job, Tag)
+                    tasks, Dependency, Job, Tag, TaskStats)
 from .session import (is_serializable_error, retry_on_serializable_error,
                       session_maker, transactional_session)
 from .task import Task
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+
+from brownthrower.examples.misc import Noop
+
+def fanout(size, rng=None):
+    """\
+    Return a superjob which creates size noop subjobs when run.
+    """
+    job = Noop.create_job()
+    job.set_input(size)
+    return [job]
+
+def spread(size, rng=None):
+    """\
+    Return a root job with size children, and a sink depending on all of them.
+    """
+    root = Noop.create_job()
+    sink = Noop.create_job()
+    jobs = [root]
+    for _ in range(size):
+        job = Noop.create_job()
+        job.parents.add(root)
+        sink.parents.add(job)
+        jobs.append(job)
+    
+    jobs.append(sink)
+    return jobs
+
+def chain(size, rng=None):
+    """\
+    Return a chain of size jobs, each one depending on the previous one.
+    """
+    jobs = []
+    for _ in range(size):
+        job = Noop.create_job()
+        if jobs:
+            job.parents.add(jobs[-1])
+        jobs.append(job)
+    
+    return jobs
+
+def reduction(size, rng=None):
+    """\
+    Return a binary reduction of size leaves, as done by the sum4 task.
+    """
+    level = [Noop.create_job() for _ in range(size)]
+    jobs  = list(level)
+    while len(level) > 1:
+        upper = []
+        for i in range(0, len(level) - 1, 2):
+            job = Noop.create_job()
+            job.parents |= set(level[i:i + 2])
+            upper.append(job)
+        
+        jobs.extend(upper)
+        # The odd job out is reduced in the next level
+        level = upper + level[len(upper) * 2:]
+    
+    return jobs
+
+def random_dag(size, rng=None, degree=2, window=100):
+    """\
+    Return a random DAG of size jobs.
+    
+    Each job depends on up to degree jobs picked among the window created just
+    before it, so the DAG is neither too shallow nor a single chain.
+    """
+    rng  = rng or random.Random()
+    jobs = []
+    for i in range(size):
+        job = Noop.create_job()
+        candidates = jobs[max(0, i - window):]
+        if candidates:
+            job.parents |= set(rng.sample(candidates, min(len(candidates), rng.randint(0, degree))))
+        jobs.append(job)
+    
+    return jobs
+
+SHAPES = {
+    'fanout'    : fanout,
+    'spread'    : spread,
+    'chain'     : chain,
+    'reduction' : reduction,
+    'random'    : random_dag,
+}
+
+def generate(shape, size, seed=0):
+    """\
+    Return the jobs of a DAG of the given shape, in topological order.
+    
+    The same seed always yields the same DAG, so results are comparable
+    between runs.
+    """
+    return SHAPES[shape](size, random.Random(seed))
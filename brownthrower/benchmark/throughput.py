@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import brownthrower as bt
+import json
+import logging
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from sqlalchemy import func
+from tabulate import tabulate
+
+from brownthrower import metrics, rusage
+from brownthrower.runner import serial
+
+from . import dags
+
+log = logging.getLogger('brownthrower.benchmark.throughput')
+
+# Statuses of the jobs that a runner may still run
+_PENDING = [bt.Job.Status.QUEUED, bt.Job.Status.RUNNING, bt.Job.Status.STAND_BY]
+
+def _counter(name):
+    return sum(value for _, _, value in metrics.METRICS[name].samples())
+
+def _latency(name, quantiles=(0.5, 0.99)):
+    """\
+    Return the mean and the upper bound of the buckets of the given quantiles
+    of a histogram, in seconds.
+    """
+    buckets = {}
+    total   = 0.0
+    count   = 0
+    for sample, labels, value in metrics.METRICS[name].samples():
+        if sample.endswith('_bucket'):
+            bound = dict(labels)['le']
+            buckets[bound] = buckets.get(bound, 0) + value
+        elif sample.endswith('_sum'):
+            total += value
+        elif sample.endswith('_count'):
+            count += value
+    
+    if not count:
+        return [None] * (len(quantiles) + 1)
+    
+    values = [total / count]
+    for q in quantiles:
+        # Buckets are kept in ascending order of their bounds
+        bound = next(bound for bound, cumulative in buckets.items() if cumulative >= q * count)
+        values.append(float(bound))
+    
+    return values
+
+def _settle(timeout=2.0):
+    """\
+    Wait until the metrics sent by the forked processes have been collected.
+    """
+    deadline = time.time() + timeout
+    last = None
+    while time.time() < deadline:
+        current = _counter('bt_sql_queries_total')
+        if current == last:
+            return
+        last = current
+        time.sleep(0.1)
+
+def _submit(session_maker, shape, size, seed):
+    """\
+    Store and submit the jobs of a DAG, returning the id of the first one.
+    """
+    with bt.transactional_session(session_maker) as session:
+        if session.query(bt.Job).filter(bt.Job.status.in_(_PENDING)).count():
+            raise RuntimeError("The database already has jobs to be run.")
+        
+        jobs = dags.generate(shape, size, seed)
+        session.add_all(jobs)
+        session.flush()
+        
+        # Submitting the sinks first raises each bottom level only once
+        for job in reversed(jobs):
+            job.submit()
+        
+        return min(job.id for job in jobs)
+
+def _statuses(session_maker, first_id):
+    with bt.transactional_session(session_maker) as session:
+        return dict(session.query(
+            bt.Job.status, func.count(bt.Job.id)
+        ).filter(
+            bt.Job.id >= first_id
+        ).group_by(
+            bt.Job.status
+        ).all())
+
+def benchmark(url, shape, size, seed=0, runner_args=()):
+    """\
+    Run a synthetic DAG of noop jobs with a runner and return its results.
+    
+    The runner is configured with the given command line arguments, so the
+    results of different runner modes can be compared.
+    """
+    session_maker = bt.session_maker(url, initialize_db=True)
+    
+    started = time.time()
+    first_id = _submit(session_maker, shape, size, seed)
+    submitted = time.time() - started
+    
+    options = serial._parse_args(['--database-url', url] + list(runner_args))
+    options.pop('verbose')
+    runner_class = serial.SerialRunner
+    if options.pop('event_loop', False):
+        from brownthrower.runner.serial.aio import AsyncRunner as runner_class
+    
+    log_dir = None
+    if not any(arg.startswith('--log-dir') for arg in runner_args):
+        log_dir = options['log_dir'] = tempfile.mkdtemp(prefix='bt_benchmark_')
+    
+    metrics.enable()
+    try:
+        with bt.engine.instrument():
+            runner = runner_class(options)
+            
+            started = time.time()
+            runner.main()
+            elapsed = time.time() - started
+            
+            _settle()
+    finally:
+        if log_dir:
+            shutil.rmtree(log_dir, ignore_errors=True)
+    
+    statuses = _statuses(session_maker, first_id)
+    jobs = sum(statuses.values())
+    claim_mean, claim_p50, claim_p99 = _latency('bt_claim_seconds')
+    
+    return {
+        'timestamp'           : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'database'            : session_maker.bind.url.drivername,
+        'shape'               : shape,
+        'size'                : size,
+        'seed'                : seed,
+        'runner_args'         : ' '.join(runner_args),
+        'jobs'                : jobs,
+        'done'                : statuses.get(bt.Job.Status.DONE, 0),
+        'failed'              : statuses.get(bt.Job.Status.FAILED, 0),
+        'submit_seconds'      : submitted,
+        'run_seconds'         : elapsed,
+        'jobs_per_second'     : jobs / elapsed if elapsed else None,
+        'claim_mean_seconds'  : claim_mean,
+        'claim_p50_seconds'   : claim_p50,
+        'claim_p99_seconds'   : claim_p99,
+        'queries_per_job'     : _counter('bt_sql_queries_total') / jobs if jobs else None,
+        'runner_maxrss_kib'   : rusage.from_struct(resource.getrusage(resource.RUSAGE_SELF))['maxrss'],
+        'children_maxrss_kib' : rusage.from_struct(resource.getrusage(resource.RUSAGE_CHILDREN))['maxrss'],
+    }
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog='benchmark.throughput', add_help=False,
+        description="Run a synthetic DAG of noop jobs and report the throughput of the runner. "
+                    "Unknown arguments are passed to the runner.")
+    parser.add_argument('--database-url', '-u', required=True, metavar='URL',
+        help="run the benchmark on the database at %(metavar)s, which must have no jobs to be run")
+    parser.add_argument('--shape', choices=sorted(dags.SHAPES), default='random',
+        help="shape of the DAG (default: %(default)s)")
+    parser.add_argument('--size', type=int, default=1000, metavar='NUMBER',
+        help="number of jobs, subjobs or leaves of the DAG (default: %(default)s)")
+    parser.add_argument('--seed', type=int, default=0,
+        help="seed of the random DAGs (default: %(default)s)")
+    parser.add_argument('--output', metavar='FILE',
+        help="append the results to %(metavar)s as a JSON line, to compare them between runs")
+    parser.add_argument('--help', '-?', action='help',
+        help='show this help message and exit')
+    
+    return parser.parse_known_args(args)
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+    
+    options, runner_args = _parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    
+    try:
+        results = benchmark(options.database_url, options.shape, options.size, options.seed, runner_args)
+    except RuntimeError as e:
+        log.error(str(e))
+        return 1
+    
+    print(tabulate([
+        [name, '%.4f' % value if isinstance(value, float) else value]
+        for name, value in sorted(results.items())
+    ], headers=['metric', 'value']))
+    
+    if options.output:
+        with open(options.output, 'a') as f:
+            f.write(json.dumps(results, sort_keys=True) + '\n')
+    
+    if results['failed']:
+        return 1
+
+if __name__ == '__main__':
+    sys.exit(main())
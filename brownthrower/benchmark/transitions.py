@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import brownthrower as bt
+import contextlib
+import json
+import logging
+import sys
+import time
+import uuid
+
+from sqlalchemy import event
+from sqlalchemy.orm import Mapper
+from tabulate import tabulate
+
+from brownthrower.examples.misc import Noop
+
+log = logging.getLogger('brownthrower.benchmark.transitions')
+
+class _Probe(object):
+    """\
+    Measure the wall time, queries and ORM instances loaded by some calls.
+    """
+    
+    def __init__(self, stats):
+        self._stats   = stats
+        self._loaded  = 0
+        self.results  = []
+        event.listen(Mapper, 'load', self._on_load)
+    
+    def _on_load(self, target, context):
+        self._loaded += 1
+    
+    def close(self):
+        event.remove(Mapper, 'load', self._on_load)
+    
+    @contextlib.contextmanager
+    def measure(self, name, calls, **params):
+        self._stats.reset()
+        self._loaded = 0
+        
+        started = time.time()
+        with bt.engine.operation(name):
+            yield
+        elapsed = time.time() - started
+        
+        queries = sum(count for count, _, _ in self._stats.snapshot().values())
+        self.results.append(dict(params,
+            operation        = name,
+            calls            = calls,
+            ms_per_call      = 1000 * elapsed / calls,
+            queries_per_call = queries / float(calls),
+            loads_per_call   = self._loaded / float(calls),
+        ))
+
+def _hierarchy(session, subjobs, depth):
+    """\
+    Store a chain of depth nested superjobs, the innermost of which has the
+    given number of subjobs, and return the outermost, the innermost and its
+    subjobs.
+    """
+    top = superjob = Noop.create_job()
+    for _ in range(depth - 1):
+        job = Noop.create_job()
+        superjob._subjobs.add(job)
+        superjob = job
+    
+    leaves = [Noop.create_job() for _ in range(subjobs)]
+    superjob._subjobs |= set(leaves)
+    
+    session.add(top)
+    session.flush()
+    return top, superjob, leaves
+
+def _each(session, jobs, fn):
+    for job in jobs:
+        fn(job)
+        session.flush()
+
+def _lifecycle(probe, session, subjobs, depth, token):
+    """\
+    Time the transitions of the subjobs of a hierarchy that succeeds.
+    """
+    _, innermost, leaves = _hierarchy(session, subjobs, depth)
+    params = dict(subjobs=subjobs, depth=depth)
+    
+    with probe.measure('submit', len(leaves), **params):
+        _each(session, leaves, lambda job: job.submit())
+    
+    with probe.measure('start', len(leaves), **params):
+        _each(session, leaves, lambda job: job._start(token))
+    
+    with probe.measure('update_status', 1, **params):
+        innermost._update_status()
+        session.flush()
+    
+    new_state = {'status' : bt.Job.Status.DONE}
+    with probe.measure('finish', len(leaves), **params):
+        _each(session, leaves, lambda job: job._finish(token, new_state))
+
+def _failure(probe, session, subjobs, depth, token):
+    """\
+    Time the cleanup of the subjobs of a hierarchy that fails.
+    """
+    _, _, leaves = _hierarchy(session, subjobs, depth)
+    _each(session, leaves, lambda job: job.submit())
+    _each(session, leaves, lambda job: job._start(token))
+    
+    with probe.measure('cleanup', len(leaves), subjobs=subjobs, depth=depth):
+        _each(session, leaves, lambda job: job._cleanup("Failed by the benchmark."))
+
+def _abortion(probe, session, subjobs, depth, token):
+    """\
+    Time the abortion of a whole hierarchy from its outermost superjob.
+    """
+    top, _, leaves = _hierarchy(session, subjobs, depth)
+    _each(session, leaves, lambda job: job.submit())
+    
+    with probe.measure('abort', 1, subjobs=subjobs, depth=depth):
+        top.abort()
+        session.flush()
+
+def benchmark(url, subjobs, depths):
+    """\
+    Time the state transitions of the jobs for every combination of number of
+    subjobs and depth of the hierarchy, and return a list of results.
+    
+    Each combination is run on a new database if the URL is an in-memory
+    SQLite one, or else in a transaction which is rolled back.
+    """
+    with bt.engine.instrument() as stats:
+        probe = _Probe(stats)
+        token = uuid.uuid1().hex
+        try:
+            for count in subjobs:
+                for depth in depths:
+                    session_maker = bt.session_maker(url, initialize_db=True)
+                    session = session_maker()
+                    try:
+                        for scenario in [_lifecycle, _failure, _abortion]:
+                            scenario(probe, session, count, depth, token)
+                    finally:
+                        session.rollback()
+                        session.close()
+        finally:
+            probe.close()
+    
+    return probe.results
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog='benchmark.transitions', add_help=False,
+        description="Time the state transitions of the jobs as the number of subjobs and the depth of their hierarchy grow.")
+    parser.add_argument('--database-url', '-u', default='sqlite://', metavar='URL',
+        help="run the benchmark on the database at %(metavar)s (default: in-memory SQLite)")
+    parser.add_argument('--subjobs', '-s', type=int, nargs='+', default=[1, 10, 100], metavar='NUMBER',
+        help="number of subjobs of the innermost superjob (default: 1 10 100)")
+    parser.add_argument('--depth', '-d', type=int, nargs='+', default=[1, 4, 16], metavar='NUMBER',
+        help="number of nested superjobs (default: 1 4 16)")
+    parser.add_argument('--output', metavar='FILE',
+        help="append the results to %(metavar)s as JSON lines, to compare them between runs")
+    parser.add_argument('--help', '-?', action='help',
+        help='show this help message and exit')
+    
+    return parser.parse_args(args)
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+    
+    options = _parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    
+    results = benchmark(options.database_url, options.subjobs, options.depth)
+    
+    columns = ['operation', 'subjobs', 'depth', 'calls', 'ms_per_call', 'queries_per_call', 'loads_per_call']
+    print(tabulate([
+        [result[column] for column in columns]
+        for result in sorted(results, key=lambda result: (result['operation'], result['subjobs'], result['depth']))
+    ], floatfmt='.3f', headers=columns))
+    
+    if options.output:
+        timestamp = time.strftime('%Y-%m-%dT%H:%M:%S')
+        with open(options.output, 'a') as f:
+            for result in results:
+                f.write(json.dumps(dict(result, timestamp=timestamp), sort_keys=True) + '\n')
+
+if __name__ == '__main__':
+    sys.exit(main())
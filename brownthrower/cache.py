@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import copy
+import hashlib
+import logging
+import threading
+import yaml
+
+log = logging.getLogger('brownthrower.cache')
+
+class OutputCache(object):
+    """\
+    Bounded LRU cache of the parsed output of finished jobs.
+    
+    Entries are keyed by job id and remember the digest of the serialized
+    output they were parsed from. The cache is limited by the accumulated size
+    of the serialized outputs, evicting the least recently used entries first.
+    A cache with a capacity of 0 bytes is disabled. It may be shared by the
+    threads of a process.
+    """
+    
+    def __init__(self, max_bytes=0):
+        self._max_bytes = max_bytes
+        self._size      = 0
+        self._entries   = collections.OrderedDict()
+        self.hits       = 0
+        self.misses     = 0
+        self._lock      = threading.RLock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def __contains__(self, job_id):
+        return job_id in self._entries
+    
+    @property
+    def enabled(self):
+        return self._max_bytes > 0
+    
+    @property
+    def size(self):
+        return self._size
+    
+    @staticmethod
+    def digest(raw):
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    
+    def resize(self, max_bytes):
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+    
+    def _evict(self):
+        while self._size > self._max_bytes:
+            _, (_, size, _) = self._entries.popitem(last=False)
+            self._size -= size
+    
+    def put(self, job_id, raw):
+        """\
+        Store the serialized output of a finished job.
+        """
+        if not self.enabled or raw is None:
+            return
+        
+        size = len(raw)
+        if size > self._max_bytes:
+            return
+        
+        digest = self.digest(raw)
+        with self._lock:
+            entry = self._entries.get(job_id)
+            if entry and entry[0] == digest:
+                self._entries.move_to_end(job_id)
+                return
+        
+        value = yaml.safe_load(raw)
+        with self._lock:
+            self.invalidate(job_id)
+            self._entries[job_id] = (digest, size, value)
+            self._size += size
+            self._evict()
+    
+    def get(self, job_id):
+        """\
+        Return a copy of the output of the given job.
+        
+        Raises KeyError if the output is not available in the cache.
+        """
+        with self._lock:
+            try:
+                _, _, value = self._entries[job_id]
+            except KeyError:
+                self.misses += 1
+                raise
+            
+            self.hits += 1
+            self._entries.move_to_end(job_id)
+        
+        return copy.deepcopy(value)
+    
+    def invalidate(self, job_id):
+        with self._lock:
+            entry = self._entries.pop(job_id, None)
+            if entry:
+                self._size -= entry[1]
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+outputs = OutputCache()
+"""Cache of job outputs shared by the whole process. Disabled by default."""
@@ -1,27 +1,124 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import contextlib
+import contextvars
+import hashlib
+import json
 import logging
+import os
+import re
+import threading
+import time
 import trunk
 
+from functools import wraps
+
 from sqlalchemy import event
-from sqlalchemy.engine import create_engine as sa_create_engine
+from sqlalchemy.engine import Engine, create_engine as sa_create_engine
+
+from . import metrics
 
 log = logging.getLogger('brownthrower.engine')
 
+# Operation to which the queries being run are attributed
+_operation = contextvars.ContextVar('bt_operation', default=None)
+
+# Queries not run inside any operation
+OTHER = 'other'
+
+# Environment variable overriding the namespace of the notification channels
+NAMESPACE_VARIABLE = 'BT_NAMESPACE'
+
+# Namespaces used verbatim in the channel names, which PostgreSQL limits to 63
+# bytes. The longest one adds 30 bytes to the namespace.
+NAMESPACE_PATTERN = re.compile(r'^[a-z0-9_]{1,32}$')
+
+# Maximum size of a notification payload, below the 8000 bytes allowed by PostgreSQL
+MAX_PAYLOAD = 7900
+
+def encode(items):
+    """\
+    Return the JSON arrays carrying the given items, as few as needed to keep
+    each one below MAX_PAYLOAD.
+    """
+    payloads = []
+    chunk    = []
+    size     = 2
+    for item in items:
+        text = json.dumps(item, separators=(',', ':'))
+        if chunk and size + len(text) + 1 > MAX_PAYLOAD:
+            payloads.append('[%s]' % ','.join(chunk))
+            chunk = []
+            size  = 2
+        chunk.append(text)
+        size += len(text) + 1
+    
+    if chunk:
+        payloads.append('[%s]' % ','.join(chunk))
+    
+    return payloads
+
+def decode(payload):
+    """\
+    Return the list of items carried by a notification payload.
+    """
+    return json.loads(payload)
+
+def _digest(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()[:8]
+
+def _namespace(text):
+    """\
+    Return the namespace to use in the channel names: the given one if it is
+    short and safe enough, or else its digest.
+    """
+    if NAMESPACE_PATTERN.match(text):
+        return text
+    
+    namespace = _digest(text)
+    log.debug("Using namespace %s instead of %r for the notification channels." % (namespace, text))
+    return namespace
+
 class _Channel(object):
-    def __init__(self, session):
-        self._hash = hex(hash(session.bind.url))[2:]
+    """\
+    Names of the notification channels of a database.
+    
+    Names are suffixed with a namespace, so every process using the same
+    database computes the same ones. It is taken from the BT_NAMESPACE
+    environment variable or else derived from the name of the database.
+    Namespaces longer than 32 characters or with characters other than lower
+    case letters, digits and underscores are replaced by their digest. The job
+    channels are also split by task, see :meth:`for_task`.
+    """
+    
+    def __init__(self, session, namespace=None):
+        namespace = namespace or os.environ.get(NAMESPACE_VARIABLE)
+        if namespace:
+            self._namespace = _namespace(namespace)
+        else:
+            self._namespace = _digest(session.bind.url.database or '')
         
-        self._job_create        = 'bt_job_create_%s'        % self._hash
-        self._job_update        = 'bt_job_update_%s'        % self._hash
-        self._job_delete        = 'bt_job_delete_%s'        % self._hash
-        self._dependency_create = 'bt_dependency_create_%s' % self._hash
-        self._dependency_update = 'bt_dependency_update_%s' % self._hash
-        self._dependency_delete = 'bt_dependency_delete_%s' % self._hash
-        self._tag_create        = 'bt_tag_create_%s'        % self._hash
-        self._tag_update        = 'bt_tag_update_%s'        % self._hash
-        self._tag_delete        = 'bt_tag_delete_%s'        % self._hash
+        self._job_create        = 'bt_job_create_%s'        % self._namespace
+        self._job_update        = 'bt_job_update_%s'        % self._namespace
+        self._job_delete        = 'bt_job_delete_%s'        % self._namespace
+        self._job_runnable      = 'bt_job_runnable_%s'      % self._namespace
+        self._dependency_create = 'bt_dependency_create_%s' % self._namespace
+        self._dependency_update = 'bt_dependency_update_%s' % self._namespace
+        self._dependency_delete = 'bt_dependency_delete_%s' % self._namespace
+        self._tag_create        = 'bt_tag_create_%s'        % self._namespace
+        self._tag_update        = 'bt_tag_update_%s'        % self._namespace
+        self._tag_delete        = 'bt_tag_delete_%s'        % self._namespace
+    
+    @property
+    def namespace(self):
+        return self._namespace
+    
+    def for_task(self, channel, name):
+        """\
+        Return the channel carrying only the notifications of the jobs of a task.
+        """
+        return '%s_%s' % (channel, _digest(name))
     
     @property
     def job_create(self):
@@ -35,6 +132,10 @@ class _Channel(object):
     def job_delete(self):
         return self._job_delete
     
+    @property
+    def job_runnable(self):
+        return self._job_runnable
+    
     @property
     def dependency_create(self):
         return self._dependency_create
@@ -65,6 +166,7 @@ class _Channel(object):
             self.job_create,
             self.job_update,
             self.job_delete,
+            self.job_runnable,
         ])
     
     @property
@@ -86,9 +188,9 @@ class _Channel(object):
     @property
     def all_channels(self):
         return set.union(
-            self.all_job_channels(),
-            self.all_dependency_channels(),
-            self.all_tag_channels(),
+            self.all_job_channels,
+            self.all_dependency_channels,
+            self.all_tag_channels,
         )
 
 class Notifications(trunk.Trunk):
@@ -121,46 +223,55 @@ class Notifications(trunk.Trunk):
             }
         )
     
+    def notify_all(self, channel, items):
+        for payload in encode(items):
+            self.notify(channel, payload)
+    
     ###########################################################################
     # Methods for SENDING notifications                                       #
     ###########################################################################
     
     def job_create(self, job_id):
-        self.notify(self.channel.job_create, str(job_id))
+        self.notify_all(self.channel.job_create, [job_id])
         
     def job_update(self, job_id):
-        self.notify(self.channel.job_update, str(job_id))
+        self.notify_all(self.channel.job_update, [job_id])
         
     def job_delete(self, job_id):
-        self.notify(self.channel.job_delete, str(job_id))
+        self.notify_all(self.channel.job_delete, [job_id])
+    
+    def job_runnable(self, job_id, name):
+        self.notify_all(self.channel.job_runnable, [[job_id, name]])
     
     def dependency_create(self, parent_id, child_id):
-        payload = "%d,%d" % (parent_id, child_id)
-        self.notify(self.channel.dependency_create, payload)
+        self.notify_all(self.channel.dependency_create, [[parent_id, child_id]])
         
     def dependency_update(self, parent_id, child_id):
-        payload = "%d,%d" % (parent_id, child_id)
-        self.notify(self.channel.dependency_update, payload)
+        self.notify_all(self.channel.dependency_update, [[parent_id, child_id]])
         
     def dependency_delete(self, parent_id, child_id):
-        payload = "%d,%d" % (parent_id, child_id)
-        self.notify(self.channel.dependency_delete, payload)
+        self.notify_all(self.channel.dependency_delete, [[parent_id, child_id]])
     
     def tag_create(self, job_id):
-        self.notify(self.channel.tag_create, str(job_id))
+        self.notify_all(self.channel.tag_create, [job_id])
         
     def tag_update(self, job_id):
-        self.notify(self.channel.tag_update, str(job_id))
+        self.notify_all(self.channel.tag_update, [job_id])
         
     def tag_delete(self, job_id):
-        self.notify(self.channel.tag_delete, str(job_id))
+        self.notify_all(self.channel.tag_delete, [job_id])
     
     ###########################################################################
     # Methods for setting CALLBACKS to notifications                          #
     ###########################################################################
     
     def _set_callback(self, channel, fn):
-        self._callbacks[channel] = fn
+        # Each notification carries a batch of items
+        def wrapped_fn(payload):
+            for item in decode(payload):
+                fn(item)
+        
+        self._callbacks[channel] = wrapped_fn
         self.listen(channel)
     
     def on_job_create(self, fn):
@@ -172,16 +283,20 @@ class Notifications(trunk.Trunk):
     def on_job_delete(self, fn):
         self._set_callback(self.channel.job_delete, fn)
     
+    def on_job_runnable(self, fn):
+        wrapped_fn = lambda item: fn(*item)
+        self._set_callback(self.channel.job_runnable, wrapped_fn)
+    
     def on_dependency_create(self, fn):
-        wrapped_fn = lambda payload: fn(*payload.split(','))
+        wrapped_fn = lambda item: fn(*item)
         self._set_callback(self.channel.dependency_create, wrapped_fn)
     
     def on_dependency_update(self, fn):
-        wrapped_fn = lambda payload: fn(*payload.split(','))
+        wrapped_fn = lambda item: fn(*item)
         self._set_callback(self.channel.dependency_update, wrapped_fn)
     
     def on_dependency_delete(self, fn):
-        wrapped_fn = lambda payload: fn(*payload.split(','))
+        wrapped_fn = lambda item: fn(*item)
         self._set_callback(self.channel.dependency_delete, wrapped_fn)
     
     def on_tag_create(self, fn):
@@ -216,6 +331,109 @@ class Notifications(trunk.Trunk):
         except trunk.Empty:
             raise StopIteration
 
+###############################################################################
+# SQL INSTRUMENTATION                                                         #
+###############################################################################
+
+@contextlib.contextmanager
+def operation(name):
+    """\
+    Attribute the queries run in this block to an operation.
+    
+    Operations may be nested, and queries are attributed to the innermost one.
+    """
+    token = _operation.set(name)
+    try:
+        yield
+    finally:
+        _operation.reset(token)
+
+def instrumented(name):
+    """\
+    Decorator that attributes the queries run by a function to an operation.
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with operation(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class QueryStats(object):
+    """\
+    Count and time the queries run by each operation in this process.
+    
+    Queries slower than slow_query seconds are logged with their statement.
+    Each query is also recorded in the ``bt_sql_queries_total`` and
+    ``bt_sql_seconds`` metrics, which gather those of the forked processes.
+    """
+    
+    def __init__(self, slow_query=None):
+        self._slow_query = slow_query
+        self._lock       = threading.Lock()
+        self._stats      = {}
+    
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        context._bt_started = time.time()
+    
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.time() - context._bt_started
+        name = _operation.get() or OTHER
+        
+        with self._lock:
+            count, total, slowest = self._stats.get(name, (0, 0.0, 0.0))
+            self._stats[name] = (count + 1, total + elapsed, max(slowest, elapsed))
+        
+        metrics.inc('bt_sql_queries_total', operation=name)
+        metrics.observe('bt_sql_seconds', elapsed, operation=name)
+        
+        if self._slow_query is not None and elapsed >= self._slow_query:
+            log.warning("Slow query (%.3f s) in operation «%s»: %s" % (elapsed, name, ' '.join(statement.split())))
+    
+    def snapshot(self):
+        """\
+        Return a dict with the count, total time and slowest time of the
+        queries of each operation.
+        """
+        with self._lock:
+            return dict(self._stats)
+    
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+    
+    def _listen(self):
+        event.listen(Engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', self._after_cursor_execute)
+    
+    def remove(self):
+        """\
+        Stop counting the queries, removing the listeners of the engines.
+        """
+        if event.contains(Engine, 'before_cursor_execute', self._before_cursor_execute):
+            event.remove(Engine, 'before_cursor_execute', self._before_cursor_execute)
+            event.remove(Engine, 'after_cursor_execute', self._after_cursor_execute)
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.remove()
+
+def instrument(slow_query=None):
+    """\
+    Start counting and timing the queries of every engine, and return the
+    :class:`QueryStats` collecting them.
+    
+    The stats can be used as a context manager, which stops counting the
+    queries on exit. Otherwise, call :meth:`QueryStats.remove`.
+    """
+    stats = QueryStats(slow_query)
+    stats._listen()
+    
+    return stats
+
 def _sqlite_connection_begin_listener(conn):
     if conn.engine.name == 'sqlite':
         log.debug("Fixing SQLite stupid implementation.")
@@ -225,12 +443,15 @@ def _sqlite_connection_begin_listener(conn):
         # This is needed to emulate FOR UPDATE locks :(
         conn.execute("BEGIN EXCLUSIVE")
 
-def create_engine(url):
+def create_engine(url, pool_size=None):
     if url.drivername == 'sqlite':
         # Disable automatic transaction handling to workaround faulty nested transactions
         engine = sa_create_engine(url, connect_args={'isolation_level':None})
         event.listen(engine, 'begin', _sqlite_connection_begin_listener)
     else:
-        engine = sa_create_engine(url, isolation_level="REPEATABLE READ")
+        kwargs = {}
+        if pool_size:
+            kwargs['pool_size'] = pool_size
+        engine = sa_create_engine(url, isolation_level="REPEATABLE READ", **kwargs)
     
     return engine
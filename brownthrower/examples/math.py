@@ -33,6 +33,8 @@ class Add2(bt.Task):
     
     _bt_name = 'add2'
     
+    bundle_size = 20
+    
     @classmethod
     def run(cls, job):
         inp = job.get_input()
@@ -12,10 +12,40 @@ class Pipe(bt.Task):
     
     _bt_name = 'pipe'
     
+    bundle_size = 20
+    
     @classmethod
     def run(cls, job):
         return job.get_input()
 
+class Noop(bt.Task):
+    """\
+    Do nothing.
+    
+    Example task that returns no output, used to measure the overhead of
+    running a job. If its input is a positive integer, it creates that amount
+    of noop subjobs instead.
+    
+    Example input: 100
+    """
+    
+    _bt_name = 'noop'
+    
+    @classmethod
+    def prolog(cls, job):
+        count = job.get_input()
+        if not isinstance(count, int) or count <= 0:
+            return
+        
+        for _ in range(count):
+            subjob = Noop.create_job()
+            subjob.submit()
+            job.new_subjobs.add(subjob)
+    
+    @classmethod
+    def run(cls, job):
+        pass
+
 class Sleep(bt.Task):
     """\
     Sleep an determined amount of seconds.
@@ -1,33 +1,257 @@
+import collections
+import contextvars
+import logging
 import os
-import subprocess
 import sys
+import threading
 
 from contextlib import contextmanager
 
-@contextmanager
-def clone_stdout_stderr(stdout_fname, stderr_fname):
-    sys.stdout.flush()
-    sys.stderr.flush()
+log = logging.getLogger('brownthrower.io')
+
+# Size of the chunks read from the pipes of the output pumps
+PUMP_BUFSIZE = 64 * 2**10
+
+# Seconds to wait for an output pump to drain its pipe when a job ends
+PUMP_TIMEOUT = 5
+
+# Streams where the output of the current context is written
+_streams = contextvars.ContextVar('bt_streams', default=None)
+_install_lock = threading.Lock()
+
+class RingBuffer(object):
+    """\
+    Keep only the last bytes written into it, up to the given size.
+    
+    Used to remember the tail of the output of a job without reading back its
+    log files. Text is stored encoded as UTF-8.
+    """
+    
+    def __init__(self, size):
+        self._size   = size
+        self._chunks = collections.deque()
+        self._length = 0
+        self._lock   = threading.Lock()
+    
+    @property
+    def size(self):
+        return self._size
+    
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8', 'replace')
+        
+        data = data[-self._size:]
+        with self._lock:
+            self._chunks.append(data)
+            self._length += len(data)
+            while self._length - len(self._chunks[0]) >= self._size:
+                self._length -= len(self._chunks.popleft())
+        
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def getvalue(self):
+        with self._lock:
+            return b''.join(self._chunks)[-self._size:]
+
+def ring_buffers(size):
+    """\
+    Return ring buffers for the stdout ('out') and stderr ('err') of a job, or
+    an empty dict if the size is zero.
+    """
+    if not size:
+        return {}
+    
+    return {'out' : RingBuffer(size), 'err' : RingBuffer(size)}
+
+class ContextStream(object):
+    """\
+    File-like object that writes to the streams of the current context.
+    
+    Outside of any :func:`context_stdout_stderr` block, data is written to the
+    original stream. This allows several jobs running in threads or coroutines
+    of the same process to keep their outputs apart.
+    """
+    
+    def __init__(self, name, default):
+        self._name    = name
+        self._default = default
+    
+    def _targets(self):
+        streams = _streams.get()
+        if streams is None:
+            return [self._default]
+        return streams[self._name]
     
-    # Disable buffering 
-    sys.stdout = os.fdopen(sys.stdout.fileno(), 'w')
-    sys.stderr = os.fdopen(sys.stderr.fileno(), 'w')
+    def write(self, data):
+        for target in self._targets():
+            target.write(data)
+        return len(data)
     
-    tee_stdout = subprocess.Popen(['tee', stdout_fname], stdin=subprocess.PIPE)
-    tee_stderr = subprocess.Popen(['tee', stderr_fname], stdin=subprocess.PIPE, stdout=sys.stderr)
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
     
-    with os.fdopen(os.dup(sys.stdout.fileno()), 'w') as stdout:
-        with os.fdopen(os.dup(sys.stderr.fileno()), 'w') as stderr:
-            os.dup2(tee_stdout.stdin.fileno(), sys.stdout.fileno())
-            os.dup2(tee_stderr.stdin.fileno(), sys.stderr.fileno())
+    def flush(self):
+        for target in self._targets():
+            target.flush()
+    
+    def __getattr__(self, name):
+        return getattr(self._default, name)
+
+def _stream_handlers():
+    loggers = [logging.getLogger()] + list(logging.Logger.manager.loggerDict.values())
+    for logger in loggers:
+        # Placeholders of loggers not created yet have no handlers
+        for handler in getattr(logger, 'handlers', []):
+            if isinstance(handler, logging.StreamHandler):
+                yield handler
+
+def _install_context_streams():
+    """\
+    Replace sys.stdout and sys.stderr by context streams, also in the logging
+    handlers that were writing to them, so logging calls made while running a
+    job reach its logs.
+    """
+    with _install_lock:
+        for name in ['stdout', 'stderr']:
+            stream = getattr(sys, name)
+            if isinstance(stream, ContextStream):
+                continue
+            
+            context = ContextStream(name, stream)
+            setattr(sys, name, context)
+            for handler in _stream_handlers():
+                if handler.stream is stream:
+                    handler.setStream(context)
+
+@contextmanager
+def context_stdout_stderr(stdout_fname, stderr_fname, console=True, tails=None):
+    """\
+    Copy everything written to sys.stdout and sys.stderr in the current context
+    (thread or coroutine) into the given files, and into the ring buffers in
+    tails, as returned by :func:`ring_buffers`, if any.
+    
+    Unlike :func:`clone_stdout_stderr`, the file descriptors are left untouched,
+    so output written directly to them, such as that of subprocesses, is not
+    captured. Logging handlers writing to sys.stdout or sys.stderr are
+    redirected as well.
+    """
+    _install_context_streams()
+    
+    with open(stdout_fname, 'w', buffering=1) as stdout:
+        with open(stderr_fname, 'w', buffering=1) as stderr:
+            streams = {'stdout' : [stdout], 'stderr' : [stderr]}
+            if console:
+                streams['stdout'].append(sys.stdout._default)
+                streams['stderr'].append(sys.stderr._default)
+            if tails:
+                streams['stdout'].append(tails['out'])
+                streams['stderr'].append(tails['err'])
+            
+            token = _streams.set(streams)
             try:
                 yield
             finally:
-                sys.stdout.flush()
-                sys.stderr.flush()
-                os.dup2(stdout.fileno(), sys.stdout.fileno())
-                os.dup2(stderr.fileno(), sys.stderr.fileno())
-                tee_stdout.terminate()
-                tee_stderr.terminate()
-                tee_stdout.wait()
-                tee_stderr.wait()
+                _streams.reset(token)
+
+class _Pump(object):
+    """\
+    Copy everything written to a file descriptor into a file.
+    
+    In console mode, the descriptor is redirected to a pipe, which is drained
+    by a thread that writes the data both to the file and to the original
+    destination of the descriptor. Otherwise, the descriptor is just redirected
+    to the file, without copying any data, and the tail kept by the ring
+    buffer, if any, is read back from the file when closed.
+    """
+    
+    def __init__(self, fd, fname, console=True, ring=None):
+        self._fd      = fd
+        self._saved   = os.dup(fd)
+        self._file    = os.open(fname, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        self._console = console
+        self._ring    = ring
+        self._thread  = None
+        
+        if console:
+            r, w = os.pipe()
+            os.dup2(w, fd)
+            os.close(w)
+            self._thread = threading.Thread(target=self._pump, args=(r,), name='bt_pump_%d' % fd)
+            self._thread.daemon = True
+            self._thread.start()
+        else:
+            os.dup2(self._file, fd)
+    
+    @staticmethod
+    def _write(fd, data):
+        while data:
+            data = data[os.write(fd, data):]
+    
+    def _pump(self, r):
+        console = self._console
+        try:
+            while True:
+                data = os.read(r, PUMP_BUFSIZE)
+                if not data:
+                    break
+                
+                self._write(self._file, data)
+                if self._ring:
+                    self._ring.write(data)
+                if console:
+                    try:
+                        self._write(self._saved, data)
+                    except OSError:
+                        # Keep logging into the file if the console goes away
+                        console = False
+        finally:
+            os.close(r)
+            os.close(self._file)
+            os.close(self._saved)
+    
+    def close(self):
+        os.dup2(self._saved, self._fd)
+        
+        if not self._thread:
+            if self._ring:
+                end = os.fstat(self._file).st_size
+                self._ring.write(os.pread(self._file, self._ring.size, max(end - self._ring.size, 0)))
+            os.close(self._file)
+            os.close(self._saved)
+            return
+        
+        # Subprocesses still holding the pipe would block the pump forever
+        self._thread.join(PUMP_TIMEOUT)
+        if self._thread.is_alive():
+            log.warning("Output of descriptor %d is still being written after the job ended." % self._fd)
+
+@contextmanager
+def clone_stdout_stderr(stdout_fname, stderr_fname, console=True, tails=None):
+    """\
+    Copy everything written to the stdout and stderr file descriptors into the
+    given files, including the output of subprocesses.
+    
+    If console is False, the output is only written to the files. The ring
+    buffers in tails, as returned by :func:`ring_buffers`, if any, keep the
+    last part of each stream.
+    """
+    tails = tails or {}
+    sys.stdout.flush()
+    sys.stderr.flush()
+    
+    stdout = _Pump(sys.stdout.fileno(), stdout_fname, console, tails.get('out'))
+    try:
+        stderr = _Pump(sys.stderr.fileno(), stderr_fname, console, tails.get('err'))
+        try:
+            yield
+        finally:
+            sys.stderr.flush()
+            stderr.close()
+    finally:
+        sys.stdout.flush()
+        stdout.close()
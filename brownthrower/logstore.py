@@ -0,0 +1,392 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import fcntl
+import glob
+import gzip
+import hashlib
+import io
+import logging
+import os
+import shutil
+import zlib
+
+from . import utils
+
+log = logging.getLogger('brownthrower.logstore')
+
+# Streams captured from the output of each job
+STREAMS = ['out', 'err']
+
+# Stacks sampled while running a job, in collapsed (flamegraph) format
+STACKS = 'stacks'
+
+# Snapshots of the memory allocations of a job
+MEMORY = 'memory'
+
+# Every stream that may be stored for a job
+ALL_STREAMS = STREAMS + [STACKS, MEMORY]
+
+# Size of the chunks read when looking for the tail of a compressed log
+TAIL_CHUNK = 2**20
+
+# Size of the chunks copied when appending a log into a segment
+COPY_CHUNK = 2**20
+
+class FlatLogStore(object):
+    """\
+    Keep the logs of each job in a pair of files in a single directory.
+    
+    Every log storage writes the output of a running job into the files
+    returned by :meth:`paths`, which are moved into their final location by
+    :meth:`commit` once the job has ended.
+    """
+    
+    layout = 'flat'
+    
+    def __init__(self, root, compress=False):
+        self._root     = root
+        self._compress = compress
+    
+    @property
+    def root(self):
+        return self._root
+    
+    def _path(self, job_id, stream):
+        return os.path.join(self._root, '{0}.{1}'.format(job_id, stream))
+    
+    def path(self, job_id, stream):
+        """\
+        Return the file where a stream of a job must be written.
+        """
+        path = self._path(job_id, stream)
+        utils.makedirs(os.path.dirname(path))
+        return path
+    
+    def paths(self, job_id):
+        """\
+        Return the files where the stdout and stderr of a job must be written.
+        """
+        return tuple(self.path(job_id, stream) for stream in STREAMS)
+    
+    def commit(self, job_id):
+        """\
+        Store the logs of a job that has ended.
+        """
+        if not self._compress:
+            return
+        
+        for stream in ALL_STREAMS:
+            path = self._path(job_id, stream)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as src:
+                with gzip.open(path + '.gz', 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+            os.unlink(path)
+    
+    def location(self, job_id):
+        """\
+        Return a string which allows :func:`read` to find the logs of a job.
+        """
+        return '{0}:{1}'.format(self.layout, os.path.abspath(self._root))
+    
+    def open(self, job_id, stream='out'):
+        """\
+        Return a binary file object to read a log of a job.
+        
+        Raises KeyError if the log cannot be found.
+        """
+        # A job run again writes a new log, while the compressed one is older
+        path = self._path(job_id, stream)
+        try:
+            return open(path, 'rb')
+        except IOError:
+            pass
+        
+        try:
+            return gzip.open(path + '.gz', 'rb')
+        except IOError:
+            raise KeyError(job_id)
+    
+    def read(self, job_id, stream='out'):
+        """\
+        Return the contents of a log of a job, as bytes.
+        
+        Raises KeyError if the log cannot be found.
+        """
+        with self.open(job_id, stream) as f:
+            return f.read()
+
+class ShardedLogStore(FlatLogStore):
+    """\
+    Keep the logs of each job in a tree of subdirectories.
+    
+    Jobs are spread among 65536 directories named after the hash of their id,
+    so no directory grows too large even with millions of jobs.
+    """
+    
+    layout = 'sharded'
+    
+    def _path(self, job_id, stream):
+        digest = hashlib.md5(str(job_id).encode('ascii')).hexdigest()
+        return os.path.join(self._root, digest[0:2], digest[2:4], '{0}.{1}'.format(job_id, stream))
+
+class SegmentLogStore(FlatLogStore):
+    """\
+    Append the logs of all the jobs of a runner into a single segment file.
+    
+    Logs are written into temporary files while the job runs, and appended
+    into the segment when it ends, optionally compressed. An index file next to
+    the segment records the offset and length of each log, so small logs do not
+    need a file of their own. Several processes may share the same segment.
+    """
+    
+    layout = 'segment'
+    
+    def __init__(self, root, compress=False, name='segment'):
+        super(SegmentLogStore, self).__init__(root, compress)
+        self._name = name
+    
+    def _path(self, job_id, stream):
+        return os.path.join(self._root, 'tmp', '{0}.{1}'.format(job_id, stream))
+    
+    @property
+    def _segment(self):
+        return os.path.join(self._root, '{0}.seg'.format(self._name))
+    
+    @property
+    def _index(self):
+        return os.path.join(self._root, '{0}.idx'.format(self._name))
+    
+    def commit(self, job_id):
+        entries = []
+        with open(self._segment, 'ab') as segment:
+            fcntl.flock(segment, fcntl.LOCK_EX)
+            try:
+                segment.seek(0, os.SEEK_END)
+                for stream in ALL_STREAMS:
+                    path = self._path(job_id, stream)
+                    if not os.path.exists(path):
+                        continue
+                    offset = segment.tell()
+                    with open(path, 'rb') as f:
+                        _append(f, segment, self._compress)
+                    
+                    entries.append('{0} {1} {2} {3} {4}\n'.format(
+                        job_id, stream, offset, segment.tell() - offset, int(self._compress)
+                    ))
+                    os.unlink(path)
+                
+                segment.flush()
+                with open(self._index, 'a') as index:
+                    index.writelines(entries)
+            finally:
+                fcntl.flock(segment, fcntl.LOCK_UN)
+    
+    def location(self, job_id):
+        return '{0}:{1}'.format(self.layout, os.path.abspath(self._segment))
+    
+    def open(self, job_id, stream='out'):
+        # The running job has not been appended to the segment yet
+        path = self._path(job_id, stream)
+        if os.path.exists(path):
+            return open(path, 'rb')
+        
+        # Look first in the index of this segment
+        indexes = sorted(glob.glob(os.path.join(self._root, '*.idx')))
+        if self._index in indexes:
+            indexes.remove(self._index)
+            indexes.insert(0, self._index)
+        
+        for index in indexes:
+            entry = _find_in_index(index, job_id, stream)
+            if entry:
+                return _open_segment(index[:-len('.idx')] + '.seg', *entry)
+        
+        raise KeyError(job_id)
+
+def _append(src, dst, compress):
+    """\
+    Copy a file into another one by chunks, optionally compressing it.
+    """
+    if not compress:
+        shutil.copyfileobj(src, dst, COPY_CHUNK)
+        return
+    
+    compressor = zlib.compressobj()
+    while True:
+        chunk = src.read(COPY_CHUNK)
+        if not chunk:
+            break
+        dst.write(compressor.compress(chunk))
+    dst.write(compressor.flush())
+
+class _Slice(io.RawIOBase):
+    """\
+    Read-only view of a region of a file.
+    """
+    
+    def __init__(self, f, offset, length):
+        self._f      = f
+        self._offset = offset
+        self._length = length
+        self._pos    = 0
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, pos, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            pos += self._pos
+        elif whence == os.SEEK_END:
+            pos += self._length
+        self._pos = min(max(pos, 0), self._length)
+        return self._pos
+    
+    def readinto(self, b):
+        size = min(len(b), self._length - self._pos)
+        self._f.seek(self._offset + self._pos)
+        data = self._f.read(size)
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+    
+    def close(self):
+        self._f.close()
+        super(_Slice, self).close()
+
+class _Inflate(io.RawIOBase):
+    """\
+    Read-only stream decompressing a file as it is read.
+    
+    Only rewinding is supported, which decompresses it again from the start.
+    """
+    
+    def __init__(self, f):
+        self._f = f
+        self.seek(0)
+    
+    def readable(self):
+        return True
+    
+    def tell(self):
+        return self._pos
+    
+    def seek(self, pos, whence=os.SEEK_SET):
+        if pos != 0 or whence != os.SEEK_SET:
+            raise io.UnsupportedOperation('seek')
+        self._f.seek(0)
+        self._decompressor = zlib.decompressobj()
+        self._pos          = 0
+        return 0
+    
+    def readinto(self, b):
+        data = b''
+        while not data and not self._decompressor.eof:
+            chunk = self._decompressor.unconsumed_tail or self._f.read(COPY_CHUNK)
+            if not chunk:
+                break
+            data = self._decompressor.decompress(chunk, len(b))
+        
+        b[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+    
+    def close(self):
+        self._f.close()
+        super(_Inflate, self).close()
+
+def _find_in_index(index, job_id, stream):
+    found = None
+    with open(index) as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) == 5 and fields[0] == str(job_id) and fields[1] == stream:
+                # A job that has been run again has a newer entry
+                found = (int(fields[2]), int(fields[3]), bool(int(fields[4])))
+    
+    return found
+
+def _open_segment(segment, offset, length, compressed):
+    f = _Slice(open(segment, 'rb'), offset, length)
+    if not compressed:
+        return f
+    
+    return _Inflate(f)
+
+LAYOUTS = {
+    FlatLogStore.layout    : FlatLogStore,
+    ShardedLogStore.layout : ShardedLogStore,
+    SegmentLogStore.layout : SegmentLogStore,
+}
+
+def from_location(location):
+    """\
+    Return the log store for a location returned by :meth:`FlatLogStore.location`.
+    """
+    layout, path = location.split(':', 1)
+    if layout == SegmentLogStore.layout:
+        name = os.path.basename(path)[:-len('.seg')]
+        return SegmentLogStore(os.path.dirname(path), name=name)
+    
+    return LAYOUTS[layout](path)
+
+def open_log(job_id, stream='out', location=None, root=None):
+    """\
+    Return a binary file object to read a log of a job.
+    
+    The log is searched in the given location, as returned by the log store
+    which stored it, or else in every layout under the given root directory.
+    Raises KeyError if the log cannot be found.
+    """
+    if stream not in ALL_STREAMS:
+        raise ValueError("Unknown log stream '%s'." % stream)
+    
+    if location:
+        return from_location(location).open(job_id, stream)
+    
+    for store in LAYOUTS.values():
+        try:
+            return store(root or '.').open(job_id, stream)
+        except KeyError:
+            pass
+    
+    raise KeyError(job_id)
+
+def read(job_id, stream='out', location=None, root=None):
+    """\
+    Return the contents of a log of a job, as bytes.
+    
+    See :func:`open_log` for the meaning of the arguments.
+    """
+    with open_log(job_id, stream, location, root) as f:
+        return f.read()
+
+def tail(f, size):
+    """\
+    Return the last size bytes of a binary file object.
+    
+    Seekable files are read only from the required position. Otherwise, as
+    with compressed files, they are read sequentially keeping only the tail.
+    """
+    try:
+        end = f.seek(0, os.SEEK_END)
+        f.seek(max(end - size, 0))
+        return f.read()
+    except (IOError, ValueError):
+        pass
+    
+    f.seek(0)
+    data = b''
+    while True:
+        chunk = f.read(TAIL_CHUNK)
+        if not chunk:
+            return data
+        data = (data + chunk)[-size:]
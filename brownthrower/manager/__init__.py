@@ -26,6 +26,10 @@ class Manager(cmd.Cmd):
         initialize = options.get('initialize_db')
         
         self._session_maker = bt.session_maker(db_url, initialize)
+        
+        self._sql_stats = None
+        if 'sql_stats' in options:
+            self._sql_stats = bt.engine.instrument(options.get('sql_stats'))
         self._subcmds = {}
         
         self.prompt = '(brownthrower): '
@@ -66,13 +70,19 @@ class Manager(cmd.Cmd):
             if subcmd:
                 return subcmd._complete(text, items[1:])
     
+    def _operation(self, items):
+        # Queries are attributed to the command, such as 'job submit'
+        return bt.engine.operation(' '.join(items[:2]))
+    
     def do_job(self, line):
         items = line.strip().split()
-        self._subcmds['job']._do(items)
+        with self._operation(['job'] + items):
+            self._subcmds['job']._do(items)
     
     def do_task(self, line):
         items = line.strip().split()
-        self._subcmds['task']._do(items)
+        with self._operation(['task'] + items):
+            self._subcmds['task']._do(items)
     
     def do_quit(self, line):
         return self.do_EOF(line)
@@ -81,6 +91,18 @@ class Manager(cmd.Cmd):
         return True
     
     def postcmd(self, stop, line):
+        if self._sql_stats:
+            stats = self._sql_stats.snapshot()
+            self._sql_stats.reset()
+            if stats:
+                table = [
+                    [name, count, total, total / count, slowest]
+                    for name, (count, total, slowest) in sorted(stats.items())
+                ]
+                print(tabulate(table, floatfmt='.4f', headers=[
+                    'operation', 'queries', 'total (s)', 'mean (s)', 'max (s)',
+                ]))
+        
         return cmd.Cmd.postcmd(self, stop, line)
     
     def postloop(self):
@@ -94,6 +116,8 @@ def _parse_args(args):
         help='show this help message and exit')
     parser.add_argument('--initialize-db', '-i', action='store_true', default=False,
         help="create database structure, if not present")
+    parser.add_argument('--sql-stats', type=float, nargs='?', const=None, default=argparse.SUPPRESS, metavar='SECONDS',
+        help="show the number and time of the queries run by each command, logging those slower than %(metavar)s")
     parser.add_argument('--verbose', '-v', action='count', default=0,
         help='increment verbosity level (can be specified twice)')
     parser.add_argument('--version', '-V', action='version', 
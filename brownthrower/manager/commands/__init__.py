@@ -24,6 +24,7 @@ class Job(Command):
         self.add_subcmd('graph',  job.JobGraph())
         self.add_subcmd('link',   job.JobLink())
         self.add_subcmd('list',   job.JobList())
+        self.add_subcmd('log',    job.JobLog())
         self.add_subcmd('remove', job.JobRemove())
         self.add_subcmd('reset',  job.JobReset())
         self.add_subcmd('show',   job.JobShow())
@@ -46,6 +47,7 @@ class Task(Command):
         self.add_subcmd('list',   task.TaskList())
 #         self.add_subcmd('output', task.TaskOutput())
         self.add_subcmd('show',   task.TaskShow())
+        self.add_subcmd('stats',  task.TaskStats())
 
 # class Profile(Command):
 #     """\
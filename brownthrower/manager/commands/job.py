@@ -7,12 +7,16 @@ import logging
 import readline # @UnresolvedImport
 import os
 import pyparsing as pp
+import select
 import subprocess
+import sys
 import tempfile
 import textwrap
+import time
 import yaml
 
 from .base import Command, error, warn, success, strong
+from brownthrower import logstore, rusage
 
 from sqlalchemy.exc import IntegrityError, DataError, DBAPIError
 from sqlalchemy.orm import joinedload, undefer_group, undefer
@@ -27,6 +31,12 @@ except ImportError:
 
 log = logging.getLogger('brownthrower.manager')
 
+# Maximum number of bytes shown from the end of a log
+LOG_TAIL = 64 * 2**10
+
+# Seconds between checks for new output when following a log
+FOLLOW_INTERVAL = 1
+
 class JobCreate(Command):
     """\
     usage: job create <task>
@@ -279,6 +289,110 @@ class JobTags(Command):
             error("The specified job does not exist.")
             log.debug(e)
 
+class JobLog(Command):
+    """\
+    usage: job log <id> [ 'out' | 'err' | 'stacks' | 'memory' ] [ '--follow' ]
+    
+    Show the last part of the standard output or error of the job with the
+    given id, or the stacks and memory snapshots taken while it ran. With
+    --follow, keep showing its output until the job ends. If the log files
+    are not reachable, show the part of them kept in the database when the
+    job failed, if any.
+    """
+    
+    def complete(self, text, items):
+        if len(items) == 1:
+            return [value
+                    for value in logstore.ALL_STREAMS + ['--follow']
+                    if value.startswith(text)]
+    
+    def _is_running(self, job_id):
+        with bt.transactional_session(self.session_maker) as session:
+            job = session.query(bt.Job).filter_by(id = job_id).one()
+            return job.status == bt.Job.Status.RUNNING
+    
+    def _copy(self, f):
+        data = f.read()
+        if data:
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+    
+    def _follow(self, job_id, f):
+        notifications = None
+        if self.session_maker.bind.url.drivername == 'postgresql':
+            notifications = bt.Notifications(self.session_maker)
+            notifications.listen(notifications.channel.job_update)
+        
+        try:
+            while True:
+                self._copy(f)
+                
+                # Notifications only wake up earlier, the status is checked anyway
+                if notifications:
+                    r, _, _ = select.select([notifications], [], [], FOLLOW_INTERVAL)
+                    if r:
+                        list(notifications)
+                else:
+                    time.sleep(FOLLOW_INTERVAL)
+                
+                if not self._is_running(job_id):
+                    self._copy(f)
+                    return
+        except KeyboardInterrupt:
+            print()
+        finally:
+            if notifications:
+                notifications.close()
+    
+    def do(self, items):
+        args   = [item for item in items if item != '--follow']
+        follow = len(args) != len(items)
+        if len(args) not in [1, 2] or (len(args) == 2 and args[1] not in logstore.ALL_STREAMS):
+            return self.help(items)
+        
+        stream = args[1] if len(args) == 2 else 'out'
+        
+        try:
+            job_id = int(args[0])
+            with bt.transactional_session(self.session_maker) as session:
+                job = session.query(bt.Job).filter_by(id = job_id).one()
+                location = job.tag.get(bt.model.TAG_LOG)
+                running  = job.status == bt.Job.Status.RUNNING
+                kept     = job.get_log_tail(stream)
+        
+        except (ValueError, DataError, NoResultFound) as e:
+            error("The specified job does not exist.")
+            log.debug(e)
+            return
+        
+        f = None
+        if location:
+            try:
+                f = logstore.open_log(job_id, stream, location=location)
+            except (KeyError, IOError) as e:
+                log.debug(e)
+        
+        if not f:
+            if kept is not None:
+                warn("Showing the last part of the log kept when the job failed.")
+                sys.stdout.buffer.write(kept)
+                sys.stdout.flush()
+            elif not location:
+                error("The location of the logs of this job is unknown.")
+            else:
+                error("The logs of this job cannot be found at «%s»." % location)
+            return
+        
+        with f:
+            data = logstore.tail(f, LOG_TAIL)
+            if f.tell() > len(data):
+                warn("Showing only the last %d KiB of the log." % (LOG_TAIL // 2**10))
+            sys.stdout.buffer.write(data)
+            sys.stdout.flush()
+            
+            if follow and running:
+                self._follow(job_id, f)
+
 class JobShow(Command):
     """\
     usage: job show <id>
@@ -300,6 +414,12 @@ class JobShow(Command):
                 for field in ['id', 'super_id', 'name', 'status', 'token', 'ts_created', 'ts_queued', 'ts_started', 'ts_ended']:
                     print(field.ljust(10) + ' : ' + str(getattr(job, field)))
                 print()
+                usage = job.get_rusage()
+                if usage:
+                    print(strong("### JOB RESOURCE USAGE:"))
+                    for field in rusage.FIELDS:
+                        print(field.ljust(10) + ' : ' + str(usage.get(field)))
+                    print()
                 print(strong("### JOB DESCRIPTION:"))
                 print(job.description if job.description else '')
                 print()
@@ -69,6 +69,44 @@ class TaskShow(Command):
             error("The task '%s' is not available in this environment." % e.task)
             log.debug(e)
 
+class TaskStats(Command):
+    """\
+    usage: task stats [ name ... ]
+    
+    Show runtime statistics of the jobs of all or the given tasks.
+    """
+    
+    def complete(self, text, items):
+        return [key
+                for key in bt.tasks.keys()
+                if key.startswith(text) and key not in items]
+    
+    def do(self, items):
+        def fmt(seconds):
+            return "%.2f" % seconds if seconds is not None else None
+        
+        with bt.transactional_session(self.session_maker) as session:
+            summary = bt.TaskStats.summary(session, items)
+        
+        if not summary:
+            warn("No statistics were found for the given tasks.")
+            return
+        
+        table = []
+        for name in sorted(summary.keys()):
+            stats = summary[name]
+            table.append([
+                name, stats.count, stats.failed,
+                fmt(stats.minimum), fmt(stats.mean),
+                fmt(stats.quantile(0.5)), fmt(stats.quantile(0.9)), fmt(stats.quantile(0.99)),
+                fmt(stats.maximum), stats.max_rss,
+            ])
+        
+        print(tabulate(table, headers=[
+            'name', 'done', 'failed',
+            'min', 'mean', 'p50', 'p90', 'p99', 'max', 'max_rss (KiB)',
+        ]))
+
 # class TaskInput(Command):
 #     """\
 #     usage: task input <command> [options]
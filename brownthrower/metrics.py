@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import bisect
+import errno
+import fcntl
+import logging
+import os
+import pickle
+import struct
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+log = logging.getLogger('brownthrower.metrics')
+
+# Upper bounds (in seconds) of the buckets of the latency histograms
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# Upper bounds (in seconds) of the buckets of the runtime histograms
+RUNTIME_BUCKETS = [0.01, 0.1, 1, 10, 60, 300, 900, 3600, 4 * 3600, 24 * 3600]
+
+# Observations are written to the collector pipe in a single write, so they
+# are not interleaved. Bigger observations are dropped.
+_HEADER  = struct.Struct('!H')
+_MAX_MSG = 512 - _HEADER.size
+
+class Counter(object):
+    """\
+    Monotonic counter, with a value for each combination of labels.
+    """
+    
+    type = 'counter'
+    
+    def __init__(self, name, doc):
+        self.name    = name
+        self.doc     = doc
+        self._values = {}
+    
+    def apply(self, labels, value):
+        self._values[labels] = self._values.get(labels, 0) + value
+    
+    def samples(self):
+        # Copying the dict is atomic, unlike iterating over it
+        for labels, value in sorted(self._values.copy().items()):
+            yield self.name, labels, value
+
+class Gauge(Counter):
+    """\
+    Value which may go up and down, such as the number of busy slots.
+    """
+    
+    type = 'gauge'
+    
+    def apply(self, labels, value):
+        self._values[labels] = value
+
+class Histogram(object):
+    """\
+    Distribution of observed values, counted in cumulative buckets.
+    """
+    
+    type = 'histogram'
+    
+    def __init__(self, name, doc, buckets=LATENCY_BUCKETS):
+        self.name     = name
+        self.doc      = doc
+        self._buckets = list(buckets)
+        self._values  = {}
+    
+    def apply(self, labels, value):
+        counts, total = self._values.get(labels, ([0] * (len(self._buckets) + 1), 0.0))
+        # Replace the counts instead of updating them, so they are never read half-way
+        counts = list(counts)
+        counts[bisect.bisect_left(self._buckets, value)] += 1
+        self._values[labels] = (counts, total + value)
+    
+    def samples(self):
+        for labels, (counts, total) in sorted(self._values.copy().items()):
+            cumulative = 0
+            for bound, count in zip(self._buckets + ['+Inf'], counts):
+                cumulative += count
+                yield self.name + '_bucket', labels + (('le', str(bound)),), cumulative
+            yield self.name + '_sum',   labels, total
+            yield self.name + '_count', labels, cumulative
+
+METRICS = dict((metric.name, metric) for metric in [
+    Counter('bt_jobs_claimed_total', "Jobs started by this runner."),
+    Counter('bt_jobs_ended_total', "Jobs ended, by final status."),
+    Counter('bt_serialization_retries_total', "Transactions retried after a serialization error."),
+    Counter('bt_sql_queries_total', "Queries run, by operation."),
+    Histogram('bt_claim_seconds', "Time to find and start a runnable job."),
+    Histogram('bt_start_overhead_seconds', "Time from starting a job until its task begins to run."),
+    Histogram('bt_task_run_seconds', "Time spent running the code of the tasks.", RUNTIME_BUCKETS),
+    Histogram('bt_finish_seconds', "Time spent in the transaction finishing a job."),
+    Histogram('bt_sql_seconds', "Time spent running queries, by operation."),
+    Gauge('bt_slots', "Number of jobs this runner may run concurrently."),
+    Gauge('bt_slots_busy', "Number of jobs being run."),
+])
+
+class _Collector(object):
+    """\
+    Apply the observations of this process and its children to the metrics.
+    
+    Observations are sent through a non-blocking pipe and applied by a single
+    thread, so recording them never waits for a lock. If the pipe is full, the
+    observations are dropped.
+    """
+    
+    def __init__(self):
+        self._r, self._w = os.pipe()
+        flags = fcntl.fcntl(self._w, fcntl.F_GETFL)
+        fcntl.fcntl(self._w, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+        
+        self._thread = threading.Thread(target=self._collect, name='bt_metrics')
+        self._thread.daemon = True
+        self._thread.start()
+    
+    def send(self, name, labels, value):
+        data = pickle.dumps((name, labels, value), protocol=2)
+        if len(data) > _MAX_MSG:
+            return
+        try:
+            os.write(self._w, _HEADER.pack(len(data)) + data)
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+    
+    def _read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = os.read(self._r, size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+    
+    def _collect(self):
+        while True:
+            size, = _HEADER.unpack(self._read(_HEADER.size))
+            name, labels, value = pickle.loads(self._read(size))
+            try:
+                METRICS[name].apply(labels, value)
+            except Exception:
+                log.debug("Invalid observation of metric %s" % name, exc_info=True)
+
+_collector = None
+
+def _send(name, value, labels):
+    if _collector is None:
+        return
+    _collector.send(name, tuple(sorted(labels.items())), value)
+
+def inc(name, value=1, **labels):
+    """\
+    Increment a counter. Does nothing unless metrics have been enabled.
+    """
+    _send(name, value, labels)
+
+def observe(name, value, **labels):
+    """\
+    Record a value into a histogram. Does nothing unless metrics have been enabled.
+    """
+    _send(name, value, labels)
+
+def set_gauge(name, value, **labels):
+    """\
+    Set the value of a gauge. Does nothing unless metrics have been enabled.
+    """
+    _send(name, value, labels)
+
+def render():
+    """\
+    Return the current value of the metrics in the Prometheus text format.
+    """
+    lines = []
+    for name, metric in sorted(METRICS.items()):
+        lines.append('# HELP %s %s' % (name, metric.doc))
+        lines.append('# TYPE %s %s' % (name, metric.type))
+        for sample, labels, value in list(metric.samples()):
+            if labels:
+                sample += '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in labels)
+            lines.append('%s %s' % (sample, repr(float(value)) if isinstance(value, float) else value))
+    
+    return '\n'.join(lines) + '\n'
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] not in ['/', '/metrics']:
+            self.send_error(404)
+            return
+        
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, fmt, *args):
+        log.debug(fmt % args)
+
+def enable(port=None, host='127.0.0.1'):
+    """\
+    Start collecting metrics and serve them over HTTP at the given address.
+    
+    Processes forked afterwards, such as the monitors and the job processes,
+    send their observations to this one. Without a port, the metrics are only
+    collected, to be read from :data:`METRICS`.
+    """
+    global _collector
+    
+    if _collector is None:
+        _collector = _Collector()
+    
+    if port is None:
+        return None
+    
+    server = HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name='bt_metrics_http')
+    thread.daemon = True
+    thread.start()
+    
+    log.info("Serving metrics at http://%s:%d/metrics" % server.server_address)
+    return server
@@ -1,15 +1,22 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import base64
+import collections
 import contextlib
 import copy
-import cProfile
+import datetime
+import fnmatch
+import inspect
 import logging
 import sys
+import time
 import traceback
 import yaml
+import zlib
 
 from sqlalchemy import event, func, literal_column
+from sqlalchemy.dialects import postgresql
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy.ext.hybrid import hybrid_property
 from sqlalchemy.orm import relationship, reconstructor, deferred
@@ -18,9 +25,14 @@ from sqlalchemy.orm.exc import DetachedInstanceError
 from sqlalchemy.orm.session import object_session
 from sqlalchemy.schema import ForeignKeyConstraint, Index, PrimaryKeyConstraint, UniqueConstraint
 from sqlalchemy.sql import functions
-from sqlalchemy.sql.expression import literal
-from sqlalchemy.types import DateTime, Integer, String, Text
+from sqlalchemy.sql.expression import cast, literal
+from sqlalchemy.types import DateTime, Float, Integer, String, Text
 
+from . import cache
+from . import engine
+from . import metrics
+from . import rusage
+from . import sketch
 from . import taskstore
 from . import utils
 from .base import Column, Base
@@ -31,6 +43,34 @@ tasks = taskstore.TaskStore()
 """Global task container, implemented as a read-only dict."""
 
 TAG_TRACEBACK = 'bt_traceback'
+TAG_AFFINITY  = 'bt_affinity'
+TAG_LOG       = 'bt_log'
+TAG_LOG_TAIL  = 'bt_log_tail_%s'
+TAG_RUSAGE    = 'bt_rusage'
+
+# Number of rows in which the statistics of each task are split
+STATS_SHARDS = 16
+
+# Estimated runtime (in seconds) of tasks without statistics
+DEFAULT_WEIGHT = 1.0
+
+# Maximum number of ids in each IN clause
+IN_CHUNK = 500
+
+def _chunks(ids):
+    ids = list(ids)
+    for i in range(0, len(ids), IN_CHUNK):
+        yield ids[i:i + IN_CHUNK]
+
+def _now(session):
+    """\
+    Return the current time of the database, as stored in DateTime columns.
+    """
+    now = functions.now()
+    if session.bind.url.drivername == 'postgresql':
+        now = cast(now, DateTime)
+    
+    return session.query(now).scalar()
 
 class Dependency(Base):
     """\
@@ -144,19 +184,20 @@ class Job(Base):
     # COLUMNS                                                                 #
     ###########################################################################
     
-    _id          =          Column('id',          Integer,    nullable=False, comment="unique identifier (ID)")
-    _super_id    =          Column('super_id',    Integer,    nullable=True,  comment="super job ID")
-    _name        =          Column('name',        String(50), nullable=False, comment="short name for categorization")
-    _status      =          Column('status',      String(20), nullable=False, comment="current status")
-    _description = deferred(Column('description', Text,       nullable=False, comment="user description", server_default=''), group='desc')
-    _token       =          Column('token',       String(32), nullable=True,  comment="unique value for reservations")
-    _config      = deferred(Column('config',      Text,       nullable=True,  comment="configuration data (in YAML format)"), group='yaml')
-    _input       = deferred(Column('input',       Text,       nullable=True,  comment="input data (in YAML format)"),         group='yaml')
-    _output      = deferred(Column('output',      Text,       nullable=True,  comment="output data (in YAML format)"),        group='yaml')
-    _ts_created  =          Column('ts_created',  DateTime,   nullable=False, comment="when was this job created (UTC)", default=functions.now())
-    _ts_queued   =          Column('ts_queued',   DateTime,   nullable=True,  comment="when was this job submitted for execution (UTC)")
-    _ts_started  =          Column('ts_started',  DateTime,   nullable=True,  comment="when did this job start executing (UTC)")
-    _ts_ended    =          Column('ts_ended',    DateTime,   nullable=True,  comment="when did this job finish executing (UTC)")
+    _id           =          Column('id',           Integer,    nullable=False, comment="unique identifier (ID)")
+    _super_id     =          Column('super_id',     Integer,    nullable=True,  comment="super job ID")
+    _name         =          Column('name',         String(50), nullable=False, comment="short name for categorization")
+    _status       =          Column('status',       String(20), nullable=False, comment="current status")
+    _description  = deferred(Column('description',  Text,       nullable=False, comment="user description", server_default=''), group='desc')
+    _token        =          Column('token',        String(32), nullable=True,  comment="unique value for reservations")
+    _config       = deferred(Column('config',       Text,       nullable=True,  comment="configuration data (in YAML format)"), group='yaml')
+    _input        = deferred(Column('input',        Text,       nullable=True,  comment="input data (in YAML format)"),         group='yaml')
+    _output       = deferred(Column('output',       Text,       nullable=True,  comment="output data (in YAML format)"),        group='yaml')
+    _ts_created   =          Column('ts_created',   DateTime,   nullable=False, comment="when was this job created (UTC)", default=functions.now())
+    _ts_queued    =          Column('ts_queued',    DateTime,   nullable=True,  comment="when was this job submitted for execution (UTC)")
+    _ts_started   =          Column('ts_started',   DateTime,   nullable=True,  comment="when did this job start executing (UTC)")
+    _ts_ended     =          Column('ts_ended',     DateTime,   nullable=True,  comment="when did this job finish executing (UTC)")
+    _bottom_level =          Column('bottom_level', Float,      nullable=False, comment="estimated runtime of the longest path from this job to the end of its workflow (seconds)", server_default='0')
     
     ###########################################################################
     # RELATIONSHIPS                                                           #
@@ -233,6 +274,7 @@ class Job(Base):
             '_name' : name,
             '_status' : Job.Status.STASHED,
             '_ts_created' : func.now(),
+            '_bottom_level' : 0.0,
         }
           
         super(Job, self).__init__(**values)
@@ -341,6 +383,10 @@ class Job(Base):
     def ts_ended(self):
         return self._ts_ended
     
+    @hybrid_property
+    def bottom_level(self):
+        return self._bottom_level
+    
     ###########################################################################
     # DESCRIPTORS                                                             #
     ###########################################################################
@@ -428,6 +474,106 @@ class Job(Base):
             if not self.ts_started:
                 self._ts_started = func.now()
     
+    @staticmethod
+    def _weights(session, names):
+        """\
+        Return a dict with the expected runtime of the jobs of the given tasks,
+        according to their statistics.
+        """
+        weights = session.info.setdefault('bt_weights', {})
+        missing = set(names) - set(weights)
+        if missing:
+            summary = TaskStats.summary(session, list(missing))
+            for name in missing:
+                stats = summary.get(name)
+                weights[name] = stats.mean if stats and stats.mean else DEFAULT_WEIGHT
+        
+        return weights
+    
+    @classmethod
+    def _update_bottom_levels(cls, session, job_ids):
+        """\
+        Compute the bottom level of the given jobs, and raise those of their
+        ancestors accordingly.
+        
+        The given jobs are computed together, from the sinks up, so a whole
+        workflow submitted at once needs a few queries. Their ancestors are
+        then raised one generation at a time, until their levels do not
+        change. Bottom levels only grow, so removing dependencies may leave
+        them as an upper bound of the actual value. Jobs that are already DONE
+        are not updated, as they will not be scheduled anymore.
+        """
+        jobs = {}
+        for chunk in _chunks(job_ids):
+            jobs.update((job.id, job) for job in session.query(cls).filter(
+                cls._id.in_(chunk),
+                cls._status != Job.Status.DONE,
+            ))
+        
+        children = collections.defaultdict(list)
+        stored   = {}
+        for chunk in _chunks(jobs):
+            for parent_id, child_id, level in session.query(
+                Dependency._parent_id, Dependency._child_id, cls._bottom_level
+            ).join(
+                cls, cls._id == Dependency._child_id
+            ).filter(
+                Dependency._parent_id.in_(chunk)
+            ):
+                children[parent_id].append(child_id)
+                stored[child_id] = level or 0.0
+        
+        weights = cls._weights(session, set(job.name for job in jobs.values()))
+        levels  = {}
+        for job_id in jobs:
+            # Iterative depth-first traversal, as chains may be very long
+            stack = [job_id]
+            while stack:
+                current = stack[-1]
+                pending = [
+                    child_id
+                    for child_id in children[current]
+                    if child_id in jobs and child_id not in levels
+                ]
+                if pending:
+                    stack.extend(pending)
+                    continue
+                
+                stack.pop()
+                if current in levels:
+                    continue
+                
+                job   = jobs[current]
+                value = weights[job.name] + max([
+                    levels.get(child_id, stored[child_id])
+                    for child_id in children[current]
+                ] or [0.0])
+                levels[current] = max(value, job.bottom_level or 0.0)
+        
+        raised = {}
+        for job_id, value in levels.items():
+            if value > (jobs[job_id].bottom_level or 0.0):
+                jobs[job_id]._bottom_level = value
+                raised[job_id] = value
+        
+        while raised:
+            rows = []
+            for chunk in _chunks(raised):
+                rows.extend(session.query(cls, Dependency._child_id).join(
+                    Dependency, Dependency._parent_id == cls._id
+                ).filter(
+                    Dependency._child_id.in_(chunk),
+                    cls._status != Job.Status.DONE,
+                ))
+            
+            weights = cls._weights(session, set(parent.name for parent, _ in rows))
+            frontier, raised = raised, {}
+            for parent, child_id in rows:
+                value = weights[parent.name] + frontier[child_id]
+                if value > (parent.bottom_level or 0.0):
+                    parent._bottom_level = value
+                    raised[parent.id] = value
+    
     def _submit(self):
         if self.subjobs:
             for subjob in self.subjobs:
@@ -440,6 +586,7 @@ class Job(Base):
             self._status = Job.Status.QUEUED
             self._ts_queued = func.now()
     
+    @engine.instrumented('submit')
     def submit(self):
         if self.status not in [
             Job.Status.FAILED,
@@ -468,6 +615,7 @@ class Job(Base):
         else:
             raise DetachedInstanceError()
     
+    @engine.instrumented('remove')
     def remove(self):
         if self.status not in [
             Job.Status.FAILED,
@@ -495,6 +643,7 @@ class Job(Base):
         ]:
             self._cleanup('Job was aborted due to user request.')
     
+    @engine.instrumented('abort')
     def abort(self):
         if self.status not in [
             Job.Status.QUEUED,
@@ -519,6 +668,7 @@ class Job(Base):
             self._ts_ended = None
             self._token = None
     
+    @engine.instrumented('reset')
     def reset(self):
         if self.status not in [
             Job.Status.FAILED,
@@ -583,6 +733,15 @@ class Job(Base):
         return self.get_dataset('input')
     
     def get_output(self):
+        if self.status == Job.Status.DONE and cache.outputs.enabled:
+            # The output of a finished job does not change anymore
+            try:
+                return cache.outputs.get(self.id)
+            except KeyError:
+                cache.outputs.put(self.id, self.raw_output or '')
+                if self.id in cache.outputs:
+                    return cache.outputs.get(self.id)
+        
         return self.get_dataset('output')
     
     def set_config(self, value):
@@ -597,6 +756,28 @@ class Job(Base):
     def edit_input(self):
         return self.edit_dataset('input')
     
+    def get_log_tail(self, stream='err'):
+        """\
+        Return the last part of the given log stream ('out' or 'err') kept when
+        the job failed, as bytes, or None if it was not kept.
+        """
+        value = self.tag.get(TAG_LOG_TAIL % stream)
+        if value is None:
+            return None
+        
+        return zlib.decompress(base64.b64decode(value))
+    
+    def _set_log_tails(self, tails):
+        """\
+        Keep the tail of the output of a failed job, compressed, in its tags.
+        """
+        for stream in ['out', 'err']:
+            data = tails.get(stream)
+            if self.status == Job.Status.FAILED and data:
+                self.tag[TAG_LOG_TAIL % stream] = base64.b64encode(zlib.compress(data)).decode('ascii')
+            else:
+                self.tag.pop(TAG_LOG_TAIL % stream, None)
+    
     ###########################################################################
     # TASK                                                                    #
     ###########################################################################
@@ -612,7 +793,17 @@ class Job(Base):
         if self.token != token:
             raise TokenMismatchException("Incorrect token given for this job.")
     
+    @engine.instrumented('start')
     def _start(self, token):
+        if self.status == Job.Status.QUEUED and self.token:
+            # Job reserved for the runner that executed one of its parents
+            if self.token == token:
+                self.tag.pop(TAG_AFFINITY, None)
+            elif self._affinity_expired():
+                log.debug("Reservation of job %d has expired." % self.id)
+                self.tag.pop(TAG_AFFINITY, None)
+                self._token = None
+        
         self.reserve(token)
         
         if self.status == Job.Status.RUNNING:
@@ -648,10 +839,10 @@ class Job(Base):
         if self.status != Job.Status.RUNNING:
             raise InvalidStatusException("Only jobs in RUNNING state can be executed.")
         
-        if profile:
-            pr = cProfile.Profile()
-            pr.enable()
+        # Only the sampled jobs are profiled
+        probe = profile.start(self) if profile else None
         
+        started   = time.time()
         new_state = {}
         try:
             if not self.subjobs:
@@ -664,7 +855,11 @@ class Job(Base):
                 if not self.new_subjobs:
                     if debug:
                         utils.start_debugger(**debug)
-                    new_state['output'] = self.task.run(self)
+                    output = self.task.run(self)
+                    if inspect.isawaitable(output):
+                        # Tasks defining 'async def run'
+                        output = utils.wait_for(output)
+                    new_state['output'] = output
                     new_state['status'] = Job.Status.DONE
                 else:
                     new_state['subjobs'] = self.new_subjobs
@@ -686,21 +881,31 @@ class Job(Base):
             finally:
                 new_state['traceback'] = ''.join(traceback.format_exception(*sys.exc_info()))
         finally:
-            if profile:
-                pr.disable()
-                pr.dump_stats('{0}.pstats'.format(self.id))
+            if probe:
+                probe.stop()
+            
+            metrics.observe('bt_task_run_seconds', time.time() - started, task=self.name)
             
             return new_state
     
+    @engine.instrumented('finish')
     def _finish(self, token, new_state):
         if self.token != token:
             raise TokenMismatchException("Incorrect token given for this job.")
         
-        tb = new_state.get('traceback', None)
+        # Jobs run in a bundle wait for their turn after being started
+        elapsed = new_state.get('elapsed', None)
+        session = object_session(self)
+        if elapsed is not None and session:
+            self._ts_started = _now(session) - datetime.timedelta(seconds=elapsed)
+        
+        tb    = new_state.get('traceback', None)
+        usage = new_state.get('rusage', None)
         
         # AN ERROR OCCURRED
         if tb:
-            self._cleanup(tb)
+            self._cleanup(tb, usage)
+            self._set_log_tails(new_state.get('log_tail', {}))
             return
         
         if 'output' in new_state:
@@ -715,9 +920,10 @@ class Job(Base):
         status = new_state.get('status', Job.Status.FAILED)
         self._status = status
         
-        self._cleanup()
+        self._cleanup(usage=usage)
+        self._set_log_tails(new_state.get('log_tail', {}))
     
-    def _cleanup(self, tb=None):
+    def _cleanup(self, tb=None, usage=None):
         if tb:
             self._status = Job.Status.FAILED
             self.tag[TAG_TRACEBACK] = tb
@@ -725,22 +931,128 @@ class Job(Base):
         else:
             self.tag.pop(TAG_TRACEBACK, Tag())
         
-        self._ts_ended = func.now()
+        if usage:
+            self.tag[TAG_RUSAGE] = rusage.dumps(usage)
+        else:
+            self.tag.pop(TAG_RUSAGE, None)
+        
+        session = object_session(self)
+        if session and self.token and self.ts_started:
+            self._ts_ended = _now(session)
+            if self.status in [Job.Status.DONE, Job.Status.FAILED]:
+                max_rss = usage.get('maxrss') if usage else None
+                TaskStats._record(session, self, max_rss)
+                metrics.inc('bt_jobs_ended_total', task=self.name, status=self.status)
+        else:
+            self._ts_ended = func.now()
+        
         self._token = None
         
         for ancestor in self._ancestors():
             ancestor._update_status()
     
-    def cleanup(self, token, tb=None):
+    def _runnable_children(self):
+        """\
+        Return the QUEUED children of this job whose parents have all finished.
+        """
+        return [
+            child
+            for child in self.children
+            if child.status == Job.Status.QUEUED
+            and all([parent.status == Job.Status.DONE for parent in child.parents])
+        ]
+    
+    def _reserve_runnable_children(self, token, window):
+        """\
+        Reserve the runnable children of this job for the given token.
+        
+        Only the runner owning the token may start these children during the
+        next `window` seconds. After that, any runner may take them.
+        """
+        if self.status != Job.Status.DONE:
+            return
+        
+        children = [child for child in self._runnable_children() if not child.token]
+        if not children:
+            return
+        
+        # Use the clock of the database, shared by the runners of every node
+        expiry = _now(object_session(self)) + datetime.timedelta(seconds=window)
+        for child in children:
+            child._token = token
+            child.tag[TAG_AFFINITY] = expiry.isoformat()
+    
+    def _affinity_expired(self):
+        """\
+        Return whether the reservation of this job for the runner that finished
+        one of its parents has expired, according to the clock of the database.
+        """
+        value = self.tag.get(TAG_AFFINITY)
+        if value is None:
+            return False
+        
+        try:
+            expiry = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            # Written by older versions, in seconds since the epoch
+            return float(value) <= time.time()
+        
+        return expiry <= _now(object_session(self))
+    
+    def _fusible_child(self, token, patterns=None):
+        """\
+        Return the child that may run right after this job in the same process.
+        
+        This is only possible when this job has finished successfully and has
+        exactly one child, which in turn has no other parents, is QUEUED, is
+        not reserved for another token and belongs to an available task
+        matching the given patterns. Otherwise, return None.
+        """
+        if self.status != Job.Status.DONE or len(self.children) != 1:
+            return None
+        
+        child = next(iter(self.children))
+        if (
+            child.status != Job.Status.QUEUED or
+            child.token not in [None, token] or
+            len(child.parents) != 1 or
+            child.subjobs or
+            not child.task or
+            not Job._name_matches(child.name, patterns)
+        ):
+            return None
+        
+        return child
+    
+    @engine.instrumented('cleanup')
+    def cleanup(self, token, tb=None, usage=None):
         if self.token != token:
             raise TokenMismatchException("Incorrect token given for this job.")
         
-        self._cleanup(tb)
+        self._cleanup(tb, usage)
+    
+    def get_rusage(self):
+        """\
+        Return the resource usage recorded when the job ended, as a dict, or
+        None if it is unknown. See :mod:`brownthrower.rusage` for the fields.
+        """
+        value = self.tag.get(TAG_RUSAGE)
+        if value is None:
+            return None
+        
+        return rusage.loads(value)
     
     ###########################################################################
     # TASK                                                                    #
     ###########################################################################
     
+    @classmethod
+    def _name_matches(cls, name, patterns):
+        if not patterns:
+            return True
+        
+        return any([fnmatch.fnmatchcase(name, pattern) for pattern in patterns])
+    
     @classmethod
     def _name_like(cls, patterns):
         if not patterns:
@@ -793,3 +1105,167 @@ class Tag(Base):
             repr(self._name),
             repr(self._value),
         )
+
+class TaskStats(Base):
+    """\
+    Runtime statistics of the jobs of each task.
+    
+    The statistics of each task are split in several rows (shards), so
+    concurrent runners seldom need to update the same row. Use :meth:`summary`
+    to retrieve the merged statistics.
+    """
+    __tablename__ = 'task_stats'
+    __table_args__ = (
+        # Primary key
+        PrimaryKeyConstraint('name', 'shard', name = 'pk_task_stats'),
+    )
+    
+    # Columns
+    _name    = Column('name',    String(50), nullable=False, comment="task name")
+    _shard   = Column('shard',   Integer,    nullable=False, comment="partition of the statistics of this task")
+    _count   = Column('count',   Integer,    nullable=False, comment="number of successful jobs", default=0)
+    _failed  = Column('failed',  Integer,    nullable=False, comment="number of failed jobs", default=0)
+    _total   = Column('total',   Float,      nullable=False, comment="accumulated runtime of successful jobs (seconds)", default=0)
+    _minimum = Column('minimum', Float,      nullable=True,  comment="shortest runtime of a successful job (seconds)")
+    _maximum = Column('maximum', Float,      nullable=True,  comment="longest runtime of a successful job (seconds)")
+    _max_rss = Column('max_rss', Integer,    nullable=True,  comment="peak resident memory of a job (KiB)")
+    _sketch  = Column('sketch',  Text,       nullable=True,  comment="quantile sketch of the runtime of successful jobs (in JSON format)")
+    
+    def __init__(self, name, shard=0):
+        super(TaskStats, self).__init__(
+            _name    = name,
+            _shard   = shard,
+            _count   = 0,
+            _failed  = 0,
+            _total   = 0.0,
+        )
+    
+    @hybrid_property
+    def name(self):
+        return self._name
+    
+    @hybrid_property
+    def count(self):
+        return self._count
+    
+    @hybrid_property
+    def failed(self):
+        return self._failed
+    
+    @hybrid_property
+    def total(self):
+        return self._total
+    
+    @hybrid_property
+    def minimum(self):
+        return self._minimum
+    
+    @hybrid_property
+    def maximum(self):
+        return self._maximum
+    
+    @hybrid_property
+    def max_rss(self):
+        return self._max_rss
+    
+    @property
+    def mean(self):
+        if self.count:
+            return self.total / self.count
+    
+    def get_sketch(self):
+        if self._sketch:
+            return sketch.QuantileSketch.loads(self._sketch)
+        return sketch.QuantileSketch()
+    
+    def quantile(self, q):
+        """\
+        Return the estimated runtime quantile (0 <= q <= 1), or None if unknown.
+        """
+        return self.get_sketch().quantile(q)
+    
+    def _add(self, duration=None, failed=False, max_rss=None):
+        if failed:
+            self._failed += 1
+        else:
+            self._count += 1
+            self._total += duration
+            self._minimum = duration if self._minimum is None else min(self._minimum, duration)
+            self._maximum = duration if self._maximum is None else max(self._maximum, duration)
+            s = self.get_sketch()
+            s.add(duration)
+            self._sketch = s.dumps()
+        
+        if max_rss is not None:
+            self._max_rss = max(self._max_rss or 0, max_rss)
+    
+    def _merge(self, other):
+        self._count  += other.count
+        self._failed += other.failed
+        self._total  += other.total
+        for attr, fn in [('_minimum', min), ('_maximum', max), ('_max_rss', max)]:
+            values = [v for v in [getattr(self, attr), getattr(other, attr)] if v is not None]
+            setattr(self, attr, fn(values) if values else None)
+        if other._sketch:
+            s = self.get_sketch()
+            s.merge(other.get_sketch())
+            self._sketch = s.dumps()
+    
+    @classmethod
+    def _shard_for(cls, token):
+        return zlib.crc32(token.encode('utf-8')) % STATS_SHARDS
+    
+    @classmethod
+    def _record(cls, session, job, max_rss=None):
+        """\
+        Add the runtime of a job that has just ended to the statistics.
+        """
+        shard = cls._shard_for(job.token)
+        
+        if session.bind.url.drivername == 'postgresql':
+            # Avoid an IntegrityError if a concurrent transaction creates it
+            session.execute(postgresql.insert(cls.__table__).values(
+                name = job.name, shard = shard,
+                count = 0, failed = 0, total = 0.0,
+            ).on_conflict_do_nothing())
+        
+        stats = session.query(cls).filter_by(_name = job.name, _shard = shard).first()
+        if not stats:
+            stats = cls(job.name, shard)
+            session.add(stats)
+        
+        if job.status == Job.Status.DONE:
+            duration = (job.ts_ended - job.ts_started).total_seconds()
+            stats._add(max(duration, 0.0), max_rss=max_rss)
+        else:
+            stats._add(failed=True, max_rss=max_rss)
+    
+    @classmethod
+    def summary(cls, session, names=None):
+        """\
+        Return a dict with the merged statistics of the given task names.
+        
+        The returned objects are not attached to the session. If no names are
+        given, the statistics of all the tasks are returned.
+        """
+        query = session.query(cls)
+        if names:
+            query = query.filter(cls._name.in_(names))
+        
+        summary = {}
+        for stats in query:
+            merged = summary.get(stats.name)
+            if not merged:
+                merged = summary[stats.name] = cls(stats.name)
+            merged._merge(stats)
+        
+        return summary
+    
+    def __repr__(self):
+        return "%s(name=%s, shard=%s, count=%s, failed=%s)" % (
+            self.__class__.__name__,
+            repr(self._name),
+            repr(self._shard),
+            repr(self._count),
+            repr(self._failed),
+        )
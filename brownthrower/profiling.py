@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import collections
+import contextlib
+import cProfile
+import glob
+import logging
+import os
+import pstats
+import random
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+
+from sqlalchemy import inspect
+
+from . import model
+from . import utils
+
+log = logging.getLogger('brownthrower.profiling')
+
+# Tag to override the sampling frequency (in Hz) of the stacks of a job
+TAG_SAMPLE_HZ = 'bt_sample_hz'
+
+# Number of frames kept by tracemalloc for each allocation
+MEMORY_FRAMES = 1
+
+# Number of allocation sites written in each memory snapshot
+MEMORY_TOP = 15
+
+class _Profile(object):
+    """\
+    Deterministic profile of a single job, dumped when stopped.
+    """
+    
+    def __init__(self, path):
+        self._path    = path
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+    
+    def stop(self):
+        self._profile.disable()
+        try:
+            utils.makedirs(os.path.dirname(self._path))
+            self._profile.dump_stats(self._path)
+        except (IOError, OSError):
+            log.warning("Could not write the profile at «%s»." % self._path, exc_info=True)
+
+class StackSampler(threading.Thread):
+    """\
+    Sample the stack of a thread at a fixed frequency.
+    
+    The samples are counted by stack and written, when stopped, in the collapsed
+    format used to draw flame graphs: one line per stack, with its frames from
+    the outermost separated by semicolons, followed by the number of samples.
+    Unlike :class:`_Profile`, the sampled code runs at full speed.
+    """
+    
+    def __init__(self, path, hz, thread_id=None):
+        super(StackSampler, self).__init__(name='bt_sampler')
+        self.daemon = True
+        
+        self._path      = path
+        self._interval  = 1.0 / hz
+        self._thread_id = thread_id or threading.get_ident()
+        self._counts    = collections.Counter()
+        self._stopped   = threading.Event()
+    
+    @staticmethod
+    def _collapse(frame):
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append('{0}:{1}'.format(os.path.basename(code.co_filename), code.co_name))
+            frame = frame.f_back
+        return ';'.join(reversed(frames))
+    
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is not None:
+                self._counts[self._collapse(frame)] += 1
+    
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        
+        try:
+            with open(self._path, 'w') as f:
+                for stack, count in self._counts.most_common():
+                    f.write('{0} {1}\n'.format(stack, count))
+        except (IOError, OSError):
+            log.warning("Could not write the sampled stacks at «%s»." % self._path, exc_info=True)
+
+class MemoryTracer(threading.Thread):
+    """\
+    Trace the memory allocations of this process with tracemalloc.
+    
+    Every interval seconds, and whenever :meth:`dump` is called, the current
+    and peak traced memory and the allocation sites holding most of it are
+    appended to the given file. While it runs, SIGUSR1 also triggers a
+    snapshot, so the monitor of a job about to exhaust its memory can ask
+    for one before it is killed (see :func:`handle_memory_signal`).
+    """
+    
+    def __init__(self, path, interval):
+        super(MemoryTracer, self).__init__(name='bt_memory')
+        self.daemon = True
+        
+        self._path     = path
+        self._interval = interval
+        self._stopped  = threading.Event()
+        self._lock     = threading.RLock()
+        self._handler  = None
+    
+    def dump(self, reason):
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                return
+            
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            
+            try:
+                with open(self._path, 'a') as f:
+                    f.write("# {0} {1}: current={2} KiB peak={3} KiB\n".format(
+                        time.strftime('%Y-%m-%d %H:%M:%S'), reason, current // 2**10, peak // 2**10,
+                    ))
+                    for stat in snapshot.statistics('lineno')[:MEMORY_TOP]:
+                        frame = stat.traceback[0]
+                        f.write("{0:>10} KiB {1:>8} blocks  {2}:{3}\n".format(
+                            stat.size // 2**10, stat.count, frame.filename, frame.lineno,
+                        ))
+            except (IOError, OSError):
+                log.warning("Could not write the memory snapshot at «%s»." % self._path, exc_info=True)
+    
+    def start(self):
+        global _active_tracer
+        
+        tracemalloc.start(MEMORY_FRAMES)
+        _active_tracer = self
+        if threading.current_thread() is threading.main_thread():
+            self._handler = signal.signal(signal.SIGUSR1, _on_memory_signal)
+        super(MemoryTracer, self).start()
+    
+    def run(self):
+        while not self._stopped.wait(self._interval):
+            self.dump("periodic")
+    
+    def stop(self):
+        global _active_tracer
+        
+        self._stopped.set()
+        self.join()
+        
+        if self._handler is not None:
+            signal.signal(signal.SIGUSR1, self._handler)
+        if _active_tracer is self:
+            _active_tracer = None
+        self.dump("job ended")
+        tracemalloc.stop()
+
+# Memory tracer running in this process, if any
+_active_tracer = None
+
+def _on_memory_signal(*args):
+    tracer = _active_tracer
+    if tracer is not None:
+        tracer.dump("memory threshold exceeded")
+
+def handle_memory_signal():
+    """\
+    Make SIGUSR1 ask the running :class:`MemoryTracer` for a snapshot.
+    
+    The signal is ignored while no memory is being traced, instead of
+    terminating the process as it does by default. Must be called from the
+    main thread.
+    """
+    signal.signal(signal.SIGUSR1, _on_memory_signal)
+
+class Profiler(object):
+    """\
+    Profile a random fraction of the jobs, keeping the stats of each task in its
+    own subdirectory, and sample the stacks of the jobs that ask for it.
+    
+    The profile of each job is stored in ``<directory>/<task>/<id>.pstats``,
+    so the profiles of a task can be aggregated with :func:`merge`. Without a
+    directory, no deterministic profiles are taken.
+    
+    The frequency at which stacks are sampled is taken from the
+    ``bt_sample_hz`` tag of the job, the :attr:`Task.sample_hz` attribute of
+    its task, or else the given default. Zero disables sampling.
+    
+    If memory_interval is given, the memory allocations of the jobs are traced
+    with a :class:`MemoryTracer`. As tracemalloc is global to the process, this
+    is only suitable for jobs running in their own process.
+    """
+    
+    def __init__(self, directory=None, rate=1.0, sample_hz=0, memory_interval=0):
+        self._directory       = os.path.abspath(directory) if directory else None
+        self._rate            = rate
+        self._sample_hz       = sample_hz
+        self._memory_interval = memory_interval
+    
+    @property
+    def directory(self):
+        return self._directory
+    
+    def path(self, job):
+        return os.path.join(self._directory, job.name, '{0}.pstats'.format(job.id))
+    
+    def start(self, job):
+        """\
+        Start profiling a job, if it has been sampled.
+        
+        Return an object whose stop() method ends the profile, or None.
+        """
+        if not self._directory:
+            return None
+        
+        if self._rate < 1.0 and random.random() >= self._rate:
+            return None
+        
+        return _Profile(self.path(job))
+    
+    @staticmethod
+    def _sample_tag(job):
+        """\
+        Return the tag of a job overriding the sampling frequency, or None.
+        
+        Unless the tags of the job have been loaded already, only this one is
+        read, as the others may carry large values such as the log tails.
+        """
+        state = inspect(job, raiseerr=False)
+        if state is None or state.session is None or '_tags' not in state.unloaded:
+            return job.tag.get(TAG_SAMPLE_HZ)
+        
+        return state.session.query(model.Tag.value).filter(
+            model.Tag.job_id == job.id,
+            model.Tag.name   == TAG_SAMPLE_HZ,
+        ).scalar()
+    
+    def sample_hz(self, job):
+        """\
+        Return the frequency at which the stacks of a job must be sampled.
+        """
+        value = self._sample_tag(job)
+        if value is not None:
+            try:
+                return float(value)
+            except ValueError:
+                log.warning("Ignoring invalid tag %s of job %d." % (TAG_SAMPLE_HZ, job.id))
+        
+        sample_hz = getattr(job.task, 'sample_hz', None)
+        if sample_hz is not None:
+            return sample_hz
+        
+        return self._sample_hz
+    
+    @contextlib.contextmanager
+    def sampling(self, job, path):
+        """\
+        Sample the stacks of the calling thread while running a job, writing
+        them into the given path.
+        """
+        hz = self.sample_hz(job)
+        if hz <= 0:
+            yield
+            return
+        
+        sampler = StackSampler(path, hz)
+        sampler.start()
+        try:
+            yield
+        finally:
+            sampler.stop()
+    
+    @contextlib.contextmanager
+    def tracing_memory(self, job, path):
+        """\
+        Trace the memory allocations while running a job, writing snapshots
+        into the given path.
+        """
+        if not self._memory_interval:
+            yield
+            return
+        
+        tracer = MemoryTracer(path, self._memory_interval)
+        tracer.start()
+        try:
+            yield
+        finally:
+            tracer.stop()
+
+def task_profiles(directory, names=None):
+    """\
+    Return a dict with the profile files of each task found in a directory.
+    """
+    profiles = {}
+    for path in sorted(glob.glob(os.path.join(directory, '*', '*.pstats'))):
+        name = os.path.basename(os.path.dirname(path))
+        if not names or name in names:
+            profiles.setdefault(name, []).append(path)
+    
+    return profiles
+
+def merge(paths, stream=None):
+    """\
+    Return a pstats.Stats object aggregating the given profile files.
+    
+    Files which cannot be loaded, such as those of jobs killed while writing
+    them, are skipped.
+    """
+    stats = None
+    for path in paths:
+        try:
+            if stats is None:
+                stats = pstats.Stats(path, stream=stream)
+            else:
+                stats.add(path)
+        except (EOFError, IOError, TypeError, ValueError):
+            log.warning("Skipping unreadable profile «%s»." % path)
+    
+    return stats
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog='profile.merge', add_help=False,
+        description="Aggregate the profiles of the jobs of each task.")
+    parser.add_argument('directory',
+        help="directory where the runners wrote the profiles")
+    parser.add_argument('tasks', nargs='*', metavar='task',
+        help="only report these tasks (default: all)")
+    parser.add_argument('--sort', '-s', default='cumulative',
+        help="sort the functions by this key (default: %(default)s)")
+    parser.add_argument('--limit', '-l', type=int, default=20,
+        help="show this number of functions per task (default: %(default)s)")
+    parser.add_argument('--dump', metavar='DIRECTORY',
+        help="also write the merged stats of each task into %(metavar)s/<task>.pstats")
+    parser.add_argument('--help', '-?', action='help',
+        help='show this help message and exit')
+    
+    return parser.parse_args(args)
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+    
+    options = _parse_args(args)
+    logging.basicConfig(level=logging.WARNING)
+    
+    profiles = task_profiles(options.directory, options.tasks)
+    if not profiles:
+        log.error("No profiles found in «%s»." % options.directory)
+        return 1
+    
+    for name, paths in sorted(profiles.items()):
+        stats = merge(paths, stream=sys.stdout)
+        if stats is None:
+            continue
+        
+        if options.dump:
+            utils.makedirs(options.dump)
+            stats.dump_stats(os.path.join(options.dump, '{0}.pstats'.format(name)))
+        
+        print("### TASK %s (%d profiled jobs)" % (name, len(paths)))
+        stats.strip_dirs().sort_stats(options.sort).print_stats(options.limit)
+
+if __name__ == '__main__':
+    sys.exit(main())
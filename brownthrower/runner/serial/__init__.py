@@ -3,22 +3,26 @@
 
 import argparse
 import brownthrower as bt
+import collections
 import contextlib
 import errno
 import logging
+import multiprocessing
 import os
 import select
 import signal
+import socket
 import sys
 import threading
 import time
 import uuid
 import random
 
+from brownthrower import cache, logstore, metrics, profiling, tracing
 from brownthrower.utils import SelectableQueue
 from sqlalchemy.orm.exc import NoResultFound
 
-from . import process
+from . import pilot, process, thread
 
 log = logging.getLogger('brownthrower.runner.serial')
 
@@ -30,25 +34,99 @@ class SerialRunner(object):
     def __init__(self, options):
         db_url = options.get('database_url')
         
-        self._session_maker = bt.session_maker(db_url)
         self._allowed_tasks = options.get('allowed_tasks', None)
         self._job_id        = options.pop('job_id', None)
-        self._log_dir       = options.pop('log_dir')
+        self._logs          = self._log_store(options)
         self._loop          = options.pop('loop', None)
         self._submit        = options.pop('submit', False)
-        self._profile       = options.pop('profile', False)
+        self._profile       = self._profiler(options)
         self._token         = options.pop('reserved', uuid.uuid1().hex)
+        self._slots         = options.pop('slots', 1)
+        self._policy        = options.pop('policy', 'random')
+        self._affinity      = options.pop('affinity', None)
+        self._fuse          = options.pop('fuse_chains', False)
+        self._backend       = options.pop('backend', 'process')
+        
+        # Each job thread keeps a connection while it runs, besides the runner
+        pool_size = self._slots + 1 if self._backend == 'thread' else None
+        self._session_maker = bt.session_maker(db_url, pool_size=pool_size)
+        self._console       = not options.pop('no_console', False)
+        self._log_tail      = options.pop('log_tail', 16) * 2**10
+        self._soft_rss      = options.pop('soft_rss', 0) * 2**10
+        
+        self._pilot = None
+        deadline = options.pop('deadline', None)
+        walltime = options.pop('walltime', None)
+        if walltime is not None:
+            deadline = time.time() + walltime
+        if deadline is not None:
+            self._pilot = pilot.Pilot(
+                deadline        = deadline,
+                grace           = options.pop('grace', 60),
+                quantile        = options.pop('runtime_quantile', 0.95),
+                unknown_runtime = options.pop('unknown_runtime', 0),
+            )
+        
+        self._running  = {}
+        self._spans    = {}
+        self._finished = collections.deque(maxlen=100)
+        self._runnable = set()
+        
+        # Channels notifying runnable jobs, set when listening
+        self._runnable_channels = set()
+        self._drained  = False
+        
+        self._q_output = None
+        output_cache = options.pop('output_cache', 0)
+        if output_cache and self._session_maker.bind.url.drivername != 'postgresql':
+            # Outdated outputs are only dropped when notified
+            log.warning("The output cache requires PostgreSQL notifications. Disabling it.")
+        elif output_cache:
+            cache.outputs.resize(output_cache * 2**20)
+            self._q_output = SelectableQueue()
         
         self._debug = {}
         if options.get('debug'):
             self._debug['host'] = options.get('debug_host')
             self._debug['port'] = options.get('debug_port')
         
+        trace = options.pop('trace', None)
+        if trace:
+            tracing.enable(trace)
+        
+        if 'sql_stats' in options:
+            bt.engine.instrument(options.pop('sql_stats'))
+        
+        metrics_port = options.pop('metrics_port', None)
+        if metrics_port is not None:
+            metrics.enable(metrics_port, options.pop('metrics_host', '127.0.0.1'))
+            metrics.set_gauge('bt_slots', self._slots)
+        
         self._lock = threading.Lock()
         
         signal.signal(signal.SIGINT,  self._system_exit)
         signal.signal(signal.SIGTERM, self._system_exit)
     
+    def _log_store(self, options):
+        root     = options.pop('log_dir')
+        layout   = options.pop('log_layout', 'flat')
+        compress = options.pop('log_compress', False)
+        
+        if layout == logstore.SegmentLogStore.layout:
+            # Each runner appends to its own segment
+            name = '{0}_{1}'.format(socket.gethostname(), os.getpid())
+            return logstore.SegmentLogStore(root, compress, name)
+        
+        return logstore.LAYOUTS[layout](root, compress)
+    
+    def _profiler(self, options):
+        return profiling.Profiler(
+            directory       = options.pop('profile', None),
+            rate            = options.pop('profile_rate', 1.0),
+            sample_hz       = options.pop('sample_hz', 0),
+            memory_interval = options.pop('trace_memory', 0),
+        )
+    
     def _system_exit(self, *args, **kwargs):
         if self._lock.acquire(False):
             log.warning("Caught signal. Terminating...")
@@ -56,6 +134,7 @@ class SerialRunner(object):
         else:
             log.warning("Caught signal. Terminating already in progress...")
     
+    @bt.engine.instrumented('must_terminate')
     def _must_terminate(self, job_id):
         with bt.transactional_session(self._session_maker) as session:
             job = session.query(bt.Job).filter_by(
@@ -66,94 +145,395 @@ class SerialRunner(object):
             
             return not bool(job)
     
-    def _run_job(self, job_id, q_finish, q_abort, token, submit=False):
-        proc = process.Monitor(
-            db_url   = self._session_maker.bind.url,
-            job_id   = job_id,
-            token    = token,
-            submit   = submit,
-            q_finish = q_finish,
-            debug    = self._debug,
-            log_dir  = self._log_dir,
-            profile  = self._profile
-        )
+    def _bundle_for(self, job, jobs):
+        """\
+        Return other runnable jobs of the same task to be run along with a job.
+        """
+        try:
+            size = bt.tasks[job[1]].bundle_size
+        except KeyError:
+            return []
+        
+        if size > 1 and self._pilot:
+            # Do not bundle more jobs than those expected to end in time
+            with bt.transactional_session(self._session_maker) as session:
+                estimate = self._pilot.estimate(session, job[1])
+            if estimate > 0:
+                size = min(size, int(self._pilot.remaining() // estimate))
         
+        return [
+            other[0]
+            for other in jobs
+            if other[1] == job[1] and other[0] != job[0] and other[3] in [None, self._token]
+        ][:max(size - 1, 0)]
+    
+    def _spawn_job(self, job_id, q_finish, token, submit=False, bundle=None):
+        if self._backend == 'thread':
+            proc = thread.JobThread(
+                session_maker = self._session_maker,
+                job_id        = job_id,
+                token         = token,
+                submit        = submit,
+                q_finish      = q_finish,
+                logs          = self._logs,
+                profile       = self._profile,
+                affinity      = self._affinity,
+                console       = self._console,
+                log_tail      = self._log_tail,
+            )
+        else:
+            proc = process.Monitor(
+                db_url        = self._session_maker.bind.url,
+                job_id        = job_id,
+                token         = token,
+                submit        = submit,
+                q_finish      = q_finish,
+                debug         = self._debug,
+                logs          = self._logs,
+                profile       = self._profile,
+                affinity      = self._affinity,
+                q_output      = self._q_output,
+                fuse          = self._fuse,
+                allowed_tasks = self._allowed_tasks,
+                bundle        = bundle,
+                console       = self._console,
+                log_tail      = self._log_tail,
+                soft_rss      = self._soft_rss,
+                pilot         = self._pilot,
+            )
+        
+        # The span of the whole job is ended by the runner, once it is reaped
+        span = tracing.start_span('job', job_id=job_id)
+        
+        # Register the job before starting it, as it may end and be reaped
+        # by another thread before start() returns
+        self._running[job_id] = proc
+        self._spans[job_id]   = span
         try:
-            proc.start()
-            
-            while True:
-                try:
-                    r, _, _ = select.select([q_abort, q_finish], [], [], None)
-                    if q_abort in r:
-                        for _, payload in q_abort:
-                            if int(payload) == job_id:
-                                if self._must_terminate(job_id):
-                                    proc.terminate()
-                    if not q_finish.empty():
-                        q_finish.get()
-                        break
-                
-                except select.error as e:
-                    if e.args[0] != errno.EINTR:
-                        raise
+            with tracing.use(span):
+                proc.start()
+        except:
+            del self._running[job_id]
+            del self._spans[job_id]
+            if span:
+                span.end()
+            raise
+        
+        metrics.set_gauge('bt_slots_busy', len(self._running))
+    
+    def _wait_events(self, q_finish, q_abort, timeout=None):
+        """\
+        Wait until a running job ends or an event arrives, and process them.
+        """
+        queues = [q_abort, q_finish]
+        if self._q_output:
+            queues.append(self._q_output)
+        
+        try:
+            r, _, _ = select.select(queues, [], [], timeout)
+            if q_abort in r:
+                for job_id, proc in self._aborted_jobs(q_abort):
+                    if self._must_terminate(job_id):
+                        proc.terminate()
+            self._receive_outputs()
+            while q_finish.poll():
+                proc = self._pop_finished(q_finish.get())
+                if proc:
+                    proc.join()
+        
+        except select.error as e:
+            if e.args[0] != errno.EINTR:
+                raise
+    
+    def _aborted_jobs(self, q_abort):
+        """\
+        Return the running jobs affected by the notifications received.
+        
+        Jobs notified as runnable are kept to be claimed first, if this runner
+        is allowed to run them.
+        """
+        aborted = []
+        for channel, payload in q_abort:
+            if channel in self._runnable_channels:
+                self._runnable.update(
+                    job_id
+                    for job_id, name in bt.engine.decode(payload)
+                    if bt.Job._name_matches(name, self._allowed_tasks)
+                )
+                continue
             
-        except SystemExit:
+            for job_id in bt.engine.decode(payload):
+                cache.outputs.invalidate(job_id)
+                for proc in list(self._running.values()):
+                    if proc.current_job_id == job_id:
+                        aborted.append((job_id, proc))
+        
+        return aborted
+    
+    def _receive_outputs(self):
+        while self._q_output and self._q_output.poll():
+            job_id, raw_output = self._q_output.get()
+            cache.outputs.put(job_id, raw_output)
+    
+    def _pop_finished(self, job_id):
+        proc = self._running.pop(job_id, None)
+        span = self._spans.pop(job_id, None)
+        if span:
+            span.end()
+        metrics.set_gauge('bt_slots_busy', len(self._running))
+        if proc and self._affinity is not None:
+            self._finished.append(proc.current_job_id)
+        
+        return proc
+    
+    def _wait_timeout(self):
+        if self._pilot and not self._drained:
+            return max(0, self._pilot.remaining())
+    
+    def _drain(self):
+        """\
+        Cancel all the jobs still running when the allocation is about to end.
+        """
+        for job_id, proc in list(self._running.items()):
+            log.warning("Cancelling job %d as the deadline is approaching." % job_id)
+            proc.terminate()
+        
+        self._drained = True
+    
+    def _terminate_all(self):
+        for proc in self._running.values():
             if proc.is_alive():
                 proc.terminate()
-                raise
-        finally:
-            if proc.is_alive():
-                proc.join()
+        for proc in self._running.values():
+            proc.join()
+        self._running.clear()
     
-    def _run_one(self, q_finish, q_abort):
-        with bt.transactional_session(self._session_maker) as session:
-            jobs = session.query(bt.Job).filter(
-                bt.Job.status == bt.Job.Status.QUEUED,
-                bt.Job._name_like(self._allowed_tasks),
-                ~ bt.Job.parents.any(bt.Job.status != bt.Job.Status.DONE), # @UndefinedVariable
-            )
-            job_ids = [job.id for job in jobs]
+    def _run_job(self, job_id, q_finish, q_abort, token, submit=False):
+        self._spawn_job(job_id, q_finish, token, submit)
+        
+        while job_id in self._running:
+            self._wait_events(q_finish, q_abort)
+    
+    def _runnable_filter(self):
+        return [
+            bt.Job.status == bt.Job.Status.QUEUED,
+            bt.Job._name_like(self._allowed_tasks),
+            ~ bt.Job.parents.any(bt.Job.status != bt.Job.Status.DONE), # @UndefinedVariable
+        ]
+    
+    def _run_affine(self, q_finish):
+        """\
+        Run a runnable child of the jobs that have recently finished in this runner.
+        """
+        while self._finished:
+            with bt.transactional_session(self._session_maker) as session:
+                jobs = session.query(bt.Job.id, bt.Job.name).join(
+                    bt.Dependency, bt.Dependency.child_id == bt.Job.id
+                ).filter(
+                    bt.Dependency.parent_id == self._finished[0],
+                    *self._runnable_filter()
+                ).all()
+                
+                if self._pilot:
+                    jobs = [
+                        (job_id, name)
+                        for job_id, name in jobs
+                        if self._pilot.fits(session, name)
+                    ]
+            
+            for job_id, _ in jobs:
+                if job_id in self._running:
+                    continue
+                try:
+                    self._spawn_job(job_id, q_finish, self._token)
+                    return
+                except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
+                    pass
+            
+            self._finished.popleft()
+        
+        raise NoRunnableJobFound()
+    
+    def _run_one(self, q_finish):
+        started = time.time()
+        with tracing.span('claim'), bt.engine.operation('claim'):
+            self._claim_one(q_finish)
+        metrics.observe('bt_claim_seconds', time.time() - started)
+    
+    def _claimable(self, session, *criteria):
+        """\
+        Return the id, name, bottom level and token of the runnable jobs that
+        match the given criteria and that this runner may start.
+        """
+        jobs = session.query(
+            bt.Job.id, bt.Job.name, bt.Job.bottom_level, bt.Job.token
+        ).filter(
+            *(self._runnable_filter() + list(criteria))
+        ).all()
+        
+        if self._pilot:
+            jobs = [
+                job
+                for job in jobs
+                if self._pilot.fits(session, job[1])
+            ]
         
+        return [job for job in jobs if job[0] not in self._running]
+    
+    def _spawn_any(self, jobs, q_finish):
+        """\
+        Start one of the given jobs, following the claiming policy, and return
+        its id and those of its bundle.
+        """
         # Shuffle jobs to avoid multiple jobs getting the same id
-        random.shuffle(job_ids)
-
-        for job_id in job_ids:
+        random.shuffle(jobs)
+        
+        if self._policy == 'critical-path':
+            # Prefer the jobs in the longest path. Ties keep the random order.
+            jobs.sort(key=lambda job: job[2], reverse=True)
+        
+        # Leave for the end the jobs reserved by other runners
+        jobs.sort(key=lambda job: job[3] not in [None, self._token])
+        
+        for job in jobs:
+            bundle = self._bundle_for(job, jobs)
             try:
-                self._run_job(job_id, q_finish, q_abort, self._token)
-                return
+                self._spawn_job(job[0], q_finish, self._token, bundle=bundle)
+                return [job[0]] + bundle
             except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
                 pass
         
         raise NoRunnableJobFound()
     
-    def _run_all(self, q_finish, q_abort):
-        while True:
+    def _run_notified(self, q_finish):
+        """\
+        Run one of the jobs notified as runnable, looking only for those.
+        
+        The jobs reserved by other runners are left for the regular claim, and
+        the others not started are kept for the next claims.
+        """
+        if not self._runnable:
+            raise NoRunnableJobFound()
+        
+        with bt.transactional_session(self._session_maker) as session:
+            jobs = []
+            for ids in bt.model._chunks(self._runnable):
+                jobs.extend(self._claimable(session, bt.Job.id.in_(ids)))
+        
+        jobs = [job for job in jobs if job[3] in [None, self._token]]
+        self._runnable = set(job[0] for job in jobs)
+        
+        started = self._spawn_any(jobs, q_finish)
+        self._runnable.difference_update(started)
+    
+    def _claim_one(self, q_finish):
+        if self._affinity is not None:
             try:
-                self._run_one(q_finish, q_abort)
+                return self._run_affine(q_finish)
             except NoRunnableJobFound:
+                pass
+        
+        # Look for every runnable job only when no notified one can be started
+        try:
+            return self._run_notified(q_finish)
+        except NoRunnableJobFound:
+            pass
+        
+        with bt.transactional_session(self._session_maker) as session:
+            jobs = self._claimable(session)
+        
+        self._spawn_any(jobs, q_finish)
+    
+    def _run_all(self, q_finish, q_abort):
+        while True:
+            if self._pilot and self._pilot.expired():
+                if not self._drained:
+                    self._drain()
+            else:
+                while len(self._running) < self._slots:
+                    try:
+                        self._run_one(q_finish)
+                    except NoRunnableJobFound:
+                        break
+            
+            if not self._running:
                 break
+            
+            self._wait_events(q_finish, q_abort, self._wait_timeout())
     
-    def main(self):
+    def _open_queues(self):
         q_finish = SelectableQueue()
         if self._session_maker.bind.url.drivername == 'postgresql':
             q_abort = bt.Notifications(self._session_maker)
-            q_abort.listen(q_abort.channel.job_delete)
-            q_abort.listen(q_abort.channel.job_update)
+            channels = [
+                q_abort.channel.job_delete,
+                q_abort.channel.job_update,
+                q_abort.channel.job_runnable,
+            ]
+            
+            # Without wildcards, only the events of the allowed tasks are received
+            names = self._allowed_tasks
+            if names and not self._job_id and not any(c in name for name in names for c in '*?[]'):
+                channels = [
+                    q_abort.channel.for_task(channel, name)
+                    for channel in channels
+                    for name in names
+                ]
+            
+            self._runnable_channels = set(
+                channel
+                for channel in channels
+                if channel.startswith(q_abort.channel.job_runnable)
+            )
+            q_abort.listen(channels)
         else:
             # Fallback dummy implementation
             q_abort = SelectableQueue()
         
-        if self._job_id:
-            self._run_job(self._job_id, q_finish, q_abort, self._token, self._submit)
-        else:
-            while True:
-                self._run_all(q_finish, q_abort)
-                
-                if not self._loop:
-                    return
-                
-                log.info("No runnable jobs found. Sleeping %d seconds until next iteration." % self._loop)
-                time.sleep(self._loop)
+        return q_finish, q_abort
+    
+    def _idle(self, q_finish, q_abort, delay):
+        """\
+        Wait the given number of seconds, or until a job is notified as runnable.
+        """
+        deadline = time.time() + delay
+        while not self._runnable and time.time() < deadline:
+            self._wait_events(q_finish, q_abort, deadline - time.time())
+    
+    def _sleep_delay(self):
+        """\
+        Return the number of seconds to sleep until the next iteration, or None
+        if the runner must end.
+        """
+        if not self._loop:
+            return None
+        
+        if self._pilot and self._pilot.expired():
+            log.info("Deadline reached. No more jobs will be run.")
+            return None
+        
+        delay = self._loop
+        if self._pilot:
+            delay = min(delay, self._pilot.remaining())
+        log.info("No runnable jobs found. Sleeping %d seconds until next iteration." % delay)
+        return delay
+    
+    def main(self):
+        q_finish, q_abort = self._open_queues()
+        
+        try:
+            if self._job_id:
+                self._run_job(self._job_id, q_finish, q_abort, self._token, self._submit)
+            else:
+                while True:
+                    self._run_all(q_finish, q_abort)
+                    
+                    delay = self._sleep_delay()
+                    if delay is None:
+                        return
+                    self._idle(q_finish, q_abort, delay)
+        finally:
+            self._terminate_all()
 
 def _parse_args(args = None):
     parser = argparse.ArgumentParser(prog='runner.serial', add_help=False)
@@ -163,9 +543,31 @@ def _parse_args(args = None):
         help="use the settings in %(metavar)s to establish the database connection")
     parser.add_argument('--log-dir', metavar='PATH', default='.',
         help="place the copy of stdout and stderr of each job in %(metavar)s. [default: '%(default)s']")
+    parser.add_argument('--log-layout', choices=sorted(logstore.LAYOUTS), default=argparse.SUPPRESS,
+        help="store the logs of each job in a flat directory, in hashed subdirectories, or appended to a segment file of this runner (default: flat)")
+    parser.add_argument('--log-compress', action='store_true', default=argparse.SUPPRESS,
+        help="compress the logs of each job once it has ended")
+    parser.add_argument('--log-tail', type=int, default=argparse.SUPPRESS, metavar='KIB',
+        help="keep the last %(metavar)s KiB of the stdout and stderr of failed jobs, compressed, in their tags (default: 16)")
+    parser.add_argument('--no-console', action='store_true', default=argparse.SUPPRESS,
+        help="write the stdout and stderr of each job only to its log files, not to the console")
+    parser.add_argument('--affinity', type=int, nargs='?', const=0, default=argparse.SUPPRESS, metavar='SECONDS',
+        help="prefer running the children of the jobs finished by this runner, reserving them for %(metavar)s seconds (default: %(const)s)")
+    parser.add_argument('--backend', choices=['process', 'thread'], default=argparse.SUPPRESS,
+        help="run each job in its own process, or in a thread of the runner for I/O-bound tasks (default: process)")
+    parser.add_argument('--event-loop', action='store_true', default=argparse.SUPPRESS,
+        help="drive the runner with an asyncio event loop, to supervise many concurrent jobs")
+    parser.add_argument('--fuse-chains', action='store_true', default=argparse.SUPPRESS,
+        help="run the only child of a finished job in the same process, if it has no other parents and is expected to end in time, passing the output in memory. "
+             "Jobs of tasks with a bundle size are run in bundles instead")
+    parser.add_argument('--policy', choices=['random', 'critical-path'], default=argparse.SUPPRESS,
+        help="order in which runnable jobs are claimed: at random, or those in the longest remaining path first (default: random)")
     parser.add_argument('--help', '-?', action='help',
         help='show this help message and exit')
     
+    parser.add_argument('--output-cache', type=int, default=argparse.SUPPRESS, metavar='MiB',
+        help="keep up to %(metavar)s of recent job outputs in memory, to be reused by their children. Only on PostgreSQL, which notifies the outputs that change (default: 0)")
+    
     group = parser.add_mutually_exclusive_group()
     group.add_argument('--job-id', '-j', type=int, default=argparse.SUPPRESS, metavar='ID',
         help="run only the job identified by %(metavar)s")
@@ -178,6 +580,21 @@ def _parse_args(args = None):
     group.add_argument('--submit', '-s', action='store_true', default=False,
         help='in conjunction with --job-id, submit the job before executing')
     
+    group = parser.add_argument_group(title='pilot')
+    group.add_argument('--slots', '-n', type=int, nargs='?', const=multiprocessing.cpu_count(), default=argparse.SUPPRESS, metavar='NUMBER',
+        help="run up to %(metavar)s jobs concurrently (default: %(const)s)")
+    deadline = group.add_mutually_exclusive_group()
+    deadline.add_argument('--walltime', type=pilot.parse_walltime, default=argparse.SUPPRESS, metavar='[D-][HH:]MM:SS',
+        help="only run jobs expected to end within this amount of time")
+    deadline.add_argument('--deadline', type=pilot.parse_deadline, default=argparse.SUPPRESS, metavar='TIMESTAMP',
+        help="only run jobs expected to end before this date and time")
+    group.add_argument('--grace', type=int, default=argparse.SUPPRESS, metavar='SECONDS',
+        help="stop running jobs %(metavar)s seconds before the deadline (default: 60)")
+    group.add_argument('--runtime-quantile', type=float, default=argparse.SUPPRESS, metavar='QUANTILE',
+        help="estimate the runtime of a task as this quantile of its previous runs (default: 0.95)")
+    group.add_argument('--unknown-runtime', type=int, default=argparse.SUPPRESS, metavar='SECONDS',
+        help="assumed runtime of tasks that have never been run before (default: 0)")
+    
     group = parser.add_argument_group(title='debug')
     group.add_argument('--debug', '-d', action='store_true',
         help='run the task inside a remote debugging session')
@@ -186,8 +603,24 @@ def _parse_args(args = None):
     group.add_argument('--debug-port', '-p', default=5678, type=int,
         help='connect using this port (default: %(default)s)')
     
-    parser.add_argument('--profile', action='store_true', default=False,
-        help='profile job and dump stats to a file')
+    parser.add_argument('--profile', nargs='?', const='.', default=argparse.SUPPRESS, metavar='DIRECTORY',
+        help="profile jobs and dump their stats into %(metavar)s/<task>/<id>.pstats (default: %(const)s)")
+    parser.add_argument('--profile-rate', type=float, default=argparse.SUPPRESS, metavar='FRACTION',
+        help="profile only this random fraction of the jobs (default: 1.0)")
+    parser.add_argument('--sample-hz', type=float, default=argparse.SUPPRESS, metavar='HZ',
+        help="sample the stacks of every job %(metavar)s times per second, storing them with its logs (default: only for tasks or jobs asking for it)")
+    parser.add_argument('--trace-memory', type=float, nargs='?', const=10, default=argparse.SUPPRESS, metavar='SECONDS',
+        help="trace the memory allocations of each job with tracemalloc, storing a snapshot every %(metavar)s seconds with its logs (default: %(const)s)")
+    parser.add_argument('--soft-rss', type=int, default=argparse.SUPPRESS, metavar='MIB',
+        help="warn when a job uses more than %(metavar)s MiB of resident memory, and take a memory snapshot if traced")
+    parser.add_argument('--trace', default=argparse.SUPPRESS, metavar='FILE',
+        help="append the timing of each phase of the jobs to %(metavar)s, as JSON lines, to be summarized with trace.summary")
+    parser.add_argument('--sql-stats', type=float, nargs='?', const=None, default=argparse.SUPPRESS, metavar='SECONDS',
+        help="count and time the queries of each operation in the metrics, logging those slower than %(metavar)s")
+    parser.add_argument('--metrics-port', type=int, default=argparse.SUPPRESS, metavar='PORT',
+        help="serve the metrics of this runner in the Prometheus text format at http://HOST:%(metavar)s/metrics")
+    parser.add_argument('--metrics-host', default=argparse.SUPPRESS, metavar='HOST',
+        help="address where the metrics are served (default: 127.0.0.1)")
     parser.add_argument('--verbose', '-v', action='count', default=0,
         help='increment verbosity level (can be specified twice)')
     parser.add_argument('--version', '-V', action='version',
@@ -211,7 +644,11 @@ def main(args=None):
     #from pysrc import pydevd
     #pydevd.settrace(port=5678)
     
-    runner = SerialRunner(options)
+    runner_class = SerialRunner
+    if options.pop('event_loop', False):
+        from .aio import AsyncRunner as runner_class
+    
+    runner = runner_class(options)
     try:
         runner.main()
     except SystemExit:
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import asyncio
+import functools
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+from . import NoRunnableJobFound, SerialRunner
+
+log = logging.getLogger('brownthrower.runner.serial')
+
+class AsyncRunner(SerialRunner):
+    """\
+    Serial runner driven by an asyncio event loop.
+    
+    Finished jobs, produced outputs and abort notifications are handled as
+    soon as their file descriptors become readable, while claiming, checking
+    and supervising jobs are coroutines. The blocking database work is run in
+    a dedicated worker thread, so the loop is always responsive and a single
+    runner may supervise a whole node's worth of jobs.
+    """
+    
+    def __init__(self, options):
+        super(AsyncRunner, self).__init__(options)
+        
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bt_db')
+        self._wakeup   = None
+    
+    async def _call(self, fn, *args, **kwargs):
+        """\
+        Run a blocking function in the database worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+    
+    def _on_abort(self, q_abort):
+        for job_id, proc in self._aborted_jobs(q_abort):
+            asyncio.ensure_future(self._abort(job_id, proc))
+        
+        # Jobs notified as runnable are claimed right away
+        if self._runnable:
+            self._wakeup.set()
+    
+    async def _abort(self, job_id, proc):
+        if await self._call(self._must_terminate, job_id):
+            await self._call(proc.terminate)
+    
+    def _on_output(self):
+        self._receive_outputs()
+    
+    def _on_finish(self, q_finish):
+        while q_finish.poll():
+            proc = self._pop_finished(q_finish.get())
+            if proc:
+                asyncio.ensure_future(self._reap(proc))
+        
+        self._wakeup.set()
+    
+    async def _reap(self, proc):
+        await self._call(proc.join)
+    
+    async def _claim(self, q_finish):
+        """\
+        Fill the free slots with runnable jobs.
+        """
+        while len(self._running) < self._slots:
+            try:
+                await self._call(self._run_one, q_finish)
+            except NoRunnableJobFound:
+                break
+    
+    async def _wait(self, timeout=None):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    
+    async def _run_job(self, job_id, q_finish, token, submit=False):
+        await self._call(self._spawn_job, job_id, q_finish, token, submit)
+        
+        while job_id in self._running:
+            self._wakeup.clear()
+            await self._wait()
+    
+    async def _run_all(self, q_finish):
+        while True:
+            # Events arriving while claiming must not be lost
+            self._wakeup.clear()
+            
+            if self._pilot and self._pilot.expired():
+                if not self._drained:
+                    await self._call(self._drain)
+            else:
+                await self._claim(q_finish)
+            
+            if not self._running:
+                break
+            
+            await self._wait(self._wait_timeout())
+    
+    async def _main(self, q_finish, q_abort):
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        
+        loop.add_reader(q_abort, self._on_abort, q_abort)
+        loop.add_reader(q_finish, self._on_finish, q_finish)
+        if self._q_output:
+            loop.add_reader(self._q_output, self._on_output)
+        
+        if self._job_id:
+            await self._run_job(self._job_id, q_finish, self._token, self._submit)
+        else:
+            while True:
+                await self._run_all(q_finish)
+                
+                delay = self._sleep_delay()
+                if delay is None:
+                    return
+                self._wakeup.clear()
+                await self._wait(delay)
+    
+    def main(self):
+        q_finish, q_abort = self._open_queues()
+        
+        try:
+            asyncio.run(self._main(q_finish, q_abort))
+        finally:
+            self._terminate_all()
+            self._executor.shutdown(wait=False)
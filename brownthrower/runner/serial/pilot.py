@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import logging
+import time
+
+import brownthrower as bt
+
+log = logging.getLogger('brownthrower.runner.serial')
+
+def parse_walltime(value):
+    """\
+    Parse a walltime specification into a number of seconds.
+    
+    Accepted formats are those commonly used by batch systems: 'SS', 'MM:SS',
+    'HH:MM:SS' and 'D-HH:MM:SS'.
+    """
+    try:
+        days = 0
+        if '-' in value:
+            days, value = value.split('-', 1)
+            days = int(days)
+        
+        fields = value.split(':')
+        if len(fields) > 3:
+            raise ValueError(value)
+        
+        seconds = 0
+        for field in fields:
+            seconds = seconds * 60 + int(field)
+        
+        if seconds < 0 or days < 0:
+            raise ValueError(value)
+        
+        return days * 86400 + seconds
+    
+    except ValueError:
+        raise ValueError("Invalid walltime '%s'." % value)
+
+def parse_deadline(value):
+    """\
+    Parse a deadline into a POSIX timestamp.
+    
+    The deadline may be given as a POSIX timestamp or as a local date and time
+    in the formats 'YYYY-MM-DD HH:MM[:SS]' or 'YYYY-MM-DDTHH:MM[:SS]'.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    
+    for fmt in ['%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M']:
+        try:
+            return time.mktime(datetime.datetime.strptime(value, fmt).timetuple())
+        except ValueError:
+            pass
+    
+    raise ValueError("Invalid deadline '%s'." % value)
+
+class Pilot(object):
+    """\
+    Decide which jobs fit in the time remaining in a batch allocation.
+    
+    The runtime of each task is estimated from the statistics of its previous
+    successful executions. Jobs are only claimed if they are expected to end
+    before the deadline, leaving a grace period to cancel and clean up any job
+    that is still running when the allocation is about to be killed.
+    """
+    
+    def __init__(self, deadline, grace=60, quantile=0.95, unknown_runtime=0, ttl=300):
+        self._deadline        = deadline
+        self._grace           = grace
+        self._quantile        = quantile
+        self._unknown_runtime = unknown_runtime
+        self._ttl             = ttl
+        self._estimates       = {}
+    
+    @property
+    def deadline(self):
+        return self._deadline
+    
+    def remaining(self):
+        """\
+        Number of seconds left to run jobs before draining.
+        """
+        return self._deadline - self._grace - time.time()
+    
+    def expired(self):
+        return self.remaining() <= 0
+    
+    def estimate(self, session, name):
+        """\
+        Return the expected runtime in seconds of a job of the given task.
+        """
+        estimate, expires = self._estimates.get(name, (None, 0))
+        if expires > time.time():
+            return estimate
+        
+        stats = bt.TaskStats.summary(session, [name]).get(name)
+        estimate = stats.quantile(self._quantile) if stats else None
+        if estimate is None:
+            estimate = self._unknown_runtime
+        
+        log.debug("Estimated runtime for task «%s» is %.1f seconds." % (name, estimate))
+        self._estimates[name] = (estimate, time.time() + self._ttl)
+        return estimate
+    
+    def fits(self, session, name):
+        """\
+        Return True if a job of the given task is expected to end in time.
+        """
+        return self.estimate(session, name) <= self.remaining()
@@ -1,13 +1,16 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import collections
 import errno
 import logging
 import multiprocessing
 import os
+import resource
 import signal
 import sys
 import threading
+import time
 import traceback
 
 from sqlalchemy.exc import InternalError
@@ -15,22 +18,41 @@ from sqlalchemy.orm import undefer_group, joinedload
 from sqlalchemy.orm.exc import NoResultFound
 
 import brownthrower as bt
+from brownthrower import cache, logstore, metrics, profiling, rusage, tracing
 
 log = logging.getLogger('brownthrower.runner.serial')
 
 # Number of seconds to wait between SIGTERM and SIGKILL when terminating a job
 KILL_TIMEOUT=2
 
+# Size of the output cache used to pass outputs along fused chains of jobs
+FUSION_CACHE_SIZE = 16 * 2**20
+
+# Number of seconds between checks of the memory used by a job
+RSS_CHECK_INTERVAL = 1
+
 class Job(multiprocessing.Process):
-    def __init__(self, db_url, job_id, token, debug, log_dir, profile):
+    def __init__(self, db_url, job_id, token, debug, logs, profile, affinity=None, q_output=None,
+                 fuse=False, allowed_tasks=None, current=None, bundle=None, console=True, log_tail=0,
+                 spawned=None, pilot=None):
         super(Job, self).__init__(name='bt_job_%d' % job_id)
-        self._job_id  = job_id
-        self._db_url  = db_url
-        self._token   = token
-        self._debug   = debug
-        self._log_dir = log_dir
-        self._profile = profile
-        self._lock    = threading.Lock()
+        self._job_id        = job_id
+        self._pilot         = pilot
+        self._spawned       = spawned
+        self._console       = console
+        self._log_tail      = log_tail
+        self._bundle        = bundle or []
+        self._db_url        = db_url
+        self._token         = token
+        self._debug         = debug
+        self._logs          = logs
+        self._profile       = profile
+        self._affinity      = affinity
+        self._q_output      = q_output
+        self._fuse          = fuse
+        self._allowed_tasks = allowed_tasks
+        self._current       = current
+        self._lock          = threading.Lock()
     
     def _system_exit(self, *args, **kwargs):
         if self._lock.acquire(False):
@@ -42,17 +64,85 @@ class Job(multiprocessing.Process):
     def _run_job(self):
         session_maker = bt.session_maker(self._db_url)
         with bt.transactional_session(session_maker, read_only=True) as session:
-            job = session.query(bt.Job).filter_by(
-                id = self._job_id
-            ).options(
-                undefer_group('yaml'),
-                joinedload(bt.Job.subjobs),
-            ).one()
+            with tracing.span('load', job_id=self._job_id), bt.engine.operation('load'):
+                job = session.query(bt.Job).filter_by(
+                    id = self._job_id
+                ).options(
+                    undefer_group('yaml'),
+                    joinedload(bt.Job.subjobs),
+                ).one()
             
-            return job._run(self._token, self._debug, self._profile)
+            with self._profile.sampling(job, self._logs.path(job.id, logstore.STACKS)):
+                with self._profile.tracing_memory(job, self._logs.path(job.id, logstore.MEMORY)):
+                    with tracing.span('run', job_id=self._job_id, task=job.name), bt.engine.operation('run'):
+                        return job._run(self._token, self._debug, self._profile)
+    
+    def _execute_job(self):
+        new_state = {}
+        started   = rusage.snapshot()
+        try:
+            new_state = self._run_job()
+        except (
+            bt.InvalidStatusException,
+            bt.TokenMismatchException,
+            bt.TaskNotAvailableException,
+            NoResultFound,
+        ):
+            log.warning("An error was found running job %d" % self._job_id, exc_info=True)
+        except InternalError:
+            new_state['traceback'] = ''.join(traceback.format_exception(*sys.exc_info()))
+        
+        new_state['rusage'] = rusage.delta(started, rusage.snapshot())
+        return new_state
+    
+    def _capture(self, tails):
+        """\
+        Capture the output of the current job into its log files.
+        """
+        return bt.clone_stdout_stderr(*self._logs.paths(self._job_id), console=self._console, tails=tails)
+    
+    @staticmethod
+    def _keep_tails(new_state, tails):
+        """\
+        Pass the tail of the output along with the new state of the job, so it
+        is kept if the job failed.
+        """
+        if tails:
+            new_state['log_tail'] = dict((stream, ring.getvalue()) for stream, ring in tails.items())
+        return new_state
+    
+    def _share_output(self, job_id, raw_output):
+        # Keep the output in memory for the next job of the chain
+        cache.outputs.put(job_id, raw_output)
+        # Share the output with the runner, so it can be reused by children
+        if self._q_output:
+            self._q_output.put((job_id, raw_output))
+    
+    def _start_fusible_child(self, session, job):
+        """\
+        Start the next job of a linear chain in the same transaction, if it is
+        expected to end in time.
+        """
+        child = job._fusible_child(self._token, self._allowed_tasks)
+        if not child:
+            return None
+        
+        if self._pilot and not self._pilot.fits(session, child.name):
+            return None
+        
+        try:
+            child._start(self._token)
+            child.tag[bt.model.TAG_LOG] = self._logs.location(child.id)
+            return child
+        except (bt.InvalidStatusException, bt.TokenMismatchException):
+            return None
     
     def _finish_job(self, new_state):
+        """\
+        Finish the current job and return the id of the next job to run, if any.
+        """
         @bt.retry_on_serializable_error
+        @bt.engine.instrumented('finish')
         def finish():
             session_maker = bt.session_maker(self._db_url)
             with bt.transactional_session(session_maker) as session:
@@ -60,41 +150,154 @@ class Job(multiprocessing.Process):
                     id = self._job_id
                 ).one()
                 job._finish(self._token, new_state)
+                
+                child = self._start_fusible_child(session, job) if self._fuse else None
+                next_job_id = child.id if child else None
+                
+                # Publish the next job before committing, so the runner does
+                # not mistake the notification of this one for an abort
+                if self._current:
+                    self._current.value = next_job_id or self._job_id
+                
+                if self._affinity and not next_job_id:
+                    job._reserve_runnable_children(self._token, self._affinity)
+                
+                raw_output = None
+                if job.status == bt.Job.Status.DONE:
+                    raw_output = job.raw_output
+                
+                return raw_output, next_job_id, child.name if child else None
         
+        started = time.time()
         try:
-            finish()
+            try:
+                raw_output, next_job_id, next_name = finish()
+            except:
+                # The next job was not started, so this one is still current
+                if self._current:
+                    self._current.value = self._job_id
+                raise
         except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
-            pass
-    
-    @property
-    def _stdout_fname(self):
-        name = '{job_id}.out'.format(job_id = self._job_id)
-        return os.path.join(self._log_dir, name)
+            return None
+        finally:
+            metrics.observe('bt_finish_seconds', time.time() - started)
+            tracing.record('finish', started, job_id=self._job_id)
+        
+        if next_job_id:
+            metrics.inc('bt_jobs_claimed_total', task=next_name)
+        
+        if raw_output is not None:
+            self._share_output(self._job_id, raw_output)
+        
+        return next_job_id
     
-    @property
-    def _stderr_fname(self):
-        name = '{job_id}.err'.format(job_id = self._job_id)
-        return os.path.join(self._log_dir, name)
+    def _finish_bundle(self, new_states):
+        """\
+        Finish all the jobs of a bundle in a single transaction.
+        
+        Jobs that are no longer running with this token, because they have been
+        cancelled meanwhile, are left untouched.
+        """
+        @bt.retry_on_serializable_error
+        @bt.engine.instrumented('finish')
+        def finish():
+            session_maker = bt.session_maker(self._db_url)
+            with bt.transactional_session(session_maker) as session:
+                jobs = session.query(bt.Job).filter(
+                    bt.Job.id.in_(list(new_states)),
+                    bt.Job.token == self._token,
+                    bt.Job.status == bt.Job.Status.RUNNING,
+                ).all()
+                
+                outputs = {}
+                for job in jobs:
+                    job._finish(self._token, new_states[job.id])
+                    
+                    if self._affinity:
+                        job._reserve_runnable_children(self._token, self._affinity)
+                    
+                    if job.status == bt.Job.Status.DONE:
+                        outputs[job.id] = job.raw_output
+                
+                return outputs
+        
+        started = time.time()
+        try:
+            outputs = finish()
+        except (bt.InvalidStatusException, bt.TokenMismatchException):
+            log.warning("An error was found finishing the bundle of job %d" % self._job_id, exc_info=True)
+            return
+        finally:
+            metrics.observe('bt_finish_seconds', time.time() - started)
+            tracing.record('finish', started, job_id=self._job_id, bundle=len(new_states))
+        
+        for job_id, raw_output in outputs.items():
+            if raw_output is not None:
+                self._share_output(job_id, raw_output)
     
     def run(self):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
         signal.signal(signal.SIGTERM, self._system_exit)
+        # The monitor may ask for a memory snapshot at any time
+        profiling.handle_memory_signal()
+        
+        if self._spawned:
+            metrics.observe('bt_start_overhead_seconds', time.time() - self._spawned)
+            tracing.record('spawn', self._spawned, job_id=self._job_id)
+        
+        # Bundled jobs are finished together, so their children cannot be fused
+        # and are claimed as usual
+        if self._bundle:
+            return self._run_bundle()
         
-        with bt.clone_stdout_stderr(self._stdout_fname, self._stderr_fname):
-            new_state = {}
+        if self._fuse and not cache.outputs.enabled:
+            cache.outputs.resize(FUSION_CACHE_SIZE)
+        
+        while self._job_id:
+            if self._current:
+                self._current.value = self._job_id
+            
+            next_job_id = None
+            new_state   = {}
+            tails       = bt.ring_buffers(self._log_tail)
             try:
-                new_state = self._run_job()
-            except (
-                bt.InvalidStatusException,
-                bt.TokenMismatchException,
-                bt.TaskNotAvailableException,
-                NoResultFound,
-            ):
-                log.warning("An error was found running job %d" % self._job_id, exc_info=True)
-            except InternalError:
-                new_state['traceback'] = ''.join(traceback.format_exception(*sys.exc_info()))
+                # The tails are complete only once the capture has ended
+                with tracing.span('execute', job_id=self._job_id):
+                    with self._capture(tails):
+                        new_state = self._execute_job()
             finally:
-                self._finish_job(new_state)
+                next_job_id = self._finish_job(self._keep_tails(new_state, tails))
+            with tracing.span('store_logs', job_id=self._job_id):
+                self._logs.commit(self._job_id)
+            
+            if next_job_id:
+                log.debug("Running job %d right after its parent %d." % (next_job_id, self._job_id))
+            self._job_id = next_job_id
+    
+    def _run_bundle(self):
+        """\
+        Run several jobs one after the other, finishing all of them at the end.
+        
+        Each job keeps its own log files, and an error in one of them does not
+        affect the others.
+        """
+        new_states = collections.OrderedDict()
+        for job_id in [self._job_id] + self._bundle:
+            self._job_id = job_id
+            if self._current:
+                self._current.value = job_id
+            
+            tails = bt.ring_buffers(self._log_tail)
+            with tracing.span('execute', job_id=job_id):
+                with self._capture(tails):
+                    started = time.time()
+                    new_state = self._execute_job()
+                    new_state['elapsed'] = time.time() - started
+            new_states[job_id] = self._keep_tails(new_state, tails)
+            with tracing.span('store_logs', job_id=job_id):
+                self._logs.commit(job_id)
+        
+        self._finish_bundle(new_states)
     
     def cancel(self):
         if self.is_alive():
@@ -111,17 +314,37 @@ class Job(multiprocessing.Process):
 
 class Monitor(multiprocessing.Process):
     
-    def __init__(self, db_url, job_id, q_finish, token, debug, log_dir, profile, submit=False):
+    def __init__(self, db_url, job_id, q_finish, token, debug, logs, profile, submit=False, affinity=None, q_output=None,
+                 fuse=False, allowed_tasks=None, bundle=None, console=True, log_tail=0, soft_rss=None, pilot=None):
         super(Monitor, self).__init__(name='bt_monitor_%d' % job_id)
-        self._job_id   = job_id
-        self._db_url   = db_url
-        self._q_finish = q_finish
-        self._token    = token
-        self._debug    = debug
-        self._log_dir  = log_dir
-        self._profile  = profile
-        self._submit   = submit
-        self._lock     = threading.Lock()
+        self._job_id        = job_id
+        self._pilot         = pilot
+        self._spawned       = None
+        self._console       = console
+        self._log_tail      = log_tail
+        self._soft_rss      = soft_rss
+        self._candidates    = bundle or []
+        self._bundle        = []
+        self._db_url        = db_url
+        self._q_finish      = q_finish
+        self._token         = token
+        self._debug         = debug
+        self._logs          = logs
+        self._profile       = profile
+        self._submit        = submit
+        self._affinity      = affinity
+        self._q_output      = q_output
+        self._fuse          = fuse
+        self._allowed_tasks = allowed_tasks
+        self._current       = multiprocessing.Value('l', job_id)
+        self._lock          = threading.Lock()
+    
+    @property
+    def current_job_id(self):
+        """\
+        Id of the job being run, which changes when running a chain of jobs.
+        """
+        return self._current.value
     
     def _system_exit(self, *args, **kwargs):
         if self._lock.acquire(False):
@@ -131,6 +354,7 @@ class Monitor(multiprocessing.Process):
             log.warning("Caught signal in monitor. Terminating already in progress...")
     
     @bt.retry_on_serializable_error
+    @bt.engine.instrumented('start')
     def _start_job(self):
         session_maker = bt.session_maker(self._db_url)
         with bt.transactional_session(session_maker) as session:
@@ -142,47 +366,149 @@ class Monitor(multiprocessing.Process):
                 job.submit()
             
             job._start(self._token)
+            job.tag[bt.model.TAG_LOG] = self._logs.location(job.id)
+            
+            bundle = []
+            if self._candidates:
+                bundle = self._start_bundle(session)
+            
+            name = job.name
+        
+        self._bundle = bundle
+        metrics.inc('bt_jobs_claimed_total', 1 + len(bundle), task=name)
     
-    def _cleanup_job(self, reason):
+    def _start_bundle(self, session):
+        """\
+        Start the other jobs of the bundle, skipping those that cannot be run.
+        
+        Each one is started in a savepoint, as a failed start may have reserved
+        the job already. SQLite supports them within its exclusive transaction.
+        """
+        started = []
+        for job in session.query(bt.Job).filter(bt.Job.id.in_(self._candidates)):
+            try:
+                with session.begin_nested():
+                    job._start(self._token)
+                    job.tag[bt.model.TAG_LOG] = self._logs.location(job.id)
+                started.append(job.id)
+            except (bt.InvalidStatusException, bt.TokenMismatchException):
+                pass
+        
+        return sorted(started)
+    
+    def _cleanup_job(self, reason, usage=None):
         @bt.retry_on_serializable_error
-        def _cleanup(tb=None):
+        @bt.engine.instrumented('cleanup')
+        def _cleanup(job_id, tb=None):
             session_maker = bt.session_maker(self._db_url)
             with bt.transactional_session(session_maker) as session:
-                job = session.query(bt.Job).filter_by(id = self._job_id).one()
-                job.cleanup(self._token, tb)
+                job = session.query(bt.Job).filter_by(id = job_id).one()
+                job.cleanup(self._token, tb, usage)
+        
+        with tracing.span('cleanup', job_id=self._job_id):
+            for job_id in self._job_ids():
+                try:
+                    _cleanup(job_id, reason)
+                except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
+                    pass
+    
+    def _children_usage(self):
+        """\
+        Return the resource usage of the job process, once it has been reaped,
+        if it ran only the current job.
+        
+        This accounts for jobs killed before they could record it themselves,
+        such as those exceeding the memory limits of the node.
+        """
+        if self._bundle or self.current_job_id != self._job_id:
+            return None
         
+        return rusage.from_struct(resource.getrusage(resource.RUSAGE_CHILDREN))
+    
+    @staticmethod
+    def _rss(pid):
+        """\
+        Return the resident memory of a process (KiB), or None if unknown.
+        """
         try:
-            _cleanup(reason)
-        except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
-            pass
+            with open('/proc/%d/statm' % pid) as f:
+                return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') // 2**10
+        except (IOError, OSError, ValueError, IndexError):
+            return None
+    
+    def _supervise(self, job_process):
+        """\
+        Wait for the job process, asking it for a memory snapshot once each
+        job exceeds the soft RSS threshold.
+        """
+        if not self._soft_rss:
+            job_process.join()
+            return
+        
+        warned = set()
+        while job_process.is_alive():
+            job_process.join(RSS_CHECK_INTERVAL)
+            
+            job_id = self.current_job_id
+            rss    = self._rss(job_process.pid)
+            if rss is None or rss <= self._soft_rss or job_id in warned:
+                continue
+            
+            warned.add(job_id)
+            log.warning("Job %d is using %d KiB of memory, above the soft limit of %d KiB." % (job_id, rss, self._soft_rss))
+            try:
+                os.kill(job_process.pid, signal.SIGUSR1)
+            except OSError as e:
+                if e.errno != errno.ESRCH:
+                    raise
+    
+    def _job_ids(self):
+        if self._bundle:
+            return [self._job_id] + self._bundle
+        return [self.current_job_id]
     
     def run(self):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
         signal.signal(signal.SIGTERM, self._system_exit)
         
         job_process = Job(
-            db_url  = self._db_url,
-            job_id  = self._job_id,
-            token   = self._token,
-            debug   = self._debug,
-            log_dir = self._log_dir,
-            profile = self._profile,
+            db_url        = self._db_url,
+            job_id        = self._job_id,
+            token         = self._token,
+            debug         = self._debug,
+            logs          = self._logs,
+            profile       = self._profile,
+            affinity      = self._affinity,
+            q_output      = self._q_output,
+            fuse          = self._fuse,
+            allowed_tasks = self._allowed_tasks,
+            current       = self._current,
+            bundle        = self._bundle,
+            console       = self._console,
+            log_tail      = self._log_tail,
+            spawned       = self._spawned,
+            pilot         = self._pilot,
         )
         
         try:
             job_process.start()
-            job_process.join()
+            self._supervise(job_process)
         except SystemExit:
             job_process.cancel()
         finally:
             try:
-                self._cleanup_job("Job aborted with exit code %s" % job_process.exitcode)
+                self._cleanup_job("Job aborted with exit code %s" % job_process.exitcode, self._children_usage())
+                # Store the logs left behind by a job that did not end cleanly
+                for job_id in self._job_ids():
+                    self._logs.commit(job_id)
             finally:
                 self._q_finish.put(self._job_id)
     
     def start(self):
         try:
-            self._start_job()
+            with tracing.span('start', job_id=self._job_id):
+                self._start_job()
+            self._spawned = time.time()
             super(Monitor, self).start()
         except:
             self._cleanup_job("Job was aborted before starting.")
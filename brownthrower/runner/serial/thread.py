@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import sys
+import threading
+import time
+import traceback
+
+from sqlalchemy.exc import InternalError
+from sqlalchemy.orm import undefer_group, joinedload
+from sqlalchemy.orm.exc import NoResultFound
+
+import brownthrower as bt
+from brownthrower import cache, logstore, metrics, tracing
+
+log = logging.getLogger('brownthrower.runner.serial')
+
+class JobThread(threading.Thread):
+    """\
+    Run a job in a thread of the runner process.
+    
+    Intended for tasks that spend most of their time waiting for I/O, so many
+    of them can share the same interpreter. It offers the same interface as
+    :class:`process.Monitor`, but a running thread cannot be interrupted: when
+    terminated, the job is aborted in the database and its result discarded.
+    """
+    
+    def __init__(self, session_maker, job_id, q_finish, token, logs, profile, submit=False, affinity=None, console=True, log_tail=0):
+        super(JobThread, self).__init__(name='bt_job_%d' % job_id)
+        self.daemon = True
+        
+        self._job_id        = job_id
+        self._console       = console
+        self._log_tail      = log_tail
+        self._session_maker = session_maker
+        self._q_finish      = q_finish
+        self._token         = token
+        self._logs          = logs
+        self._profile       = profile
+        self._submit        = submit
+        self._affinity      = affinity
+        self._spawned       = None
+        self._trace         = None
+        self._aborted       = threading.Event()
+        self._finished      = threading.Event()
+    
+    @property
+    def current_job_id(self):
+        return self._job_id
+    
+    @bt.retry_on_serializable_error
+    @bt.engine.instrumented('start')
+    def _start_job(self):
+        with bt.transactional_session(self._session_maker) as session:
+            job = session.query(bt.Job).filter_by(
+                id = self._job_id
+            ).one()
+            
+            if self._submit:
+                job.submit()
+            
+            job._start(self._token)
+            job.tag[bt.model.TAG_LOG] = self._logs.location(job.id)
+            name = job.name
+        
+        metrics.inc('bt_jobs_claimed_total', task=name)
+    
+    def _run_job(self):
+        with bt.transactional_session(self._session_maker, read_only=True) as session:
+            with tracing.span('load', job_id=self._job_id), bt.engine.operation('load'):
+                job = session.query(bt.Job).filter_by(
+                    id = self._job_id
+                ).options(
+                    undefer_group('yaml'),
+                    joinedload(bt.Job.subjobs),
+                ).one()
+            
+            with self._profile.sampling(job, self._logs.path(job.id, logstore.STACKS)):
+                with tracing.span('run', job_id=self._job_id, task=job.name), bt.engine.operation('run'):
+                    return job._run(self._token, None, self._profile)
+    
+    def _finish_job(self, new_state):
+        @bt.retry_on_serializable_error
+        @bt.engine.instrumented('finish')
+        def finish():
+            with bt.transactional_session(self._session_maker) as session:
+                job = session.query(bt.Job).filter_by(
+                    id = self._job_id
+                ).one()
+                job._finish(self._token, new_state)
+                
+                if self._affinity:
+                    job._reserve_runnable_children(self._token, self._affinity)
+                
+                if job.status == bt.Job.Status.DONE:
+                    return job.raw_output
+        
+        started = time.time()
+        try:
+            raw_output = finish()
+        except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
+            pass
+        else:
+            # The runner shares the same cache, so children can reuse it
+            cache.outputs.put(self._job_id, raw_output)
+        finally:
+            metrics.observe('bt_finish_seconds', time.time() - started)
+            tracing.record('finish', started, job_id=self._job_id)
+    
+    def _cleanup_job(self, reason):
+        @bt.retry_on_serializable_error
+        @bt.engine.instrumented('cleanup')
+        def _cleanup(tb=None):
+            with bt.transactional_session(self._session_maker) as session:
+                job = session.query(bt.Job).filter_by(id = self._job_id).one()
+                job.cleanup(self._token, tb)
+        
+        with tracing.span('cleanup', job_id=self._job_id):
+            try:
+                _cleanup(reason)
+            except (bt.InvalidStatusException, bt.TokenMismatchException, NoResultFound):
+                pass
+    
+    def run(self):
+        metrics.observe('bt_start_overhead_seconds', time.time() - self._spawned)
+        # Threads do not inherit the context, so the span of the job is passed along
+        with tracing.use(self._trace):
+            tracing.record('spawn', self._spawned, job_id=self._job_id)
+            self._execute()
+    
+    def _execute(self):
+        try:
+            tails = bt.ring_buffers(self._log_tail)
+            with bt.context_stdout_stderr(*self._logs.paths(self._job_id), console=self._console, tails=tails):
+                new_state = {}
+                try:
+                    new_state = self._run_job()
+                except (
+                    bt.InvalidStatusException,
+                    bt.TokenMismatchException,
+                    bt.TaskNotAvailableException,
+                    NoResultFound,
+                ):
+                    log.warning("An error was found running job %d" % self._job_id, exc_info=True)
+                except InternalError:
+                    new_state['traceback'] = ''.join(traceback.format_exception(*sys.exc_info()))
+                
+                if tails:
+                    new_state['log_tail'] = dict((stream, ring.getvalue()) for stream, ring in tails.items())
+                
+                if not self._aborted.is_set():
+                    self._finish_job(new_state)
+                    self._finished.set()
+            self._logs.commit(self._job_id)
+        except Exception:
+            self._cleanup_job(''.join(traceback.format_exception(*sys.exc_info())))
+        finally:
+            if not self._aborted.is_set():
+                self._q_finish.put(self._job_id)
+    
+    def start(self):
+        try:
+            with tracing.span('start', job_id=self._job_id):
+                self._start_job()
+            self._spawned = time.time()
+            self._trace   = tracing.current()
+            super(JobThread, self).start()
+        except:
+            self._cleanup_job("Job was aborted before starting.")
+            raise
+    
+    def terminate(self):
+        if self._aborted.is_set() or self._finished.is_set():
+            return
+        
+        log.warning("Job %d runs in a thread and cannot be interrupted. Its result will be discarded." % self._job_id)
+        self._aborted.set()
+        self._cleanup_job("Job aborted while running in a thread")
+        self._q_finish.put(self._job_id)
+    
+    def join(self, timeout=None):
+        # Do not wait for aborted jobs, as they cannot be interrupted
+        if not self._aborted.is_set():
+            super(JobThread, self).join(timeout)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import resource
+import sys
+
+# Fields of the resource usage of a job, in the order they are stored
+FIELDS = ['utime', 'stime', 'maxrss', 'inblock', 'oublock', 'nvcsw', 'nivcsw']
+
+# Fields accumulated over the life of a process, instead of peak values
+_CUMULATIVE = ['utime', 'stime', 'inblock', 'oublock', 'nvcsw', 'nivcsw']
+
+def _maxrss(ru):
+    # Linux reports KiB, but OS X reports bytes
+    if sys.platform == 'darwin':
+        return ru.ru_maxrss // 2**10
+    return ru.ru_maxrss
+
+def from_struct(ru):
+    """\
+    Return the resource usage in a struct_rusage as a dict.
+    
+    CPU times are given in seconds, the peak resident memory in KiB and the
+    block I/O in number of operations.
+    """
+    return {
+        'utime'   : ru.ru_utime,
+        'stime'   : ru.ru_stime,
+        'maxrss'  : _maxrss(ru),
+        'inblock' : ru.ru_inblock,
+        'oublock' : ru.ru_oublock,
+        'nvcsw'   : ru.ru_nvcsw,
+        'nivcsw'  : ru.ru_nivcsw,
+    }
+
+def snapshot():
+    """\
+    Return the resource usage of this process and its finished children.
+    """
+    own      = from_struct(resource.getrusage(resource.RUSAGE_SELF))
+    children = from_struct(resource.getrusage(resource.RUSAGE_CHILDREN))
+    
+    usage = dict((field, own[field] + children[field]) for field in _CUMULATIVE)
+    usage['maxrss'] = max(own['maxrss'], children['maxrss'])
+    return usage
+
+def delta(start, end):
+    """\
+    Return the resource usage between two snapshots.
+    
+    The peak resident memory cannot be split, so it is that of the end, which
+    includes everything run before by the same process.
+    """
+    usage = dict((field, end[field] - start[field]) for field in _CUMULATIVE)
+    usage['maxrss'] = end['maxrss']
+    return usage
+
+def dumps(usage):
+    """\
+    Return a compact text representation of a resource usage dict.
+    """
+    return ' '.join(
+        ('%s=%.3f' if isinstance(usage[field], float) else '%s=%d') % (field, usage[field])
+        for field in FIELDS
+        if field in usage
+    )
+
+def loads(text):
+    """\
+    Return the resource usage dict stored in a text by :func:`dumps`.
+    """
+    usage = {}
+    for item in text.split():
+        field, value = item.split('=', 1)
+        usage[field] = float(value) if '.' in value else int(value)
+    return usage
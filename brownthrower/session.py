@@ -1,64 +1,260 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import collections
 import contextlib
 import logging
 
 from functools import wraps
 
-from sqlalchemy import event
+from sqlalchemy import event, inspect, or_
 from sqlalchemy.engine.url import make_url
 from sqlalchemy.exc import DBAPIError
-from sqlalchemy.orm import scoped_session
+from sqlalchemy.orm import attributes, scoped_session
 from sqlalchemy.orm.session import sessionmaker
 
 from . import engine
+from . import metrics
 from . import model
 
 log = logging.getLogger('brownthrower.model')
 
+def _notification_scope(transaction):
+    # Notifications are kept by savepoint, so those rolled back can be dropped
+    while transaction.parent is not None and not transaction.nested:
+        transaction = transaction.parent
+    return transaction
+
+def _pending_notifications(session, transaction):
+    # Items to notify on each channel, deduplicated and in order of appearance
+    pending = session.info.setdefault('bt_notifications', {})
+    return pending.setdefault(_notification_scope(transaction), collections.defaultdict(dict))
+
+def _add_job_notification(pending, name, job, item):
+    # Job notifications are also sent to the channel of their task
+    pending[(name, '')][item] = None
+    pending[(name, job.name)][item] = None
+
+def _runnable_jobs(session):
+    """\
+    Return the id and name of the jobs that may be run after the status
+    changes of this flush.
+    
+    Those are the jobs that have been QUEUED with all their parents DONE, and
+    the QUEUED children of the jobs that are now DONE, once all their parents
+    are DONE too. They are found with a single query, instead of loading the
+    relatives of each job.
+    """
+    queued = []
+    done   = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, model.Job) or not attributes.get_history(obj, '_status').added:
+            continue
+        if obj.status == model.Job.Status.QUEUED:
+            queued.append(obj.id)
+        elif obj.status == model.Job.Status.DONE:
+            done.append(obj.id)
+    
+    if not queued and not done:
+        return []
+    
+    return session.query(model.Job.id, model.Job.name).filter(
+        model.Job.status == model.Job.Status.QUEUED,
+        or_(
+            model.Job.id.in_(queued),
+            model.Job.parents.any(model.Job.id.in_(done)), # @UndefinedVariable
+        ),
+        ~ model.Job.parents.any(model.Job.status != model.Job.Status.DONE), # @UndefinedVariable
+    ).all()
+
+def _session_after_flush(session, flush_context):
+    """\
+    After flush event callback to collect the jobs whose bottom level must be
+    computed: those submitted and those with new children.
+    """
+    job_ids = set()
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, model.Job):
+            continue
+        if model.Job.Status.QUEUED in attributes.get_history(obj, '_status').added:
+            job_ids.add(obj.id)
+        # Unloaded collections have a blank history, without items
+        if attributes.get_history(obj, 'children', attributes.PASSIVE_NO_INITIALIZE).added:
+            job_ids.add(obj.id)
+        job_ids.update(
+            parent.id
+            for parent in attributes.get_history(obj, 'parents', attributes.PASSIVE_NO_INITIALIZE).added or ()
+        )
+    
+    if job_ids:
+        session.info.setdefault('bt_bottom_levels', set()).update(job_ids)
+
+def _session_before_commit(session):
+    """\
+    Before commit event callback to compute the bottom levels of the jobs
+    collected, once per transaction.
+    """
+    if session.transaction.nested:
+        return
+    
+    session.flush()
+    job_ids = session.info.pop('bt_bottom_levels', None)
+    if job_ids:
+        model.Job._update_bottom_levels(session, job_ids)
+
+def _session_after_transaction_end(session, transaction):
+    # Scoped sessions keep their info, so the weights must be read again
+    if transaction.parent is None:
+        session.info.pop('bt_bottom_levels', None)
+        session.info.pop('bt_weights', None)
+
 def _postgresql_session_after_flush(session, flush_context):
     """\
-    After flush event callback to push notifications on Job changes.
+    After flush event callback to collect the changes to be notified.
+    
+    Notifications are only sent when the transaction is committed, so a job
+    changed by several flushes is notified once.
     """
-    notifier = engine.Notifications(session)
+    pending = _pending_notifications(session, session.transaction)
     for obj in session.new:
         if isinstance(obj, model.Job):
-            notifier.job_create(obj.id)
+            _add_job_notification(pending, 'job_create', obj, obj.id)
         elif isinstance(obj, model.Dependency):
-            notifier.dependency_create(obj.parent_id, obj.child_id)
+            pending[('dependency_create', '')][(obj.parent_id, obj.child_id)] = None
         elif isinstance(obj, model.Tag):
-            notifier.tag_create(obj.job_id)
+            pending[('tag_create', '')][obj.job_id] = None
     for obj in session.dirty:
         if isinstance(obj, model.Job):
-            notifier.job_update(obj.id)
+            _add_job_notification(pending, 'job_update', obj, obj.id)
         elif isinstance(obj, model.Dependency):
-            notifier.dependency_update(obj.parent_id, obj.child_id)
+            pending[('dependency_update', '')][(obj.parent_id, obj.child_id)] = None
         elif isinstance(obj, model.Tag):
-            notifier.tag_update(obj.job_id)
+            pending[('tag_update', '')][obj.job_id] = None
+    for job in _runnable_jobs(session):
+        _add_job_notification(pending, 'job_runnable', job, (job.id, job.name))
     for obj in session.deleted:
         if isinstance(obj, model.Job):
-            notifier.job_delete(obj.id)
+            _add_job_notification(pending, 'job_delete', obj, obj.id)
         elif isinstance(obj, model.Dependency):
-            notifier.dependency_delete(obj.parent_id, obj.child_id)
+            pending[('dependency_delete', '')][(obj.parent_id, obj.child_id)] = None
         elif isinstance(obj, model.Tag):
-            notifier.tag_delete(obj.job_id)
+            pending[('tag_delete', '')][obj.job_id] = None
+
+def _postgresql_session_before_commit(session):
+    """\
+    Before commit event callback to push the collected notifications.
+    
+    All of them are sent in a single statement, as JSON arrays of items. As
+    PostgreSQL delivers them on commit, a transaction rolled back notifies
+    nothing. Releasing a savepoint only hands its notifications over to the
+    enclosing transaction.
+    """
+    # The last changes are flushed after this callback
+    session.flush()
+    
+    transaction = session.transaction
+    pending = session.info.get('bt_notifications', {}).pop(transaction, None)
+    if transaction.nested:
+        if pending:
+            enclosing = _pending_notifications(session, transaction.parent)
+            for key, items in pending.items():
+                enclosing[key].update(items)
+        return
+    
+    if not pending:
+        return
+    
+    channel  = engine._Channel(session)
+    channels = []
+    payloads = []
+    for (name, task), items in sorted(pending.items()):
+        target = getattr(channel, name)
+        if task:
+            target = channel.for_task(target, task)
+        
+        for payload in engine.encode(list(items)):
+            channels.append(target)
+            payloads.append(payload)
+    
+    # A row per notification, as a SELECT list is limited to 1664 entries
+    session.execute(
+        "SELECT pg_notify(c, p) FROM unnest(CAST(:channels AS text[]), CAST(:payloads AS text[])) AS t(c, p);", {
+            'channels' : channels,
+            'payloads' : payloads,
+        }
+    )
+
+def _postgresql_session_after_transaction_end(session, transaction):
+    """\
+    After transaction end event callback to discard the notifications of a
+    transaction or a savepoint that has been rolled back.
+    """
+    if transaction.parent is None:
+        session.info.pop('bt_notifications', None)
+    else:
+        session.info.get('bt_notifications', {}).pop(transaction, None)
+
+# Columns added to existing tables, which create_all does not alter
+UPGRADES = [
+    ('job', 'bottom_level', "FLOAT NOT NULL DEFAULT 0"),
+]
+
+def _upgrade_db(eng):
+    """\
+    Add the columns missing in the tables of an older database.
+    
+    The bottom levels of the unfinished jobs are computed if their column was
+    missing, so they can be claimed by the critical-path policy.
+    """
+    added = set()
+    for table, column, definition in UPGRADES:
+        if column in set(c['name'] for c in inspect(eng).get_columns(table)):
+            continue
+        
+        log.info("Adding column %s.%s" % (table, column))
+        with eng.begin() as conn:
+            conn.execute("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, definition))
+        added.add((table, column))
+    
+    if ('job', 'bottom_level') in added:
+        session = sessionmaker(eng)()
+        try:
+            job_ids = [job_id for (job_id,) in session.query(model.Job.id).filter(
+                model.Job.status != model.Job.Status.DONE
+            )]
+            model.Job._update_bottom_levels(session, job_ids)
+            session.commit()
+        finally:
+            session.close()
 
-def session_maker(dsn, initialize_db=False):
+def session_maker(dsn, initialize_db=False, pool_size=None):
     """\
     Return a new session maker from the provided DSN.
+    
+    The pool keeps pool_size connections, if given, as needed when that many
+    threads use the database at the same time.
     """
     url = make_url(dsn)
-    eng = engine.create_engine(url)
+    eng = engine.create_engine(url, pool_size)
     session_maker = scoped_session(sessionmaker(eng))
-     
+    
+    # Bottom levels must be updated before the changes are notified
+    event.listen(session_maker, 'after_flush', _session_after_flush)
+    event.listen(session_maker, 'before_commit', _session_before_commit)
+    event.listen(session_maker, 'after_transaction_end', _session_after_transaction_end)
+    
     if url.drivername == 'postgresql':
         event.listen(session_maker, 'after_flush', _postgresql_session_after_flush)
+        event.listen(session_maker, 'before_commit', _postgresql_session_before_commit)
+        event.listen(session_maker, 'after_transaction_end', _postgresql_session_after_transaction_end)
     
     if initialize_db:
         log.info("Initializing database structure on %s" % dsn)
         model.Base.metadata.create_all(bind=eng) # @UndefinedVariable
-        model.Base.metadata.create_comments(bind=eng) # @UndefinedVariable
+        _upgrade_db(eng)
+        if url.drivername == 'postgresql':
+            # Other backends, such as SQLite, do not support COMMENT ON
+            model.Base.metadata.create_comments(bind=eng) # @UndefinedVariable
     
     return session_maker
 
@@ -85,6 +281,7 @@ def retry_on_serializable_error(fn):
             except DBAPIError as e:
                 if not is_serializable_error(e):
                     raise
+                metrics.inc('bt_serialization_retries_total')
                 log.debug("Retrying call to «%s» due to serialization error." % fn)
     return wrapper
 
@@ -99,7 +296,7 @@ def transactional_session(session_cls, read_only=False):
     """
     session = session_cls()
     try:
-        if read_only:
+        if read_only and session.bind.url.drivername == 'postgresql':
             session.execute("SET TRANSACTION ISOLATION LEVEL SERIALIZABLE READ ONLY DEFERRABLE")
         yield session
     except:
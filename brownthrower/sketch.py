@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import math
+
+class QuantileSketch(object):
+    """\
+    Mergeable sketch to estimate quantiles of a distribution of positive values.
+    
+    Values are counted in logarithmically sized buckets, so any quantile is
+    estimated with a bounded relative error, regardless of the number of values
+    added. Two sketches with the same accuracy can be merged by adding their
+    bucket counts, which allows keeping partial sketches that are combined only
+    when queried.
+    """
+    
+    def __init__(self, accuracy=0.01, min_value=1e-3):
+        """\
+        @param accuracy: maximum relative error of the estimated quantiles
+        @type accuracy: float
+        @param min_value: values below this threshold are considered zero
+        @type min_value: float
+        """
+        self._accuracy  = accuracy
+        self._min_value = min_value
+        self._gamma     = (1 + accuracy) / (1 - accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._zero      = 0
+        self._buckets   = {}
+    
+    def __len__(self):
+        return self._zero + sum(self._buckets.values())
+    
+    def _key(self, value):
+        return int(math.ceil(math.log(value) / self._log_gamma))
+    
+    def _value(self, key):
+        # Midpoint of the bucket that minimizes the relative error
+        return 2 * self._gamma ** key / (self._gamma + 1)
+    
+    def add(self, value, count=1):
+        if value < self._min_value:
+            self._zero += count
+        else:
+            key = self._key(value)
+            self._buckets[key] = self._buckets.get(key, 0) + count
+    
+    def merge(self, other):
+        if (self._accuracy, self._min_value) != (other._accuracy, other._min_value):
+            raise ValueError("Cannot merge sketches with different parameters.")
+        
+        self._zero += other._zero
+        for key, count in other._buckets.items():
+            self._buckets[key] = self._buckets.get(key, 0) + count
+    
+    def quantile(self, q):
+        """\
+        Return the estimated value of the given quantile (0 <= q <= 1).
+        
+        Return None if the sketch is empty.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError("The quantile must be in the range [0, 1].")
+        
+        total = len(self)
+        if not total:
+            return None
+        
+        rank = q * (total - 1)
+        seen = self._zero
+        if seen > rank:
+            return 0.0
+        
+        for key in sorted(self._buckets):
+            seen += self._buckets[key]
+            if seen > rank:
+                return self._value(key)
+    
+    def dumps(self):
+        """\
+        Serialize this sketch into a compact string.
+        """
+        return json.dumps({
+            'accuracy'  : self._accuracy,
+            'min_value' : self._min_value,
+            'zero'      : self._zero,
+            'buckets'   : sorted(self._buckets.items()),
+        }, separators=(',', ':'))
+    
+    @classmethod
+    def loads(cls, data):
+        """\
+        Rebuild a sketch previously serialized with :meth:`dumps`.
+        """
+        values = json.loads(data)
+        sketch = cls(values['accuracy'], values['min_value'])
+        sketch._zero = values['zero']
+        sketch._buckets = dict((key, count) for key, count in values['buckets'])
+        return sketch
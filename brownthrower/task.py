@@ -17,10 +17,20 @@ class Task(object):
      * :meth:`prolog`
      * :meth:`epilog`
      * :meth:`run`
+    
+    Tasks whose jobs run in a very short time may set :attr:`bundle_size` to
+    let the runner execute up to that number of their jobs in a single process,
+    finishing all of them in the same transaction.
+    
+    Setting :attr:`sample_hz` samples the stacks of every job of the task at
+    that frequency, storing them along with its logs.
     """
     
     _bt_name = None
     
+    bundle_size = 1
+    sample_hz   = None
+    
     @utils.deprecated
     def __init__(self, config):
         self.config = config
@@ -65,7 +75,9 @@ class Task(object):
         Executes this Task.
         
         This code is run over a read-only transaction, so no modifications of
-        any kind are allowed on the job database.
+        any kind are allowed on the job database. It may also be defined as a
+        coroutine ('async def run'), which is then run in an event loop shared
+        by all the jobs of the same process.
         
         @param inp:  list with the output of the parent jobs
         @type inp: list
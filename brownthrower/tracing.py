@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import argparse
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+
+from tabulate import tabulate
+
+log = logging.getLogger('brownthrower.tracing')
+
+# Span being run in the current context, inherited by forked processes
+_current = contextvars.ContextVar('bt_span', default=None)
+
+# Descriptor of the trace file, shared by every process forked afterwards
+_fd = None
+
+def _new_id(size):
+    return os.urandom(size).hex()
+
+class Span(object):
+    """\
+    Timed phase of the lifecycle of a job.
+    
+    Spans are written as one JSON object per line when they end, with the field
+    names used by OpenTelemetry. A span may be started in one process and ended
+    in another one forked meanwhile, as the runner does with the whole job.
+    """
+    
+    def __init__(self, name, parent=None, **attributes):
+        self.name       = name
+        self.trace_id   = parent.trace_id if parent else _new_id(16)
+        self.span_id    = _new_id(8)
+        self.parent_id  = parent.span_id if parent else None
+        self.attributes = attributes
+        self.start      = time.time()
+    
+    def end(self, end=None):
+        _write({
+            'traceId'           : self.trace_id,
+            'spanId'            : self.span_id,
+            'parentSpanId'      : self.parent_id,
+            'name'              : self.name,
+            'startTimeUnixNano' : int(self.start * 1e9),
+            'endTimeUnixNano'   : int((end or time.time()) * 1e9),
+            'attributes'        : dict(self.attributes, pid=os.getpid()),
+        })
+
+def _write(record):
+    if _fd is None:
+        return
+    
+    line = (json.dumps(record, sort_keys=True) + '\n').encode('utf-8')
+    try:
+        # A single write keeps the lines of concurrent processes apart
+        os.write(_fd, line)
+    except OSError:
+        log.debug("Could not write span %s" % record['name'], exc_info=True)
+
+def enable(path):
+    """\
+    Start writing the spans of this process, and those forked from it, to a file.
+    """
+    global _fd
+    
+    _fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+
+def current():
+    """\
+    Return the span being run in the current context, or None.
+    """
+    return _current.get()
+
+def start_span(name, **attributes):
+    """\
+    Start a span as a child of the current one, or None if tracing is disabled.
+    
+    The caller must end it, but it does not become the current span.
+    """
+    if _fd is None:
+        return None
+    
+    return Span(name, current(), **attributes)
+
+@contextlib.contextmanager
+def use(span):
+    """\
+    Make a span the parent of those started in this block.
+    """
+    if span is None:
+        yield
+        return
+    
+    token = _current.set(span)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    """\
+    Trace the time spent running this block.
+    """
+    s = start_span(name, **attributes)
+    if s is None:
+        yield None
+        return
+    
+    with use(s):
+        try:
+            yield s
+        finally:
+            s.end()
+
+def record(name, start, end=None, **attributes):
+    """\
+    Write a span which began at a known time, such as before a fork.
+    """
+    s = start_span(name, **attributes)
+    if s is not None:
+        s.start = start
+        s.end(end)
+
+###############################################################################
+# SUMMARY                                                                     #
+###############################################################################
+
+def _quantile(values, q):
+    return values[min(int(q * len(values)), len(values) - 1)]
+
+def summary(lines):
+    """\
+    Return a table with the count and latency percentiles of each span name.
+    """
+    durations = {}
+    for line in lines:
+        try:
+            record = json.loads(line)
+            duration = (record['endTimeUnixNano'] - record['startTimeUnixNano']) / 1e9
+        except (ValueError, KeyError, TypeError):
+            continue
+        durations.setdefault(record['name'], []).append(duration)
+    
+    table = []
+    for name, values in sorted(durations.items()):
+        values.sort()
+        table.append([
+            name, len(values), sum(values) / len(values),
+            _quantile(values, 0.5), _quantile(values, 0.9), _quantile(values, 0.99), values[-1],
+        ])
+    
+    return table
+
+def _parse_args(args):
+    parser = argparse.ArgumentParser(prog='trace.summary', add_help=False,
+        description="Summarize the latency of each phase of the jobs in trace files.")
+    parser.add_argument('files', nargs='+', metavar='FILE',
+        help="trace files written by the runners")
+    parser.add_argument('--help', '-?', action='help',
+        help='show this help message and exit')
+    
+    return parser.parse_args(args)
+
+def main(args=None):
+    if not args:
+        args = sys.argv[1:]
+    
+    options = _parse_args(args)
+    
+    lines = []
+    for path in options.files:
+        with open(path) as f:
+            lines.extend(f)
+    
+    print(tabulate(summary(lines), floatfmt='.4f', headers=[
+        'phase', 'count', 'mean (s)', 'p50 (s)', 'p90 (s)', 'p99 (s)', 'max (s)',
+    ]))
+
+if __name__ == '__main__':
+    sys.exit(main())
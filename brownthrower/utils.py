@@ -1,8 +1,11 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import asyncio
 import collections
+import contextvars
 import multiprocessing
+import os
 import threading
 import time
 import warnings
@@ -55,10 +58,57 @@ def deprecated(func):
     
     return newFunc
 
+def makedirs(path):
+    """\
+    Create a directory and its parents, unless it exists already.
+    """
+    try:
+        os.makedirs(path)
+    except OSError:
+        if not os.path.isdir(path):
+            raise
+
 def start_debugger(host, port):
     import pydevd
     pydevd.settrace(host, port=port)
 
+_event_loop = None
+_event_loop_lock = threading.Lock()
+
+def event_loop():
+    """\
+    Return an event loop running in a background thread of this process.
+    
+    The loop is created on first use and shared by all the threads.
+    """
+    global _event_loop
+    
+    with _event_loop_lock:
+        if not _event_loop:
+            loop = asyncio.new_event_loop()
+            thread = threading.Thread(target=loop.run_forever, name='bt_event_loop')
+            thread.daemon = True
+            thread.start()
+            _event_loop = loop
+    
+    return _event_loop
+
+def wait_for(awaitable):
+    """\
+    Run an awaitable in the shared event loop and wait for its result.
+    
+    The context variables of the caller are visible to the awaitable, so its
+    output is captured along with that of the calling job.
+    """
+    context = contextvars.copy_context()
+    
+    async def run():
+        for var, value in context.items():
+            var.set(value)
+        return await awaitable
+    
+    return asyncio.run_coroutine_threadsafe(run(), event_loop()).result()
+
 class SelectableQueue(SimpleQueue):
     """\
     Simple subclass hack to allow 'selecting' when reading.
@@ -53,11 +53,16 @@ setup(
         'console_scripts' : [
             'brownthrower = brownthrower.manager.__init__:main',
             'runner.serial = brownthrower.runner.serial.__init__:main',
+            'profile.merge = brownthrower.profiling:main',
+            'trace.summary = brownthrower.tracing:main',
+            'benchmark.throughput = brownthrower.benchmark.throughput:main',
+            'benchmark.transitions = brownthrower.benchmark.transitions:main',
         ],
         'brownthrower.task' : [
             'random   = brownthrower.examples.math:Random',
             'add2     = brownthrower.examples.math:Add2',
             'sum4     = brownthrower.examples.math:Sum4',
+            'noop     = brownthrower.examples.misc:Noop',
             'pipe     = brownthrower.examples.misc:Pipe',
             'sleep    = brownthrower.examples.misc:Sleep',
             'environ  = brownthrower.examples.misc:Environ',
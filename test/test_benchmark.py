@@ -0,0 +1,39 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from brownthrower.benchmark import dags
+
+class TestDags(object):
+    def test_topological(self):
+        for shape in sorted(dags.SHAPES):
+            yield self._check_topological, shape
+    
+    def _check_topological(self, shape):
+        seen = set()
+        for job in dags.generate(shape, 25):
+            assert all(parent in seen for parent in job.parents)
+            seen.add(job)
+    
+    def test_sizes(self):
+        assert len(dags.generate('chain', 10))     == 10
+        assert len(dags.generate('spread', 10))    == 12
+        assert len(dags.generate('reduction', 5))  == 9
+        assert dags.generate('fanout', 10)[0].get_input() == 10
+    
+    def test_repeatable(self):
+        def degrees(seed):
+            jobs = dags.generate('random', 50, seed)
+            return [len(job.parents) for job in jobs]
+        
+        assert degrees(1) == degrees(1)
+
+class TestTransitions(object):
+    def test_results(self):
+        from brownthrower.benchmark import transitions
+        
+        results = transitions.benchmark('sqlite://', [2], [1, 3])
+        assert set(result['operation'] for result in results) == set([
+            'submit', 'start', 'update_status', 'finish', 'cleanup', 'abort',
+        ])
+        assert all(result['queries_per_call'] >= 0 for result in results)
+        assert len(results) == 12
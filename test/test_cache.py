@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from nose.tools import raises
+
+from brownthrower import cache
+
+class TestOutputCache(object):
+    def setup(self):
+        self.cache = cache.OutputCache(100)
+    
+    def test_disabled(self):
+        disabled = cache.OutputCache()
+        disabled.put(1, '[1, 2]')
+        assert not disabled.enabled
+        assert 1 not in disabled
+    
+    def test_get(self):
+        self.cache.put(1, '{a: [1, 2]}')
+        value = self.cache.get(1)
+        assert value == {'a': [1, 2]}
+        
+        # Callers receive their own copy
+        value['a'].append(3)
+        assert self.cache.get(1) == {'a': [1, 2]}
+        assert (self.cache.hits, self.cache.misses) == (2, 0)
+    
+    @raises(KeyError)
+    def test_miss(self):
+        try:
+            self.cache.get(1)
+        finally:
+            assert self.cache.misses == 1
+    
+    def test_replace(self):
+        self.cache.put(1, '[1]')
+        self.cache.put(1, '[1, 2]')
+        assert self.cache.get(1) == [1, 2]
+        assert self.cache.size == len('[1, 2]')
+    
+    def test_evict(self):
+        for job_id in range(4):
+            self.cache.put(job_id, '"%s"' % ('x' * 38))
+        
+        # The least recently used entries are evicted first
+        assert sorted(self.cache._entries) == [2, 3]
+        self.cache.get(2)
+        self.cache.put(4, '"%s"' % ('x' * 38))
+        assert sorted(self.cache._entries) == [2, 4]
+        assert self.cache.size <= 100
+    
+    def test_too_large(self):
+        self.cache.put(1, '"%s"' % ('x' * 100))
+        assert 1 not in self.cache
+        assert self.cache.size == 0
+    
+    def test_invalidate(self):
+        self.cache.put(1, '[1]')
+        self.cache.put(2, '[2]')
+        self.cache.invalidate(1)
+        assert 1 not in self.cache
+        assert self.cache.size == len('[2]')
+        
+        self.cache.clear()
+        assert len(self.cache) == 0
+        assert self.cache.size == 0
+    
+    def test_resize(self):
+        self.cache.put(1, '[1]')
+        self.cache.resize(0)
+        assert not self.cache.enabled
+        assert len(self.cache) == 0
@@ -0,0 +1,117 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import os
+
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine, create_engine
+from sqlalchemy.engine.url import make_url
+
+from brownthrower import engine
+
+class TestQueryStats(object):
+    def setup(self):
+        self._stats  = engine.instrument()
+        self._engine = create_engine('sqlite://')
+    
+    def teardown(self):
+        self._stats.remove()
+    
+    def _query(self):
+        with self._engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+    
+    def test_operations(self):
+        self._query()
+        with engine.operation('submit'):
+            self._query()
+            with engine.operation('start'):
+                self._query()
+                self._query()
+        
+        stats = self._stats.snapshot()
+        assert sorted(stats) == [engine.OTHER, 'start', 'submit']
+        assert stats['submit'][0] == 1
+        assert stats['start'][0]  == 2
+    
+    def test_instrumented(self):
+        @engine.instrumented('abort')
+        def abort():
+            self._query()
+        
+        abort()
+        assert self._stats.snapshot()['abort'][0] == 1
+        
+        self._stats.reset()
+        assert self._stats.snapshot() == {}
+    
+    def test_remove(self):
+        with engine.instrument() as stats:
+            self._query()
+        self._query()
+        
+        assert stats.snapshot()[engine.OTHER][0] == 1
+        assert not event.contains(Engine, 'after_cursor_execute', stats._after_cursor_execute)
+        stats.remove()
+
+class TestPayload(object):
+    def test_roundtrip(self):
+        items = [1, 2, [3, 4]]
+        assert engine.encode(items) == ['[1,2,[3,4]]']
+        assert engine.decode(engine.encode(items)[0]) == items
+    
+    def test_split(self):
+        items = list(range(10**5, 10**5 + 5000))
+        payloads = engine.encode(items)
+        assert len(payloads) > 1
+        assert all(len(payload) <= engine.MAX_PAYLOAD for payload in payloads)
+        assert sum((engine.decode(payload) for payload in payloads), []) == items
+
+class TestChannel(object):
+    class _Session(object):
+        def __init__(self, url):
+            self.bind = create_engine(url)
+    
+    def setup(self):
+        self._environ = os.environ.pop(engine.NAMESPACE_VARIABLE, None)
+    
+    def teardown(self):
+        os.environ.pop(engine.NAMESPACE_VARIABLE, None)
+        if self._environ is not None:
+            os.environ[engine.NAMESPACE_VARIABLE] = self._environ
+    
+    def test_stable(self):
+        # Digests do not depend on the randomized hash of each process
+        channel = engine._Channel(self._Session('sqlite:///bt'))
+        namespace = hashlib.sha1(b'bt').hexdigest()[:8]
+        task      = hashlib.sha1(b'sleep').hexdigest()[:8]
+        assert channel.namespace == namespace
+        assert channel.job_update == 'bt_job_update_%s' % namespace
+        assert channel.for_task(channel.job_runnable, 'sleep') == 'bt_job_runnable_%s_%s' % (namespace, task)
+    
+    def test_namespace(self):
+        channel = engine._Channel(self._Session('sqlite:///bt'), namespace='test')
+        assert channel.tag_create == 'bt_tag_create_test'
+        assert channel.job_runnable in channel.all_channels
+    
+    def test_environ(self):
+        os.environ[engine.NAMESPACE_VARIABLE] = 'env_test'
+        channel = engine._Channel(self._Session('sqlite:///bt'))
+        assert channel.namespace == 'env_test'
+    
+    def test_unsafe_namespace(self):
+        # Channel names must fit in 63 bytes and be quoted safely
+        for namespace in ['x' * 100, 'my"namespace', 'Namespace']:
+            channel = engine._Channel(self._Session('sqlite:///bt'), namespace=namespace)
+            assert channel.namespace == hashlib.sha1(namespace.encode('utf-8')).hexdigest()[:8]
+            assert all(
+                len(channel.for_task(name, 'sleep').encode('utf-8')) <= 63
+                for name in channel.all_channels
+            )
+
+class TestCreateEngine(object):
+    def test_pool_size(self):
+        url = make_url('postgresql://user@localhost/bt')
+        assert engine.create_engine(url, pool_size=21).pool.size() == 21
+        assert engine.create_engine(url).pool.size() == 5
@@ -0,0 +1,154 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+from brownthrower import io
+from io import StringIO
+
+class TestRingBuffer(object):
+    def test_tail(self):
+        def check(size, chunks, expected):
+            ring = io.RingBuffer(size)
+            for chunk in chunks:
+                ring.write(chunk)
+            assert ring.getvalue() == expected
+        
+        for chunks, expected in [
+            ([],                      b''),
+            ([b'ab'],                 b'ab'),
+            ([b'ab', b'cd', b'ef'],   b'cdef'),
+            ([b'abcdefgh'],           b'efgh'),
+            ([b'a', b'bcdefg', b'h'], b'efgh'),
+            (['ab', u'cñ'],           b'bc\xc3\xb1'),
+        ]:
+            yield check, 4, chunks, expected
+    
+    def test_disabled(self):
+        assert io.ring_buffers(0) == {}
+
+class TestContextStreams(object):
+    def setup(self):
+        self.root    = tempfile.mkdtemp()
+        self.streams = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = StringIO(), StringIO()
+        self.console = sys.stderr
+        self.handler = logging.StreamHandler(sys.stderr)
+        self.logger  = logging.getLogger('brownthrower.test.io')
+        self.logger.addHandler(self.handler)
+        self.logger.propagate = False
+    
+    def teardown(self):
+        self.logger.removeHandler(self.handler)
+        self.logger.propagate = True
+        sys.stdout, sys.stderr = self.streams
+        shutil.rmtree(self.root)
+    
+    def _read(self, name):
+        with open(os.path.join(self.root, name)) as f:
+            return f.read()
+    
+    def test_logging(self):
+        # Handlers created beforehand keep writing to the original stderr
+        out, err = os.path.join(self.root, 'out'), os.path.join(self.root, 'err')
+        tails = io.ring_buffers(64)
+        with io.context_stdout_stderr(out, err, console=False, tails=tails):
+            print("to stdout")
+            self.logger.warning("to logging")
+        self.logger.warning("after")
+        
+        assert self._read('out') == "to stdout\n"
+        assert self._read('err') == "to logging\n"
+        assert tails['err'].getvalue() == b"to logging\n"
+        assert self.console.getvalue() == "after\n"
+
+class TestPump(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+        # Stands for the console where the descriptor was written before
+        self.console = os.path.join(self.root, 'console')
+        self.fd = os.open(self.console, os.O_WRONLY | os.O_CREAT, 0o644)
+    
+    def teardown(self):
+        os.close(self.fd)
+        shutil.rmtree(self.root)
+    
+    def _read(self, name):
+        with open(os.path.join(self.root, name), 'rb') as f:
+            return f.read()
+    
+    def _pump(self, console, ring=None):
+        pump = io._Pump(self.fd, os.path.join(self.root, 'log'), console, ring)
+        try:
+            os.write(self.fd, b'first ')
+            os.write(self.fd, b'second')
+        finally:
+            pump.close()
+        os.write(self.fd, b' after')
+        return pump
+    
+    def test_console(self):
+        ring = io.RingBuffer(4)
+        self._pump(True, ring)
+        assert self._read('log') == b'first second'
+        assert self._read('console') == b'first second after'
+        assert ring.getvalue() == b'cond'
+    
+    def test_zero_copy(self):
+        ring = io.RingBuffer(4)
+        pump = self._pump(False, ring)
+        assert pump._thread is None
+        assert self._read('log') == b'first second'
+        assert self._read('console') == b' after'
+        assert ring.getvalue() == b'cond'
+    
+    def test_console_gone(self):
+        # The output is still logged after the console has been closed
+        r, w = os.pipe()
+        os.close(r)
+        try:
+            pump = io._Pump(w, os.path.join(self.root, 'log'), True)
+            try:
+                os.write(w, b'lost console')
+            finally:
+                pump.close()
+        finally:
+            os.close(w)
+        
+        assert self._read('log') == b'lost console'
+    
+    def test_subprocess(self):
+        # Both modes capture the output of the subprocesses of a job
+        for console in [True, False]:
+            pump = io._Pump(self.fd, os.path.join(self.root, 'log'), console)
+            try:
+                subprocess.check_call(['echo', 'from child'], stdout=self.fd)
+            finally:
+                pump.close()
+            
+            assert self._read('log') == b'from child\n'
+    
+    def test_clone(self):
+        # Jobs are run with the real descriptors, not those captured by nose
+        streams = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        tails = io.ring_buffers(16)
+        try:
+            out, err = os.path.join(self.root, 'out'), os.path.join(self.root, 'err')
+            with io.clone_stdout_stderr(out, err, console=False, tails=tails):
+                pumps = [t for t in threading.enumerate() if t.name.startswith('bt_pump')]
+                print("to stdout")
+                os.write(sys.stderr.fileno(), b'to stderr\n')
+        finally:
+            sys.stdout, sys.stderr = streams
+        
+        assert not pumps
+        assert self._read('out') == b'to stdout\n'
+        assert self._read('err') == b'to stderr\n'
+        assert tails['out'].getvalue() == b'to stdout\n'
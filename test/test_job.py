@@ -2,6 +2,9 @@
 # -*- coding: utf-8 -*-
 
 import itertools
+import os
+import shutil
+import tempfile
 
 import brownthrower as bt
 
@@ -241,3 +244,114 @@ class TestParentsSession(TestParents):
 
 class TestTagSession(TestTag):
     _use_session = True
+
+class TestBottomLevel(object):
+    def setup(self):
+        self.session_maker = bt.session_maker('sqlite://', initialize_db=True)
+    
+    def teardown(self):
+        self.session_maker.remove()
+    
+    def _jobs(self, size):
+        return [bt.tasks['noop'].create_job() for _ in range(size)]
+    
+    def _submit(self, jobs, edges=()):
+        with bt.transactional_session(self.session_maker) as session:
+            session.add_all(jobs)
+            for parent, child in edges:
+                child.parents.add(parent)
+            session.flush()
+            for job in jobs:
+                job.submit()
+            return [job.id for job in jobs]
+    
+    def _levels(self, ids):
+        with bt.transactional_session(self.session_maker) as session:
+            return [session.query(bt.Job).filter_by(id = job_id).one().bottom_level for job_id in ids]
+    
+    def test_chain(self):
+        jobs = self._jobs(200)
+        ids = self._submit(jobs, zip(jobs, jobs[1:]))
+        assert self._levels(ids) == [float(level) for level in range(200, 0, -1)]
+    
+    def test_diamond(self):
+        a, b, c, d = jobs = self._jobs(4)
+        ids = self._submit(jobs, [(a, b), (a, c), (c, d)])
+        assert self._levels(ids) == [3.0, 1.0, 2.0, 1.0]
+    
+    def test_ancestors(self):
+        # Children submitted later raise the levels of their ancestors
+        a, b = self._jobs(2)
+        ids = self._submit([a, b], [(a, b)])
+        
+        c = self._jobs(1)[0]
+        with bt.transactional_session(self.session_maker) as session:
+            session.add(c)
+            c.parents.add(session.query(bt.Job).filter_by(id = ids[1]).one())
+            session.flush()
+            c.submit()
+            ids.append(c.id)
+        
+        assert self._levels(ids) == [3.0, 2.0, 1.0]
+    
+    def test_weights(self):
+        with bt.transactional_session(self.session_maker) as session:
+            stats = bt.TaskStats('noop')
+            stats._add(5.0)
+            session.add(stats)
+        
+        jobs = self._jobs(2)
+        ids = self._submit(jobs, [(jobs[0], jobs[1])])
+        assert self._levels(ids) == [10.0, 5.0]
+    
+    def test_weights_updated(self):
+        # Long-lived sessions read the statistics again in every transaction
+        jobs = self._jobs(2)
+        ids = self._submit(jobs, [(jobs[0], jobs[1])])
+        assert self._levels(ids) == [2.0, 1.0]
+        
+        with bt.transactional_session(self.session_maker) as session:
+            stats = bt.TaskStats('noop')
+            stats._add(100.0)
+            session.add(stats)
+        
+        jobs = self._jobs(2)
+        ids = self._submit(jobs, [(jobs[0], jobs[1])])
+        assert self._levels(ids) == [200.0, 100.0]
+        assert 'bt_weights' not in self.session_maker().info
+    
+    def test_upgrade(self):
+        root = tempfile.mkdtemp()
+        try:
+            url = 'sqlite:///' + os.path.join(root, 'bt.db')
+            self.session_maker = bt.session_maker(url, initialize_db=True)
+            jobs = self._jobs(2)
+            ids = self._submit(jobs, [(jobs[0], jobs[1])])
+            self.session_maker.remove()
+            
+            # Databases created before the bottom levels lack their column
+            with self.session_maker.bind.begin() as conn:
+                conn.execute("ALTER TABLE job DROP COLUMN bottom_level")
+            self.session_maker.bind.dispose()
+            
+            self.session_maker = bt.session_maker(url, initialize_db=True)
+            assert self._levels(ids) == [2.0, 1.0]
+        finally:
+            self.session_maker.bind.dispose()
+            shutil.rmtree(root)
+    
+    def test_rollback(self):
+        jobs = self._jobs(2)
+        try:
+            with bt.transactional_session(self.session_maker) as session:
+                session.add_all(jobs)
+                jobs[1].parents.add(jobs[0])
+                session.flush()
+                for job in jobs:
+                    job.submit()
+                session.flush()
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        
+        assert 'bt_bottom_levels' not in self.session_maker().info
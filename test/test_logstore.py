@@ -0,0 +1,86 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import shutil
+import tempfile
+
+from nose.tools import raises
+from brownthrower import logstore
+
+class TestLogStore(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+    
+    def teardown(self):
+        shutil.rmtree(self.root)
+    
+    def _write(self, store, job_id, out, err):
+        stdout, stderr = store.paths(job_id)
+        with open(stdout, 'wb') as f:
+            f.write(out)
+        with open(stderr, 'wb') as f:
+            f.write(err)
+        store.commit(job_id)
+    
+    def test_layouts(self):
+        # Generated tests run before setup, so each one has its own directory
+        def check(layout, compress):
+            root = tempfile.mkdtemp()
+            try:
+                store = logstore.LAYOUTS[layout](root, compress)
+                self._write(store, 1, b'out 1', b'err 1')
+                self._write(store, 2, b'out 2', b'')
+                
+                assert store.read(1, 'out') == b'out 1'
+                assert store.read(1, 'err') == b'err 1'
+                assert store.read(2, 'out') == b'out 2'
+                assert store.read(2, 'err') == b''
+                assert logstore.read(1, 'err', location=store.location(1)) == b'err 1'
+                assert logstore.read(2, 'out', root=store.root) == b'out 2'
+            finally:
+                shutil.rmtree(root)
+        
+        for layout in sorted(logstore.LAYOUTS):
+            for compress in [False, True]:
+                yield check, layout, compress
+    
+    def test_segment_rerun(self):
+        store = logstore.SegmentLogStore(self.root, name='runner')
+        self._write(store, 1, b'first', b'')
+        self._write(store, 1, b'second', b'')
+        assert store.read(1) == b'second'
+    
+    def test_segment_large(self):
+        data = bytes(bytearray(range(256))) * (3 * logstore.COPY_CHUNK // 256 + 1)
+        for compress in [False, True]:
+            store = logstore.SegmentLogStore(self.root, compress, name=str(compress))
+            self._write(store, 1, data, b'')
+            assert store.read(1) == data
+    
+    def test_segment_stream(self):
+        data  = bytes(bytearray(range(256))) * (3 * logstore.COPY_CHUNK // 256 + 1)
+        store = logstore.SegmentLogStore(self.root, True)
+        self._write(store, 1, data, b'')
+        
+        # Compressed logs are decompressed while being read
+        with store.open(1) as f:
+            assert f.read(10) == data[:10]
+            assert logstore.tail(f, 100) == data[-100:]
+            assert f.tell() == len(data)
+    
+    def test_flat_rerun(self):
+        store = logstore.FlatLogStore(self.root, True)
+        self._write(store, 1, b'first', b'')
+        
+        # The log of the new run is shown instead of the compressed one
+        stdout, _ = store.paths(1)
+        with open(stdout, 'wb') as f:
+            f.write(b'second')
+        assert store.read(1) == b'second'
+        
+        store.commit(1)
+        assert store.read(1) == b'second'
+    
+    @raises(KeyError)
+    def test_missing(self):
+        logstore.read(1, root=self.root)
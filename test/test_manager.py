@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+import brownthrower as bt
+
+from brownthrower import logstore
+from brownthrower.examples.misc import Noop
+from brownthrower.manager.commands import job as commands
+
+class Manager(object):
+    def __init__(self, session_maker):
+        self.session_maker = session_maker
+
+class TestJobLog(object):
+    def setup(self):
+        self.root          = tempfile.mkdtemp()
+        self.session_maker = bt.session_maker('sqlite:///' + os.path.join(self.root, 'bt.db'), initialize_db=True)
+        self.logs          = logstore.FlatLogStore(os.path.join(self.root, 'logs'))
+        self.command       = commands.JobLog(manager=Manager(self.session_maker))
+        self._interval     = commands.FOLLOW_INTERVAL
+        commands.FOLLOW_INTERVAL = 0.01
+        
+        with bt.transactional_session(self.session_maker) as session:
+            job = Noop.create_job()
+            session.add(job)
+            session.flush()
+            job.submit()
+            job._start('token')
+            job.tag[bt.model.TAG_LOG] = self.logs.location(job.id)
+            self.job_id = job.id
+        self._write(b'first\n')
+    
+    def teardown(self):
+        commands.FOLLOW_INTERVAL = self._interval
+        self.session_maker.bind.dispose()
+        shutil.rmtree(self.root)
+    
+    def _write(self, data):
+        with open(self.logs.path(self.job_id, 'out'), 'ab') as f:
+            f.write(data)
+    
+    def _finish(self):
+        with bt.transactional_session(self.session_maker) as session:
+            job = session.query(bt.Job).filter_by(id = self.job_id).one()
+            job._finish('token', {'status' : bt.Job.Status.DONE})
+    
+    def _do(self, *items):
+        """\
+        Run the command, returning what it wrote to the standard output.
+        """
+        stdout = sys.stdout
+        sys.stdout = io.TextIOWrapper(io.BytesIO())
+        try:
+            self.command.do([str(self.job_id)] + list(items))
+            sys.stdout.flush()
+            return sys.stdout.buffer.getvalue()
+        finally:
+            sys.stdout = stdout
+    
+    def test_tail(self):
+        assert self._do() == b'first\n'
+    
+    def test_follow(self):
+        is_running = self.command._is_running
+        written = [b'second\n', b'third\n']
+        
+        def write_and_check(job_id):
+            # The job ends after writing its last line
+            self._write(written.pop(0))
+            if not written:
+                self._finish()
+            return is_running(job_id)
+        
+        self.command._is_running = write_and_check
+        assert self._do('--follow') == b'first\nsecond\nthird\n'
+        assert not written
+    
+    def test_follow_ended(self):
+        # The log of a job that has ended is not followed
+        self._finish()
+        self.command._is_running = None
+        assert self._do('--follow') == b'first\n'
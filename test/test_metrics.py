@@ -0,0 +1,28 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from brownthrower import metrics
+
+class TestHistogram(object):
+    def test_buckets(self):
+        histogram = metrics.Histogram('h', "doc", buckets=[1, 10])
+        for value in [0.5, 1, 5, 50]:
+            histogram.apply((), value)
+        
+        samples = dict(((name, labels), value) for name, labels, value in histogram.samples())
+        assert samples[('h_bucket', (('le', '1'),))]    == 2
+        assert samples[('h_bucket', (('le', '10'),))]   == 3
+        assert samples[('h_bucket', (('le', '+Inf'),))] == 4
+        assert samples[('h_count', ())] == 4
+        assert samples[('h_sum', ())]   == 56.5
+
+class TestCounter(object):
+    def test_labels(self):
+        counter = metrics.Counter('c', "doc")
+        counter.apply((('task', 'a'),), 1)
+        counter.apply((('task', 'a'),), 2)
+        counter.apply((('task', 'b'),), 1)
+        assert list(counter.samples()) == [
+            ('c', (('task', 'a'),), 3),
+            ('c', (('task', 'b'),), 1),
+        ]
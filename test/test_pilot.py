@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import datetime
+import time
+
+from nose.tools import raises
+from brownthrower.runner.serial import pilot
+
+class TestWalltime(object):
+    def test_valid(self):
+        def check(value, seconds):
+            assert pilot.parse_walltime(value) == seconds
+        
+        for value, seconds in [
+            ('45',          45),
+            ('10:00',       600),
+            ('01:30:00',    5400),
+            ('2-00:00:01',  172801),
+        ]:
+            yield check, value, seconds
+    
+    def test_invalid(self):
+        @raises(ValueError)
+        def check(value):
+            pilot.parse_walltime(value)
+        
+        for value in ['', 'abc', '1:2:3:4', '-1', '1-2-3']:
+            yield check, value
+
+class TestDeadline(object):
+    def test_timestamp(self):
+        assert pilot.parse_deadline('1500000000') == 1500000000
+    
+    def test_datetime(self):
+        expected = time.mktime(datetime.datetime(2020, 1, 2, 3, 4, 5).timetuple())
+        assert pilot.parse_deadline('2020-01-02 03:04:05') == expected
+        assert pilot.parse_deadline('2020-01-02T03:04:05') == expected
+    
+    @raises(ValueError)
+    def test_invalid(self):
+        pilot.parse_deadline('tomorrow')
+
+class TestPilot(object):
+    def test_remaining(self):
+        p = pilot.Pilot(deadline=time.time() + 100, grace=10)
+        assert 80 < p.remaining() <= 90
+        assert not p.expired()
+    
+    def test_expired(self):
+        p = pilot.Pilot(deadline=time.time() + 5, grace=10)
+        assert p.expired()
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import collections
+import os
+import shutil
+import signal
+import tempfile
+import time
+
+import brownthrower as bt
+
+from sqlalchemy import inspect
+
+from brownthrower import profiling
+from brownthrower.examples.misc import Noop
+
+FakeJob = collections.namedtuple('FakeJob', ['id', 'name'])
+
+class TestProfiler(object):
+    def setup(self):
+        self.root = tempfile.mkdtemp()
+    
+    def teardown(self):
+        shutil.rmtree(self.root)
+    
+    def test_merge(self):
+        profiler = profiling.Profiler(self.root)
+        for job in [FakeJob(1, 'a'), FakeJob(2, 'a'), FakeJob(3, 'b')]:
+            probe = profiler.start(job)
+            sum(range(1000))
+            probe.stop()
+        
+        profiles = profiling.task_profiles(self.root)
+        assert sorted(profiles) == ['a', 'b']
+        assert len(profiles['a']) == 2
+        assert profiling.merge(profiles['a']).total_calls > 0
+    
+    def test_rate(self):
+        profiler = profiling.Profiler(self.root, rate=0.0)
+        assert profiler.start(FakeJob(1, 'a')) is None
+    
+    def test_sampler(self):
+        path = os.path.join(self.root, 'stacks')
+        sampler = profiling.StackSampler(path, 1000)
+        sampler.start()
+        time.sleep(0.1)
+        sampler.stop()
+        
+        with open(path) as f:
+            lines = f.readlines()
+        assert lines
+        assert all(['test_sampler' in line.rsplit(' ', 1)[0] for line in lines])
+    
+    def test_memory_signal(self):
+        previous = signal.getsignal(signal.SIGUSR1)
+        try:
+            # Ignored while no memory is being traced
+            profiling.handle_memory_signal()
+            os.kill(os.getpid(), signal.SIGUSR1)
+            
+            path = os.path.join(self.root, 'memory')
+            tracer = profiling.MemoryTracer(path, 3600)
+            tracer.start()
+            try:
+                os.kill(os.getpid(), signal.SIGUSR1)
+            finally:
+                tracer.stop()
+            os.kill(os.getpid(), signal.SIGUSR1)
+            
+            with open(path) as f:
+                reasons = [line.split(' ', 3)[3].split(':')[0] for line in f if line.startswith('#')]
+            assert reasons == ["memory threshold exceeded", "job ended"]
+        finally:
+            signal.signal(signal.SIGUSR1, previous)
+    
+    def test_sample_hz(self):
+        session = bt.session_maker('sqlite://', initialize_db=True)()
+        try:
+            tagged, plain = Noop.create_job(), Noop.create_job()
+            tagged.tag[profiling.TAG_SAMPLE_HZ] = '50'
+            plain.tag['other'] = 'value'
+            session.add_all([tagged, plain])
+            session.commit()
+            session.expire_all()
+            
+            # Only the tag overriding the frequency is read
+            profiler = profiling.Profiler(self.root, sample_hz=10)
+            assert profiler.sample_hz(tagged) == 50.0
+            assert profiler.sample_hz(plain) == 10.0
+            assert '_tags' in inspect(plain).unloaded
+            
+            assert dict(plain.tag) == {'other': 'value'}
+            assert profiler.sample_hz(plain) == 10.0
+        finally:
+            session.close()
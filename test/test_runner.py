@@ -0,0 +1,437 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import contextlib
+import multiprocessing
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import threading
+import time
+
+import brownthrower as bt
+
+from nose.tools import raises
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from brownthrower import cache, logstore
+from brownthrower.examples.misc import Noop, Pipe
+from brownthrower.runner import serial
+from brownthrower.runner.serial import aio, pilot, process
+
+# Number of seconds a runner may take to run the jobs of a test
+RUN_TIMEOUT = 60
+
+class RunnerTimeout(Exception):
+    pass
+
+class RunnerTest(object):
+    """\
+    Run the serial runner on the jobs stored in a temporary SQLite database.
+    """
+    
+    def setup(self):
+        self.root          = tempfile.mkdtemp()
+        self.url           = 'sqlite:///' + os.path.join(self.root, 'bt.db')
+        self.session_maker = bt.session_maker(self.url, initialize_db=True)
+        self._handlers     = dict(
+            (signum, signal.getsignal(signum))
+            for signum in [signal.SIGINT, signal.SIGTERM, signal.SIGALRM]
+        )
+    
+    def teardown(self):
+        signal.alarm(0)
+        for signum, handler in self._handlers.items():
+            signal.signal(signum, handler)
+        self.session_maker.bind.dispose()
+        shutil.rmtree(self.root)
+    
+    def _submit(self, jobs):
+        """\
+        Store and submit some jobs, returning their ids.
+        """
+        with bt.transactional_session(self.session_maker) as session:
+            session.add_all(jobs)
+            session.flush()
+            for job in reversed(jobs):
+                job.submit()
+            return [job.id for job in jobs]
+    
+    def _chain(self, size):
+        jobs = []
+        for _ in range(size):
+            job = Noop.create_job()
+            if jobs:
+                job.parents.add(jobs[-1])
+            jobs.append(job)
+        return self._submit(jobs)
+    
+    @staticmethod
+    def _timeout(*args):
+        raise RunnerTimeout()
+    
+    @staticmethod
+    @contextlib.contextmanager
+    def _real_streams():
+        """\
+        Restore the streams replaced by nose, as jobs capture their output
+        through the file descriptors.
+        """
+        streams = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+        try:
+            yield
+        finally:
+            sys.stdout, sys.stderr = streams
+    
+    def _runner(self, *args, **kwargs):
+        options = serial._parse_args([
+            '--database-url', self.url,
+            '--log-dir',      os.path.join(self.root, 'logs'),
+            '--no-console',
+        ] + list(args))
+        options.pop('verbose')
+        
+        return kwargs.get('runner_class', serial.SerialRunner)(options)
+    
+    def _run(self, *args, **kwargs):
+        """\
+        Run a runner with the given arguments until no jobs are left.
+        """
+        runner = self._runner(*args, **kwargs)
+        signal.signal(signal.SIGALRM, self._timeout)
+        signal.alarm(RUN_TIMEOUT)
+        try:
+            with self._real_streams():
+                runner.main()
+        finally:
+            signal.alarm(0)
+        
+        return runner
+    
+    def _jobs(self, ids):
+        """\
+        Return the status and the tags of the given jobs, by id.
+        """
+        with bt.transactional_session(self.session_maker) as session:
+            return dict(
+                (job.id, (job.status, dict(job.tag)))
+                for job in session.query(bt.Job).filter(bt.Job.id.in_(ids))
+            )
+    
+    def _statuses(self, ids):
+        return dict((job_id, status) for job_id, (status, _) in self._jobs(ids).items())
+    
+    def _start(self, job_id, token):
+        with bt.transactional_session(self.session_maker) as session:
+            session.query(bt.Job).filter_by(id = job_id).one()._start(token)
+    
+    def _job_process(self, job_id, token, **kwargs):
+        """\
+        Return the process which would run a job, to call its methods directly.
+        """
+        return process.Job(
+            db_url  = self.url,
+            job_id  = job_id,
+            token   = token,
+            debug   = {},
+            logs    = logstore.FlatLogStore(os.path.join(self.root, 'logs')),
+            profile = None,
+            current = multiprocessing.Value('l', job_id),
+            **kwargs
+        )
+
+class TestAsyncRunner(RunnerTest):
+    def test_instant_jobs(self):
+        # Jobs may end before the worker thread returns from starting them
+        ids = self._submit([Noop.create_job() for _ in range(20)])
+        runner = self._run('--slots', '4', runner_class=aio.AsyncRunner)
+        
+        assert not runner._running
+        assert set(self._statuses(ids).values()) == set([bt.Job.Status.DONE])
+    
+    def test_finished_while_starting(self):
+        runner = self._runner(runner_class=aio.AsyncRunner)
+        
+        class Monitor(object):
+            def __init__(self, job_id, **kwargs):
+                self._job_id = job_id
+            
+            def start(self):
+                # The loop thread reaps the job before start() returns
+                runner._pop_finished(self._job_id)
+        
+        original = serial.process.Monitor
+        serial.process.Monitor = Monitor
+        try:
+            runner._spawn_job(1, None, runner._token)
+        finally:
+            serial.process.Monitor = original
+        
+        assert not runner._running
+
+class TestFusion(RunnerTest):
+    _done = {'status': bt.Job.Status.DONE}
+    
+    def test_fused(self):
+        ids = self._chain(2)
+        self._start(ids[0], 'token')
+        job = self._job_process(ids[0], 'token', fuse=True)
+        
+        assert job._finish_job(dict(self._done)) == ids[1]
+        assert job._current.value == ids[1]
+        assert self._statuses(ids) == {ids[0]: bt.Job.Status.DONE, ids[1]: bt.Job.Status.RUNNING}
+    
+    def test_deadline(self):
+        ids = self._chain(2)
+        self._start(ids[0], 'token')
+        expired = pilot.Pilot(deadline=time.time() + 5, grace=10)
+        job = self._job_process(ids[0], 'token', fuse=True, pilot=expired)
+        
+        assert job._finish_job(dict(self._done)) is None
+        assert job._current.value == ids[0]
+        assert self._statuses(ids) == {ids[0]: bt.Job.Status.DONE, ids[1]: bt.Job.Status.QUEUED}
+    
+    def test_failed_commit(self):
+        ids = self._chain(2)
+        self._start(ids[0], 'token')
+        job = self._job_process(ids[0], 'token', fuse=True)
+        
+        def fail(session):
+            raise RuntimeError("Commit failed")
+        
+        event.listen(Session, 'before_commit', fail)
+        try:
+            raises(RuntimeError)(job._finish_job)(dict(self._done))
+        finally:
+            event.remove(Session, 'before_commit', fail)
+        
+        # The next job is not published, as it has not been started
+        assert job._current.value == ids[0]
+        assert self._statuses(ids) == {ids[0]: bt.Job.Status.RUNNING, ids[1]: bt.Job.Status.QUEUED}
+    
+    def test_chain(self):
+        ids = self._chain(5)
+        self._run('--fuse-chains')
+        assert set(self._statuses(ids).values()) == set([bt.Job.Status.DONE])
+
+class TestAffinity(RunnerTest):
+    _done = {'status': bt.Job.Status.DONE}
+    
+    def _finish_parent(self, ids, window):
+        # The job process reserves the children of the jobs it finishes
+        self._start(ids[0], 'token')
+        job = self._job_process(ids[0], 'token', affinity=window)
+        assert job._finish_job(dict(self._done)) is None
+    
+    def _child(self, job_id):
+        with bt.transactional_session(self.session_maker) as session:
+            job = session.query(bt.Job).filter_by(id = job_id).one()
+            return job.token, bt.model.TAG_AFFINITY in job.tag
+    
+    def test_reserve(self):
+        ids = self._chain(2)
+        self._finish_parent(ids, 3600)
+        assert self._child(ids[1]) == ('token', True)
+        
+        raises(bt.TokenMismatchException)(self._start)(ids[1], 'other')
+        self._start(ids[1], 'token')
+        assert self._child(ids[1]) == ('token', False)
+    
+    def test_expired(self):
+        ids = self._chain(2)
+        self._finish_parent(ids, -1)
+        
+        # Any runner may take the child once the reservation has expired
+        self._start(ids[1], 'other')
+        assert self._child(ids[1]) == ('other', False)
+    
+    def test_clock_skew(self):
+        # Expiries are compared with the clock of the database, not the node's
+        ids = self._chain(2)
+        self._finish_parent(ids, 3600)
+        
+        clock = bt.model.time.time
+        bt.model.time.time = lambda: clock() + 7200
+        try:
+            raises(bt.TokenMismatchException)(self._start)(ids[1], 'other')
+        finally:
+            bt.model.time.time = clock
+        assert self._child(ids[1]) == ('token', True)
+    
+    def test_run_affine(self):
+        lonely = self._submit([Noop.create_job()])
+        ids = self._chain(2)
+        self._submit([Noop.create_job() for _ in range(5)])
+        runner = self._runner('--affinity', '3600', '--reserved', 'token')
+        self._finish_parent(ids, 3600)
+        self._start(lonely[0], 'token')
+        self._job_process(lonely[0], 'token')._finish_job(dict(self._done))
+        
+        spawned = []
+        runner._spawn_job = lambda job_id, q_finish, token, bundle=None: spawned.append(job_id)
+        runner._finished.extend([lonely[0], ids[0]])
+        
+        # Children are preferred over other runnable jobs, skipping the
+        # finished jobs without runnable children
+        runner._claim_one(None)
+        assert spawned == [ids[1]]
+        assert list(runner._finished) == [ids[0]]
+
+class TestBundle(RunnerTest):
+    def test_start_bundle(self):
+        ids = self._submit([Pipe.create_job() for _ in range(3)])
+        parent, blocked = self._submit([Pipe.create_job(), Pipe.create_job()])
+        with bt.transactional_session(self.session_maker) as session:
+            job = session.query(bt.Job).filter_by(id = blocked).one()
+            job.parents.add(session.query(bt.Job).filter_by(id = parent).one())
+        
+        monitor = process.Monitor(
+            db_url   = self.url,
+            job_id   = ids[0],
+            q_finish = None,
+            token    = 'token',
+            debug    = {},
+            logs     = logstore.FlatLogStore(os.path.join(self.root, 'logs')),
+            profile  = None,
+            bundle   = ids[1:] + [blocked],
+        )
+        monitor._start_job()
+        
+        # The savepoint of the job which cannot be started undoes its reservation
+        assert monitor._bundle == ids[1:]
+        assert set(self._statuses(ids).values()) == set([bt.Job.Status.RUNNING])
+        with bt.transactional_session(self.session_maker) as session:
+            job = session.query(bt.Job).filter_by(id = blocked).one()
+            assert (job.status, job.token) == (bt.Job.Status.QUEUED, None)
+    
+    def test_fuse_chains(self):
+        # Bundled jobs are not fused with their children, which run afterwards
+        parents = [Pipe.create_job() for _ in range(4)]
+        children = []
+        for parent in parents:
+            child = Pipe.create_job()
+            child.parents.add(parent)
+            children.append(child)
+        ids = self._submit(parents + children)
+        
+        self._run('--fuse-chains')
+        assert set(self._statuses(ids).values()) == set([bt.Job.Status.DONE])
+
+class TestOutputCache(RunnerTest):
+    def teardown(self):
+        cache.outputs.resize(0)
+        super(TestOutputCache, self).teardown()
+    
+    def test_no_notifications(self):
+        # Without notifications, outdated outputs would never be dropped
+        runner = self._runner('--output-cache', '1')
+        assert not cache.outputs.enabled
+        assert runner._q_output is None
+
+class TestCriticalPath(RunnerTest):
+    def test_claim_order(self):
+        singles = self._submit([Noop.create_job() for _ in range(5)])
+        chain   = self._chain(3)
+        runner  = self._runner('--policy', 'critical-path')
+        
+        spawned = []
+        runner._spawn_job = lambda job_id, q_finish, token, bundle=None: spawned.append(job_id)
+        runner._claim_one(None)
+        
+        assert spawned == [chain[0]]
+        with bt.transactional_session(self.session_maker) as session:
+            levels = dict(session.query(bt.Job.id, bt.Job.bottom_level).filter(bt.Job.id.in_(singles + chain)))
+        assert [levels[job_id] for job_id in chain] == [3.0, 2.0, 1.0]
+        assert set(levels[job_id] for job_id in singles) == set([1.0])
+
+class TestCapture(RunnerTest):
+    def test_no_console(self):
+        # The tail of the output is kept by default, without pumping it
+        runner = self._runner()
+        job = self._job_process(1, 'token', console=runner._console, log_tail=runner._log_tail)
+        tails = bt.ring_buffers(runner._log_tail)
+        with self._real_streams():
+            with job._capture(tails):
+                pumps = [t for t in threading.enumerate() if t.name.startswith('bt_pump')]
+                os.write(sys.stdout.fileno(), b'output\n')
+        
+        assert not pumps
+        assert tails['out'].getvalue() == b'output\n'
+        assert job._logs.read(1) == b'output\n'
+
+class TestNotified(RunnerTest):
+    def _notify(self, runner, *names):
+        payload = bt.engine.encode([[job_id, name] for job_id, name in enumerate(names)])[0]
+        return runner._aborted_jobs([('runnable', payload)])
+    
+    def test_allowed_tasks(self):
+        runner = self._runner('--allowed-tasks', 'noop')
+        runner._runnable_channels = set(['runnable'])
+        
+        assert self._notify(runner, 'other') == []
+        assert not runner._runnable
+        assert self._notify(runner, 'other', 'noop') == []
+        assert runner._runnable == set([1])
+    
+    def test_wakeup(self):
+        runner = self._runner()
+        runner._runnable = set([1])
+        
+        # Notified jobs end the wait
+        started = time.time()
+        runner._idle(None, None, RUN_TIMEOUT)
+        assert time.time() - started < RUN_TIMEOUT
+        
+        raises(serial.NoRunnableJobFound)(runner._claim_one)(None)
+        assert not runner._runnable
+    
+    def test_claim_notified(self):
+        ids    = self._submit([Noop.create_job() for _ in range(4)])
+        runner = self._runner()
+        runner._runnable = set(ids[2:])
+        
+        spawned = []
+        runner._spawn_job = lambda job_id, q_finish, token, bundle=None: spawned.append(job_id)
+        runner._claim_one(None)
+        runner._claim_one(None)
+        
+        # The notified jobs are started first
+        assert set(spawned) == set(ids[2:])
+        assert not runner._runnable
+    
+    def test_fallback(self):
+        ids    = self._submit([Noop.create_job() for _ in range(2)])
+        runner = self._runner()
+        self._start(ids[0], 'other')
+        runner._runnable = set([ids[0]])
+        
+        # Every runnable job is looked for when no notified one can be started
+        spawned = []
+        runner._spawn_job = lambda job_id, q_finish, token, bundle=None: spawned.append(job_id)
+        runner._claim_one(None)
+        
+        assert spawned == [ids[1]]
+        assert not runner._runnable
+
+class TestThreadBackend(RunnerTest):
+    def test_run(self):
+        ids = self._chain(3) + self._submit([Noop.create_job() for _ in range(8)])
+        self._run('--backend', 'thread', '--slots', '4')
+        assert set(self._statuses(ids).values()) == set([bt.Job.Status.DONE])
+    
+    def test_event_loop(self):
+        ids = self._submit([Noop.create_job() for _ in range(8)])
+        self._run('--backend', 'thread', '--slots', '4', runner_class=aio.AsyncRunner)
+        assert set(self._statuses(ids).values()) == set([bt.Job.Status.DONE])
+    
+    def test_output(self):
+        ids = self._submit([Noop.create_job()])
+        self._run('--backend', 'thread')
+        
+        status, tags = self._jobs(ids)[ids[0]]
+        assert status == bt.Job.Status.DONE
+        assert logstore.read(ids[0], location=tags[bt.model.TAG_LOG]) == b''
@@ -0,0 +1,20 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from brownthrower import rusage
+
+class TestRusage(object):
+    def test_roundtrip(self):
+        usage = rusage.snapshot()
+        assert sorted(usage) == sorted(rusage.FIELDS)
+        
+        loaded = rusage.loads(rusage.dumps(usage))
+        for field in rusage.FIELDS:
+            assert abs(loaded[field] - usage[field]) < 0.001
+    
+    def test_delta(self):
+        start = dict((field, 1) for field in rusage.FIELDS)
+        end   = dict((field, 5) for field in rusage.FIELDS)
+        usage = rusage.delta(start, end)
+        assert usage['utime']  == 4
+        assert usage['maxrss'] == 5
@@ -0,0 +1,205 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import brownthrower as bt
+
+from nose.plugins.skip import SkipTest
+from sqlalchemy import event
+
+from brownthrower import engine, session
+from brownthrower.examples.misc import Noop
+
+from testconfig import config # @UnresolvedImport
+
+def _chain(size):
+    jobs = []
+    for _ in range(size):
+        job = Noop.create_job()
+        if jobs:
+            job.parents.add(jobs[-1])
+        jobs.append(job)
+    return jobs
+
+def _finish(job):
+    job._start('token')
+    job._finish('token', {'status' : bt.Job.Status.DONE})
+
+class TestRunnableJobs(object):
+    def setup(self):
+        self.session  = bt.session_maker('sqlite://', initialize_db=True)()
+        self.runnable = []
+        event.listen(self.session, 'after_flush', self._after_flush)
+    
+    def teardown(self):
+        self.session.rollback()
+        self.session.close()
+    
+    def _after_flush(self, s, flush_context):
+        self.runnable.extend(tuple(row) for row in session._runnable_jobs(s))
+    
+    def _flush(self):
+        """\
+        Return the runnable jobs found since the last call, including those of
+        the autoflushes.
+        """
+        self.session.flush()
+        runnable = sorted(self.runnable)
+        del self.runnable[:]
+        return runnable
+    
+    def test_submit(self):
+        jobs = _chain(3) + [Noop.create_job()]
+        self.session.add_all(jobs)
+        self._flush()
+        
+        for job in jobs:
+            job.submit()
+        assert self._flush() == [(jobs[0].id, 'noop'), (jobs[3].id, 'noop')]
+    
+    def test_finish(self):
+        jobs = _chain(3)
+        self.session.add_all(jobs)
+        self._flush()
+        for job in jobs:
+            job.submit()
+        self._flush()
+        
+        _finish(jobs[0])
+        assert self._flush() == [(jobs[1].id, 'noop')]
+    
+    def test_other_parents(self):
+        parents = [Noop.create_job(), Noop.create_job()]
+        child = Noop.create_job()
+        child.parents |= set(parents)
+        self.session.add_all(parents + [child])
+        self._flush()
+        for job in parents + [child]:
+            job.submit()
+        self._flush()
+        
+        _finish(parents[0])
+        assert self._flush() == []
+        _finish(parents[1])
+        assert self._flush() == [(child.id, 'noop')]
+
+class PostgreSQLTest(object):
+    """\
+    Send notifications through the PostgreSQL database given in the settings.
+    """
+    
+    def setup(self):
+        url = config.get('database', {}).get('url', 'sqlite:///')
+        if not url.startswith('postgresql'):
+            raise SkipTest("Notifications are only supported in PostgreSQL.")
+        
+        self.session_maker = bt.session_maker(url, initialize_db=True)
+        self.notifications = bt.Notifications(self.session_maker)
+        self.ids           = []
+    
+    def teardown(self):
+        self.notifications.close()
+        with bt.transactional_session(self.session_maker) as s:
+            for model, column in [
+                (bt.Dependency, bt.Dependency.child_id),
+                (bt.Tag,        bt.Tag.job_id),
+                (bt.Job,        bt.Job.id),
+            ]:
+                s.query(model).filter(column.in_(self.ids)).delete(synchronize_session=False)
+        self.session_maker.remove()
+    
+    def _received(self, channel):
+        """\
+        Return the items received in a channel, by notification.
+        """
+        self.notifications.conn.poll()
+        return [
+            engine.decode(notify.payload)
+            for notify in self.notifications.conn.notifies
+            if notify.channel == channel
+        ]
+    
+    def _submit(self, jobs):
+        with bt.transactional_session(self.session_maker) as s:
+            s.add_all(jobs)
+            s.flush()
+            for job in jobs:
+                job.submit()
+            self.ids.extend(job.id for job in jobs)
+
+class TestRunnableChannel(PostgreSQLTest):
+    def test_submit(self):
+        channel = self.notifications.channel
+        self.notifications.listen([
+            channel.job_runnable,
+            channel.for_task(channel.job_runnable, 'noop'),
+            channel.for_task(channel.job_runnable, 'other'),
+        ])
+        
+        jobs = _chain(2)
+        self._submit(jobs)
+        
+        expected = [[[self.ids[0], 'noop']]]
+        assert self._received(channel.job_runnable) == expected
+        assert self._received(channel.for_task(channel.job_runnable, 'noop')) == expected
+        assert self._received(channel.for_task(channel.job_runnable, 'other')) == []
+
+class TestCoalescing(PostgreSQLTest):
+    def test_transaction(self):
+        channel = self.notifications.channel
+        self.notifications.listen([channel.job_create, channel.job_update])
+        
+        jobs = [Noop.create_job(), Noop.create_job()]
+        with bt.transactional_session(self.session_maker) as s:
+            s.add_all(jobs)
+            s.flush()
+            self.ids.extend(job.id for job in jobs)
+            for job in jobs:
+                job.submit()
+                s.flush()
+            jobs[0].description = 'changed'
+        
+        # Several flushes send a single notification per channel
+        assert self._received(channel.job_create) == [self.ids]
+        assert self._received(channel.job_update) == [self.ids]
+    
+    def test_savepoint(self):
+        channel = self.notifications.channel
+        self.notifications.listen([channel.job_create])
+        
+        with bt.transactional_session(self.session_maker) as s:
+            kept = Noop.create_job()
+            s.add(kept)
+            s.flush()
+            
+            # Released savepoints are notified with their transaction
+            with s.begin_nested():
+                released = Noop.create_job()
+                s.add(released)
+            assert self._received(channel.job_create) == []
+            
+            savepoint = s.begin_nested()
+            dropped = Noop.create_job()
+            s.add(dropped)
+            s.flush()
+            savepoint.rollback()
+            
+            self.ids.extend([kept.id, released.id])
+        
+        assert self._received(channel.job_create) == [self.ids]
+    
+    def test_many_channels(self):
+        # More notifications than entries allowed in a SELECT list
+        channel = self.notifications.channel
+        names = ['task%d' % i for i in range(2000)]
+        self.notifications.listen([
+            channel.for_task(channel.job_update, names[0]),
+            channel.for_task(channel.job_update, names[-1]),
+        ])
+        
+        with bt.transactional_session(self.session_maker) as s:
+            pending = session._pending_notifications(s, s.transaction)
+            for i, name in enumerate(names):
+                pending[('job_update', name)][i] = None
+        
+        assert self._received(channel.for_task(channel.job_update, names[0])) == [[0]]
+        assert self._received(channel.for_task(channel.job_update, names[-1])) == [[1999]]
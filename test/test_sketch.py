@@ -0,0 +1,57 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+
+from nose.tools import raises
+from brownthrower.sketch import QuantileSketch
+
+class TestQuantileSketch(object):
+    def test_empty(self):
+        s = QuantileSketch()
+        assert len(s) == 0
+        assert s.quantile(0.5) is None
+    
+    def test_accuracy(self):
+        values = [random.uniform(0.1, 1000) for _ in range(1000)]
+        s = QuantileSketch(accuracy=0.01)
+        for value in values:
+            s.add(value)
+        
+        values.sort()
+        for q in [0.0, 0.25, 0.5, 0.9, 0.99, 1.0]:
+            expected = values[int(q * (len(values) - 1))]
+            assert abs(s.quantile(q) - expected) <= 0.01 * expected
+    
+    def test_zero(self):
+        s = QuantileSketch()
+        s.add(0)
+        s.add(0)
+        s.add(10)
+        assert s.quantile(0.5) == 0.0
+    
+    def test_merge(self):
+        s1 = QuantileSketch()
+        s2 = QuantileSketch()
+        for value in range(1, 51):
+            s1.add(value)
+        for value in range(51, 101):
+            s2.add(value)
+        s1.merge(s2)
+        
+        assert len(s1) == 100
+        assert abs(s1.quantile(0.99) - 99) <= 0.99
+    
+    @raises(ValueError)
+    def test_merge_incompatible(self):
+        QuantileSketch(accuracy=0.01).merge(QuantileSketch(accuracy=0.05))
+    
+    def test_serialization(self):
+        s1 = QuantileSketch()
+        for value in [0, 0.5, 1, 2, 300]:
+            s1.add(value)
+        s2 = QuantileSketch.loads(s1.dumps())
+        
+        assert len(s2) == len(s1)
+        for q in [0.0, 0.5, 1.0]:
+            assert s1.quantile(q) == s2.quantile(q)
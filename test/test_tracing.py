@@ -0,0 +1,51 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import tempfile
+
+from brownthrower import tracing
+
+class TestTracing(object):
+    def setup(self):
+        fd, self._path = tempfile.mkstemp()
+        os.close(fd)
+        tracing.enable(self._path)
+    
+    def teardown(self):
+        os.close(tracing._fd)
+        tracing._fd = None
+        os.unlink(self._path)
+    
+    def _spans(self):
+        with open(self._path) as f:
+            return dict((span['name'], span) for span in map(json.loads, f))
+    
+    def test_nested(self):
+        with tracing.span('outer', job_id=1):
+            with tracing.span('inner'):
+                pass
+        
+        spans = self._spans()
+        assert spans['inner']['traceId']      == spans['outer']['traceId']
+        assert spans['inner']['parentSpanId'] == spans['outer']['spanId']
+        assert spans['outer']['parentSpanId'] is None
+        assert spans['outer']['attributes']['job_id'] == 1
+    
+    def test_record(self):
+        tracing.record('spawn', 1.0, 3.0)
+        span = self._spans()['spawn']
+        assert span['endTimeUnixNano'] - span['startTimeUnixNano'] == 2 * 10**9
+
+class TestSummary(object):
+    def test_percentiles(self):
+        lines = [
+            json.dumps({'name' : 'run', 'startTimeUnixNano' : 0, 'endTimeUnixNano' : i * 10**9})
+            for i in range(1, 101)
+        ] + ['garbage\n']
+        
+        [row] = tracing.summary(lines)
+        assert row[0:2] == ['run', 100]
+        assert row[2]   == 50.5
+        assert row[3:]  == [51, 91, 100, 100]